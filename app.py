@@ -1,63 +1,158 @@
 import streamlit as st
 import tempfile
 import os
+import io
+import mmap
+import hashlib
 import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
 import re
 import openai
 
+from audio_analysis import analyze_audio, merge_analysis
+from audio_utils import EXTENSION_FORMATS, ValidationStats, validate_audio
+from local_transcriber import local_transcriber
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# バックグラウンドジョブ設定
+PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', '2'))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '1'))
+JOB_HISTORY_LIMIT = int(os.environ.get('JOB_HISTORY_LIMIT', '100'))
+
+# ジョブ用一時領域（これより大きい音声はメモリではなく一時ディスクに置く）
+SPOOL_MAX_MEMORY_MB = float(os.environ.get('SPOOL_MAX_MEMORY_MB', '8'))
+
+# Whisper API料金（音声1分あたりのドル）と、受け付ける未処理音声の合計上限（分）
+WHISPER_COST_PER_MINUTE = 0.006
+MAX_BACKLOG_AUDIO_MINUTES = float(os.environ.get('MAX_BACKLOG_AUDIO_MINUTES', '240'))
+
+# 文字起こしのタイムアウト（固定分 + 音声1秒あたりの許容秒数）
+TRANSCRIBE_TIMEOUT_BASE_SECONDS = float(os.environ.get('TRANSCRIBE_TIMEOUT_BASE_SECONDS', '60'))
+TRANSCRIBE_TIMEOUT_PER_AUDIO_SECOND = float(os.environ.get('TRANSCRIBE_TIMEOUT_PER_AUDIO_SECOND', '0.5'))
+
+# 文字起こしの経路（api: OpenAI Whisper API / local: faster-whisper の int8 量子化モデルでCPU推論）
+TRANSCRIBE_BACKEND = os.environ.get('TRANSCRIBE_BACKEND', 'api')
+# APIが使えないとき（キー未設定・25MB超過・レート制限・タイムアウト・障害）にローカルで文字起こしする
+# （faster-whisper が必要なので既定では無効。有効にするには LOCAL_TRANSCRIBE_FALLBACK=1）
+LOCAL_TRANSCRIBE_FALLBACK = os.environ.get('LOCAL_TRANSCRIBE_FALLBACK', '0') == '1'
+# Whisper APIに送れるファイルサイズの上限
+API_MAX_FILE_SIZE = 25 * 1024 * 1024
+# 文字起こし中の進捗表示（実際に使った経路ごと）
+TRANSCRIBE_STAGE_LABELS = {
+    'api': "🎤 OpenAI Whisper APIで文字起こし中",
+    'local': "🎤 ローカルモデル（faster-whisper）で文字起こし中"
+}
+
+class _BufferReader(io.RawIOBase):
+    """アップロード済みバッファを複製せずに読み出すファイル風オブジェクト"""
+    
+    def __init__(self, buffer, name: str):
+        self.view = memoryview(buffer)
+        self.name = name
+        self.position = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, min(len(self.view), base + offset))
+        return self.position
+    
+    def read(self, size: int = -1):
+        # bytes ではなく memoryview のスライスを返し、全体読み込みでも複製しない
+        end = len(self.view) if size is None or size < 0 else min(len(self.view), self.position + size)
+        chunk = self.view[self.position:end]
+        self.position = end
+        return chunk
+    
+    def readinto(self, buffer) -> int:
+        # io.BufferedReader で包んだとき（bytes しか受け付けない読み手向け）に使われる
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+    
+    def close(self):
+        # 元のバッファを解放できるようエクスポートを解除
+        if not self.closed:
+            self.view.release()
+        super().close()
+
 class AudioProcessor:
     """音声処理クラス（OpenAI API版）"""
     
     def __init__(self):
-        # OpenAI APIキーを設定
-        self.api_key = st.secrets.get("OPENAI_API_KEY", "")
+        # OpenAI APIキーを設定（secrets.toml がない環境では環境変数を使用）
+        try:
+            self.api_key = st.secrets.get("OPENAI_API_KEY", "")
+        except FileNotFoundError:
+            self.api_key = os.environ.get("OPENAI_API_KEY", "")
         if self.api_key:
             openai.api_key = self.api_key
     
-    def transcribe_audio(self, audio_path: str) -> Dict[str, any]:
-        """OpenAI Whisper APIを使用して音声を文字起こし"""
+    def transcribe_audio(self, audio_path: str, timeout: Optional[float] = None) -> Dict[str, any]:
+        """OpenAI Whisper APIを使用して音声ファイルを文字起こし"""
+        # ファイルの存在確認
+        if not os.path.exists(audio_path):
+            return {
+                "success": False,
+                "error": f"音声ファイルが見つかりません: {audio_path}"
+            }
+        
+        with open(audio_path, "rb") as audio_file:
+            return self._transcribe(audio_file, os.path.getsize(audio_path), audio_path, timeout)
+    
+    def transcribe_buffer(self, buffer, filename: str, timeout: Optional[float] = None, on_backend=None) -> Dict[str, any]:
+        """アップロード済みバッファを一時ファイルを経由せずに文字起こし（memoryviewで複製しない）"""
+        with _BufferReader(buffer, filename) as reader:
+            return self._transcribe(reader, len(reader.view), filename, timeout, on_backend)
+    
+    def local_available(self) -> bool:
+        """ローカルモデルで文字起こしできるか（経路が local、またはフォールバックが有効）"""
+        return (TRANSCRIBE_BACKEND == 'local' or LOCAL_TRANSCRIBE_FALLBACK) and local_transcriber.available()
+    
+    def _transcribe(self, audio_file, file_size: int, source: str, timeout: Optional[float] = None,
+                    on_backend=None) -> Dict[str, any]:
+        """OpenAI Whisper APIを使用して音声を文字起こし（on_backend: 実際に使う経路 api / local を通知）"""
+        if TRANSCRIBE_BACKEND == 'local':
+            return self._transcribe_local(audio_file, source, on_backend)
+        
         try:
-            logger.info(f"OpenAI Whisper APIで音声文字起こし開始: {audio_path}")
+            logger.info(f"OpenAI Whisper APIで音声文字起こし開始: {source}")
             
             # APIキーの確認
             if not self.api_key:
-                return {
+                return self._fallback_local(audio_file, source, on_backend, {
                     "success": False,
                     "error": "OpenAI APIキーが設定されていません。"
-                }
-            
-            # ファイルの存在確認
-            if not os.path.exists(audio_path):
-                return {
-                    "success": False,
-                    "error": f"音声ファイルが見つかりません: {audio_path}"
-                }
+                })
             
             # ファイルサイズを確認（25MB制限）
-            file_size = os.path.getsize(audio_path)
-            max_size = 25 * 1024 * 1024  # 25MB
-            
-            if file_size > max_size:
-                return {
+            if file_size > API_MAX_FILE_SIZE:
+                return self._fallback_local(audio_file, source, on_backend, {
                     "success": False,
                     "error": f"ファイルサイズが大きすぎます。25MB以下にしてください。現在のサイズ: {file_size / 1024 / 1024:.1f}MB"
-                }
+                })
             
             logger.info(f"音声ファイルサイズ: {file_size / 1024 / 1024:.1f}MB")
             
             # OpenAI Whisper APIで文字起こし実行
-            with open(audio_path, "rb") as audio_file:
-                transcript = openai.Audio.transcribe(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="ja"
-                )
+            if on_backend:
+                on_backend('api')
+            transcript = self._request_transcription(audio_file, timeout)
             
             transcription_text = transcript.text
             
@@ -83,22 +178,71 @@ class AudioProcessor:
             }
         except openai.error.RateLimitError:
             logger.error("OpenAI APIレート制限エラー")
-            return {
+            return self._fallback_local(audio_file, source, on_backend, {
                 "success": False,
                 "error": "APIの使用制限に達しました。しばらく待ってから再試行してください。"
-            }
-        except openai.error.APIError as e:
+            })
+        except openai.error.Timeout:
+            logger.error(f"OpenAI APIタイムアウト: {timeout}秒")
+            return self._fallback_local(audio_file, source, on_backend, {
+                "success": False,
+                "error": f"文字起こしがタイムアウトしました（上限 {timeout:.0f}秒）。時間をおいて再試行してください。"
+            })
+        except (openai.error.APIError, openai.error.APIConnectionError, openai.error.ServiceUnavailableError) as e:
             logger.error(f"OpenAI APIエラー: {str(e)}")
-            return {
+            return self._fallback_local(audio_file, source, on_backend, {
                 "success": False,
                 "error": f"OpenAI APIエラー: {str(e)}"
-            }
+            })
         except Exception as e:
             logger.error(f"音声文字起こしエラー: {str(e)}")
             return {
                 "success": False,
                 "error": f"予期しないエラー: {str(e)}"
             }
+    
+    def _transcribe_local(self, audio_file, source: str, on_backend=None) -> Dict[str, any]:
+        """faster-whisper（int8 量子化モデル）でCPU上で文字起こし"""
+        if on_backend:
+            on_backend('local')
+        logger.info(f"ローカルモデルで音声文字起こし開始: {source}（{local_transcriber.describe()}）")
+        audio_file.seek(0)
+        # PyAV は read() に bytes を要求するため、バッファ単位でだけ複製する読み手で包む
+        if isinstance(audio_file, _BufferReader):
+            audio_file = io.BufferedReader(audio_file)
+        return local_transcriber.transcribe(audio_file)
+    
+    def _fallback_local(self, audio_file, source: str, on_backend, failure: Dict[str, any]) -> Dict[str, any]:
+        """APIで文字起こしできなかったとき、ローカルモデルが使えればそちらで文字起こし"""
+        if not (LOCAL_TRANSCRIBE_FALLBACK and local_transcriber.available()):
+            return failure
+        logger.warning(f"Whisper APIが使えないためローカルモデルで文字起こしします: {failure['error']}")
+        result = self._transcribe_local(audio_file, source, on_backend)
+        if not result["success"]:
+            result["error"] = f"{failure['error']}（ローカル文字起こしも失敗: {result['error']}）"
+        return result
+    
+    def _request_transcription(self, audio_file, timeout: Optional[float]):
+        """Whisper APIへリクエスト（音声の長さに応じたタイムアウトを指定）"""
+        if timeout is None:
+            return openai.Audio.transcribe(
+                model="whisper-1",
+                file=audio_file,
+                language="ja"
+            )
+        
+        # openai 0.28 の Audio.transcribe は request_timeout を受け取らないため、同じ手順で送信する
+        requestor, files, data = openai.Audio._prepare_request(
+            file=audio_file,
+            filename=audio_file.name,
+            model="whisper-1",
+            language="ja"
+        )
+        response, _, api_key = requestor.request(
+            "post", openai.Audio._get_url("transcriptions"),
+            files=files, params=data, request_timeout=timeout
+        )
+        return openai.util.convert_to_openai_object(response, api_key)
 
 class SuperImprovedArticleGenerator:
     """超改良版記事生成クラス（まるつー風プロ仕様・重複除去版）"""
@@ -460,12 +604,199 @@ class SuperImprovedArticleGenerator:
             return match.group(1) + "年"
         return ""
 
+class TranscriptionError(Exception):
+    """文字起こし失敗（失敗結果を st.cache_data にキャッシュさせないために送出）"""
+
+@st.cache_resource
+def get_audio_processor() -> AudioProcessor:
+    """音声処理クラスをプロセス内で1つだけ作成"""
+    return AudioProcessor()
+
+@st.cache_resource
+def get_article_generator() -> SuperImprovedArticleGenerator:
+    """記事生成クラスをプロセス内で1つだけ作成"""
+    return SuperImprovedArticleGenerator()
+
+def spool_upload(uploaded_file) -> tempfile.SpooledTemporaryFile:
+    """アップロードをジョブ専用の一時領域へ複製（小さい音声はメモリ、大きい音声は一時ディスク）"""
+    max_size = int(SPOOL_MAX_MEMORY_MB * 1024 * 1024)
+    spool = tempfile.SpooledTemporaryFile(
+        max_size=max_size,
+        prefix="audio_",
+        suffix=os.path.splitext(uploaded_file.name)[1]
+    )
+    try:
+        if uploaded_file.size > max_size:
+            # メモリに溜めてから書き出すと一時的に2倍になるため先にディスクへ切り替え
+            spool.rollover()
+        spool.write(uploaded_file.getbuffer())
+        spool.flush()
+    except Exception:
+        spool.close()
+        raise
+    return spool
+
+@contextmanager
+def spool_view(spool: tempfile.SpooledTemporaryFile):
+    """一時領域の内容を複製せずに参照（ディスク上なら mmap、メモリ上ならバッファ）"""
+    # _rolled / _file は SpooledTemporaryFile が保持する実体（ディスク移行済みか、BytesIO か）
+    if spool._rolled:
+        mapped = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+    else:
+        mapped = None
+        view = spool._file.getbuffer()
+    try:
+        yield view
+    finally:
+        view.release()
+        if mapped is not None:
+            mapped.close()
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def transcribe_audio_cached(file_hash: str, _app: 'SuperImprovedApp', _spool, _filename: str, _timeout: Optional[float] = None,
+                            _on_backend=None) -> Dict[str, any]:
+    """文字起こし結果を音声ファイルのハッシュ単位でキャッシュ（再実行でAPIを呼ばない）"""
+    # ジョブの一時領域をそのまま送信（複製・再読み込みをしない）
+    with spool_view(_spool) as view:
+        transcription_result = _app.audio_processor.transcribe_buffer(view, _filename, _timeout, _on_backend)
+    
+    if not transcription_result["success"]:
+        raise TranscriptionError(transcription_result["error"])
+    return transcription_result
+
+class PipelineJobManager:
+    """記事生成ジョブをプロセス全体で実行・管理（再実行やページ更新をまたいで継続）"""
+    
+    STATUS_LABELS = {
+        'queued': '順番待ち',
+        'running': '処理中',
+        'done': '完了',
+        'error': 'エラー'
+    }
+    
+    def __init__(self, max_workers: int = PIPELINE_WORKERS, history_limit: int = JOB_HISTORY_LIMIT):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline')
+        self.history_limit = history_limit
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+    
+    def submit(self, pipeline, *args, label: str = '', duration: Optional[float] = None) -> str:
+        """ジョブを登録してワーカーに投入し、ジョブIDを返す"""
+        job_id = uuid.uuid4().hex[:16]
+        with self.lock:
+            self.jobs[job_id] = {
+                'id': job_id,
+                'label': label,
+                'duration': duration,
+                'status': 'queued',
+                'stage': '順番待ち',
+                'result': None,
+                'error': None,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None
+            }
+            self._prune()
+        self.executor.submit(self._run, job_id, pipeline, args)
+        logger.info(f"ジョブを登録: {job_id} {label}")
+        return job_id
+    
+    def get(self, job_id: str) -> Optional[dict]:
+        """ジョブ状態のコピーを取得（存在しなければ None）"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+    
+    def update(self, job_id: str, **fields):
+        """ジョブ状態を更新"""
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+    
+    def _run(self, job_id: str, pipeline, args):
+        """ワーカースレッドでパイプラインを実行"""
+        self.update(job_id, status='running', started_at=time.time())
+        try:
+            result = pipeline(lambda stage: self.update(job_id, stage=stage), *args)
+        except Exception as e:
+            logger.error(f"ジョブ実行エラー ({job_id}): {str(e)}")
+            result = {"success": False, "error": f"予期しないエラー: {str(e)}"}
+        
+        if result["success"]:
+            self.update(job_id, status='done', stage='完了', result=result, finished_at=time.time())
+            logger.info(f"ジョブ完了: {job_id}")
+        else:
+            self.update(job_id, status='error', stage='エラー', error=result["error"], finished_at=time.time())
+    
+    def backlog_seconds(self) -> float:
+        """順番待ち・処理中ジョブの音声の合計秒数"""
+        with self.lock:
+            return sum(
+                job['duration'] or 0 for job in self.jobs.values()
+                if job['status'] in ('queued', 'running')
+            )
+    
+    def can_admit(self, duration: float, limit_minutes: float = MAX_BACKLOG_AUDIO_MINUTES) -> bool:
+        """未処理音声の合計が上限を超えないか（空いていれば上限を超える1件目は受け付ける）"""
+        backlog = self.backlog_seconds()
+        return backlog == 0 or backlog + duration <= limit_minutes * 60
+    
+    def _prune(self):
+        """終了済みジョブを古い順に削除して履歴数を制限"""
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ('done', 'error')]
+        for job_id in finished[:max(0, len(self.jobs) - self.history_limit)]:
+            del self.jobs[job_id]
+
+@st.cache_resource
+def get_job_manager() -> PipelineJobManager:
+    """ジョブ管理クラスをプロセス内で1つだけ作成"""
+    return PipelineJobManager()
+
+@st.cache_resource
+def get_validation_stats() -> ValidationStats:
+    """事前検証の集計をプロセス内で1つだけ作成"""
+    return ValidationStats()
+
 class SuperImprovedApp:
     """超改良版記事生成アプリ（OpenAI API版）"""
     
+    SHOP_CATEGORIES = [
+        "カフェ", "レストラン", "居酒屋", "ラーメン店", "うどん店", "そば店", 
+        "焼肉店", "寿司店", "中華料理店", "イタリアン", "フレンチ", "和食店",
+        "ファストフード", "スイーツ店", "ベーカリー", "ショップ", "美容院",
+        "理容店", "エステサロン", "ネイルサロン", "マッサージ店", "整体院",
+        "病院", "クリニック", "薬局", "ホテル", "旅館", "民宿", "ゲストハウス",
+        "スーパー", "コンビニ", "書店", "雑貨店", "洋服店", "靴店", "家電店",
+        "車販売店", "ガソリンスタンド", "銀行", "郵便局", "学習塾", "習い事教室",
+        "フィットネスジム", "娯楽施設", "その他"
+    ]
+    
+    SHOP_LOCATIONS = [
+        "高松市", "丸亀市", "坂出市", "善通寺市", "観音寺市", "さぬき市", "東かがわ市",
+        "三豊市", "土庄町", "小豆島町", "三木町", "直島町", "宇多津町", "綾川町",
+        "琴平町", "多度津町", "まんのう町", "その他中讃地域", "その他西讃地域",
+        "その他東讃地域", "その他小豆地域"
+    ]
+    
+    INTERVIEWEE_TITLES = [
+        "店長", "オーナー", "副店長", "マネージャー", "スタッフ", "代表", "取締役", "その他"
+    ]
+    
+    # ファイル別フォームで「共通設定を使う」を表す選択肢
+    USE_COMMON = "（共通設定）"
+    
+    # 店舗情報フォームの項目（ウィジェットのキーは shop_<項目名>）
+    SHOP_FIELDS = [
+        'name', 'category', 'location', 'address', 'phone', 'hours', 'holiday', 'notes',
+        'interviewee_name', 'interviewee_title'
+    ]
+    
     def __init__(self):
-        self.audio_processor = AudioProcessor()
-        self.article_generator = SuperImprovedArticleGenerator()
+        self.audio_processor = get_audio_processor()
+        self.article_generator = get_article_generator()
+        self.job_manager = get_job_manager()
+        self.validation_stats = get_validation_stats()
     
     def run(self):
         """アプリケーションのメイン実行"""
@@ -512,6 +843,34 @@ class SuperImprovedApp:
         st.markdown('<h1 class="main-header">📰 まるつー記事生成システム</h1>', unsafe_allow_html=True)
         st.markdown("---")
         
+        with self._measure_rerun('page'):
+            self._render_page()
+    
+    @contextmanager
+    def _measure_rerun(self, section: str):
+        """再実行にかかった時間を区間ごとに記録"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            st.session_state.setdefault('rerun_timings', {})[section] = elapsed_ms
+            logger.debug(f"再実行時間 {section}: {elapsed_ms:.1f}ms")
+    
+    def _render_page(self):
+        """ページ全体の描画（フォーム・アップロード・結果はそれぞれ部分再実行）"""
+        # 実行中・実行済みジョブ（ページ更新後は URL の job パラメータから再接続）
+        requested_ids = st.session_state.get('job_ids') or st.query_params.get_all('job')
+        jobs = [job for job in map(self.job_manager.get, requested_ids) if job]
+        if len(jobs) < len(requested_ids):
+            st.warning("⚠️ 以前のジョブの一部が見つかりません（サーバー再起動などで破棄されました）。")
+            if jobs:
+                st.query_params['job'] = [job['id'] for job in jobs]
+            else:
+                st.query_params.pop('job', None)
+        st.session_state.job_ids = [job['id'] for job in jobs]
+        st.session_state.processing_status = self._batch_status(jobs)
+        
         # サイドバー情報
         with st.sidebar:
             st.header("ℹ️ システム情報")
@@ -536,194 +895,367 @@ class SuperImprovedApp:
             
             st.markdown("---")
             st.header("⚡ 処理状況")
-            if 'processing_status' not in st.session_state:
-                st.session_state.processing_status = "待機中"
             st.write(f"**状態:** {st.session_state.processing_status}")
+            
+            validation = self.validation_stats.stats()
+            if validation['rejected']:
+                st.write(
+                    f"**事前検証:** {validation['rejected']}件"
+                    f"（{validation['rejected_bytes'] / 1024 / 1024:.1f}MB）を送信前に除外"
+                )
+            
+            with st.expander("⏱️ 直近の再実行時間"):
+                for section, elapsed_ms in st.session_state.get('rerun_timings', {}).items():
+                    st.write(f"- {section}: {elapsed_ms:.1f}ms")
         
-        # 店舗情報入力フォーム
-        st.header("📝 店舗情報を入力")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            shop_name = st.text_input("🏪 店舗名", placeholder="例: MARGINAL")
-            shop_category = st.selectbox("🏷️ 業種", [
-                "カフェ", "レストラン", "居酒屋", "ラーメン店", "うどん店", "そば店", 
-                "焼肉店", "寿司店", "中華料理店", "イタリアン", "フレンチ", "和食店",
-                "ファストフード", "スイーツ店", "ベーカリー", "ショップ", "美容院",
-                "理容店", "エステサロン", "ネイルサロン", "マッサージ店", "整体院",
-                "病院", "クリニック", "薬局", "ホテル", "旅館", "民宿", "ゲストハウス",
-                "スーパー", "コンビニ", "書店", "雑貨店", "洋服店", "靴店", "家電店",
-                "車販売店", "ガソリンスタンド", "銀行", "郵便局", "学習塾", "習い事教室",
-                "フィットネスジム", "娯楽施設", "その他"
-            ])
-            shop_address = st.text_input("📍 住所", placeholder="例: 香川県綾歌郡綾川町萱原822-1")
-            shop_phone = st.text_input("📞 電話番号", placeholder="例: 087-876-1234")
-        
-        with col2:
-            shop_location = st.selectbox("🌍 エリア（地域）", [
-                "高松市", "丸亀市", "坂出市", "善通寺市", "観音寺市", "さぬき市", "東かがわ市",
-                "三豊市", "土庄町", "小豆島町", "三木町", "直島町", "宇多津町", "綾川町",
-                "琴平町", "多度津町", "まんのう町", "その他中讃地域", "その他西讃地域",
-                "その他東讃地域", "その他小豆地域"
-            ])
-            shop_hours = st.text_input("🕐 営業時間", placeholder="例: 10:00-20:00")
-            shop_holiday = st.text_input("🗓️ 定休日", placeholder="例: 毎週火曜日")
-            shop_notes = st.text_area("📋 備考・特記事項", placeholder="例: 駐車場完備、Wi-Fi利用可能、テイクアウト対応")
-        
-        # 取材対応者情報の追加
-        st.subheader("👤 取材対応者情報")
-        col3, col4 = st.columns(2)
-        
-        with col3:
-            interviewee_name = st.text_input("👤 取材対応者のお名前", placeholder="例: 山田太郎")
-            interviewee_title = st.selectbox("👤 役職・立場", [
-                "店長", "オーナー", "副店長", "マネージャー", "スタッフ", "代表", "取締役", "その他"
-            ])
-        
-        with col4:
-            st.info("💡 取材対応者の情報を正確に入力することで、記事内での表記が正確になります。")
-        
-        # 音声ファイルアップロード
-        st.header("🎤 音声ファイルをアップロード")
-        
-        # ファイルサイズ制限の案内
-        st.info("📏 **ファイル制限:** 25MB以下 | **推奨時間:** 30分以内 | **対応形式:** MP3, WAV, M4A, FLAC, AAC")
-        
-        uploaded_file = st.file_uploader(
-            "インタビュー音声ファイルを選択してください",
-            type=['mp3', 'wav', 'm4a', 'flac', 'aac'],
-            help="OpenAI Whisper APIを使用して高精度な文字起こしを行います"
-        )
-        
-        # 音声処理と記事生成
-        if uploaded_file is not None:
-            # ファイルサイズチェック
-            file_size = len(uploaded_file.getbuffer())
-            file_size_mb = file_size / 1024 / 1024
+        self._render_shop_form()
+        self._render_upload_panel()
+        self._render_results()
+    
+    @st.fragment
+    def _render_shop_form(self):
+        """店舗情報入力フォーム（入力のたびにこの部分だけ再実行）"""
+        with self._measure_rerun('form'):
+            # 店舗情報入力フォーム
+            st.header("📝 店舗情報を入力")
             
-            st.write(f"📁 **アップロードファイル:** {uploaded_file.name}")
-            st.write(f"📊 **ファイルサイズ:** {file_size_mb:.1f}MB")
+            col1, col2 = st.columns(2)
             
-            if file_size_mb > 25:
-                st.error("❌ ファイルサイズが25MBを超えています。ファイルを圧縮するか、短く分割してください。")
-                return
+            with col1:
+                st.text_input("🏪 店舗名", placeholder="例: MARGINAL", key="shop_name")
+                st.selectbox("🏷️ 業種", self.SHOP_CATEGORIES, key="shop_category")
+                st.text_input("📍 住所", placeholder="例: 香川県綾歌郡綾川町萱原822-1", key="shop_address")
+                st.text_input("📞 電話番号", placeholder="例: 087-876-1234", key="shop_phone")
             
-            # 推定料金の表示
-            estimated_minutes = file_size_mb * 2  # 大まかな推定
-            estimated_cost = estimated_minutes * 0.006
-            st.info(f"💰 **推定料金:** 約${estimated_cost:.3f} (約{estimated_cost * 150:.1f}円)")
+            with col2:
+                st.selectbox("🌍 エリア（地域）", self.SHOP_LOCATIONS, key="shop_location")
+                st.text_input("🕐 営業時間", placeholder="例: 10:00-20:00", key="shop_hours")
+                st.text_input("🗓️ 定休日", placeholder="例: 毎週火曜日", key="shop_holiday")
+                st.text_area("📋 備考・特記事項", placeholder="例: 駐車場完備、Wi-Fi利用可能、テイクアウト対応", key="shop_notes")
             
-            # 必須項目チェック
-            if not shop_name or not interviewee_name:
-                st.error("❌ 店舗名と取材対応者のお名前は必須項目です。")
-                return
+            # 取材対応者情報の追加
+            st.subheader("👤 取材対応者情報")
+            col3, col4 = st.columns(2)
             
-            if st.button("🚀 記事を生成", type="primary"):
-                # 店舗情報をまとめる
-                shop_info = {
-                    'name': shop_name,
-                    'category': shop_category,
-                    'location': shop_location,
-                    'address': shop_address,
-                    'phone': shop_phone,
-                    'hours': shop_hours,
-                    'holiday': shop_holiday,
-                    'notes': shop_notes,
-                    'interviewee_name': interviewee_name,
-                    'interviewee_title': interviewee_title
-                }
-                
-                self._process_audio_and_generate_article(uploaded_file, shop_info)
-
-    def _save_temp_audio_file(self, uploaded_file) -> str:
-        """アップロードされた音声ファイルを一時保存"""
-        try:
-            # 一意なファイル名を生成
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_extension = uploaded_file.name.split('.')[-1]
-            temp_filename = f"audio_{timestamp}.{file_extension}"
-            temp_path = os.path.join(tempfile.gettempdir(), temp_filename)
+            with col3:
+                st.text_input("👤 取材対応者のお名前", placeholder="例: 山田太郎", key="shop_interviewee_name")
+                st.selectbox("👤 役職・立場", self.INTERVIEWEE_TITLES, key="shop_interviewee_title")
             
-            # ファイルを保存
-            with open(temp_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            with col4:
+                st.info("💡 取材対応者の情報を正確に入力することで、記事内での表記が正確になります。")
+    
+    def _common_shop_info(self) -> dict:
+        """共通の店舗情報（フォームのウィジェット状態から取得）"""
+        return {field: st.session_state.get(f"shop_{field}", '') for field in self.SHOP_FIELDS}
+    
+    @st.fragment
+    def _render_upload_panel(self):
+        """音声アップロードと料金表示（この部分だけ再実行）"""
+        with self._measure_rerun('upload'):
+            # 音声ファイルアップロード
+            st.header("🎤 音声ファイルをアップロード")
             
-            logger.info(f"音声ファイルを一時保存: {temp_path}")
-            return temp_path
+            # ファイルサイズ制限の案内
+            size_limit = "25MB超はローカルモデルで文字起こし" if self.audio_processor.local_available() else "1ファイル25MB以下"
+            st.info(f"📏 **ファイル制限:** {size_limit} | **推奨時間:** 30分以内 | **対応形式:** MP3, WAV, M4A, FLAC, AAC | 複数ファイルをまとめて選択できます")
             
-        except Exception as e:
-            logger.error(f"音声ファイル保存エラー: {str(e)}")
-            return None
-
-    def _process_audio_and_generate_article(self, uploaded_file, shop_info: dict):
-        """音声処理と記事生成のメイン処理（OpenAI API版）"""
-        # セッション状態に店舗情報を保存
-        st.session_state.current_shop_info = shop_info
-        st.session_state.processing_status = "処理中"
-        
-        with st.spinner("🎵 音声ファイルを処理中..."):
-            # 音声ファイルを保存
-            temp_audio_path = self._save_temp_audio_file(uploaded_file)
-            
-            if not temp_audio_path:
-                st.error("❌ 音声ファイルの保存に失敗しました。")
-                st.session_state.processing_status = "エラー"
-                return
+            uploaded_files = st.file_uploader(
+                "インタビュー音声ファイルを選択してください",
+                type=['mp3', 'wav', 'm4a', 'flac', 'aac'],
+                accept_multiple_files=True,
+                help="OpenAI Whisper APIを使用して高精度な文字起こしを行います"
+            )
             
-            st.success(f"✅ 音声ファイルを保存しました: {os.path.basename(temp_audio_path)}")
-        
-        with st.spinner("🎤 OpenAI Whisper APIで文字起こし中..."):
-            # 文字起こし実行
-            transcription_result = self.audio_processor.transcribe_audio(temp_audio_path)
+            # 音声処理と記事生成
+            if uploaded_files:
+                self._render_upload(uploaded_files, self._common_shop_info())
+    
+    @st.fragment
+    def _render_results(self):
+        """ジョブの進捗・結果表示（ダウンロード等ではこの部分だけ再実行）"""
+        with self._measure_rerun('results'):
+            if st.session_state.job_ids:
+                self._render_jobs(st.session_state.job_ids)
+    
+    def _render_upload(self, uploaded_files: list, shop_info: dict):
+        """アップロードファイルの確認とジョブ投入"""
+        multiple = len(uploaded_files) > 1
+        entries = []
+        total_minutes = 0
+        
+        for uploaded_file in uploaded_files:
+            # ファイルサイズチェック（バッファに触れずに取得）
+            file_size_mb = uploaded_file.size / 1024 / 1024
             
-            if not transcription_result["success"]:
-                st.error(f"❌ 文字起こしに失敗しました: {transcription_result['error']}")
-                st.session_state.processing_status = "エラー"
-                
-                # 一時ファイルをクリーンアップ
-                try:
-                    os.unlink(temp_audio_path)
-                except:
-                    pass
-                return
+            st.write(f"📁 **アップロードファイル:** {uploaded_file.name}（{file_size_mb:.1f}MB）")
+            
+            if uploaded_file.size > API_MAX_FILE_SIZE and TRANSCRIBE_BACKEND != 'local':
+                if not self.audio_processor.local_available():
+                    st.error(f"❌ {uploaded_file.name}: ファイルサイズが25MBを超えています。ファイルを圧縮するか、短く分割してください。")
+                    continue
+                st.info(f"ℹ️ {uploaded_file.name}: 25MBを超えるためローカルモデルで文字起こしします")
             
-            transcription_text = transcription_result["text"]
-            st.success("✅ 文字起こしが完了しました！")
+            # 形式・構造の事前検証（壊れたファイルはAPIに送らない）
+            validation = self._inspect_upload(uploaded_file)
+            if not validation['valid']:
+                st.error(f"❌ {uploaded_file.name}: {'、'.join(validation['errors'])}（文字起こし前に除外しました）")
+                continue
+            for warning in validation['warnings']:
+                st.warning(f"⚠️ {uploaded_file.name}: {warning}")
             
-            # 文字起こし結果を表示
-            with st.expander("📝 文字起こし結果を確認", expanded=False):
-                st.text_area("文字起こし内容", transcription_text, height=200)
-                st.info(f"📊 文字数: {len(transcription_text)} 文字")
+            # ヘッダーから再生時間を取得（解析できない形式はサイズから大まかに推定）
+            duration = validation['duration']
+            if duration is not None:
+                st.write(f"⏱️ **再生時間:** {int(duration // 60)}分{int(duration % 60):02d}秒")
+                total_minutes += duration / 60
+            else:
+                st.write("⏱️ **再生時間:** ヘッダーから取得できませんでした（サイズから推定）")
+                total_minutes += file_size_mb * 2
+            
+            # 複数ファイルの場合はファイルごとに店舗情報を指定（空欄は共通設定）
+            file_shop_info = self._render_file_shop_form(uploaded_file, shop_info) if multiple else shop_info
+            
+            entries.append((uploaded_file, file_shop_info, validation))
+        
+        if not entries:
+            return
         
-        with st.spinner("📰 記事を生成中..."):
-            # 記事生成
-            article_result = self.article_generator.generate_article(transcription_text, shop_info)
+        # 推定料金の表示
+        estimated_cost = total_minutes * WHISPER_COST_PER_MINUTE
+        st.info(f"💰 **推定料金（{len(entries)}件・{total_minutes:.1f}分）:** 約${estimated_cost:.3f} (約{estimated_cost * 150:.1f}円)")
+        
+        label = f"🚀 {len(entries)}件の記事を生成" if multiple else "🚀 記事を生成"
+        if st.button(label, type="primary"):
+            # 必須項目チェック（フォームは別に再実行されるため押下時に確認）
+            missing = [
+                uploaded_file.name for uploaded_file, file_shop_info, _ in entries
+                if not file_shop_info['name'] or not file_shop_info['interviewee_name']
+            ]
+            if missing:
+                st.error(f"❌ 店舗名と取材対応者のお名前は必須項目です: {', '.join(missing)}")
+                return
             
-            if not article_result["success"]:
-                st.error(f"❌ 記事生成に失敗しました: {article_result['error']}")
-                st.session_state.processing_status = "エラー"
-                
-                # 一時ファイルをクリーンアップ
-                try:
-                    os.unlink(temp_audio_path)
-                except:
-                    pass
+            # 受付制御（未処理の音声が多すぎる場合は投入しない）
+            if not self.job_manager.can_admit(total_minutes * 60):
+                backlog_minutes = self.job_manager.backlog_seconds() / 60
+                st.error(f"❌ 現在混み合っています（処理待ちの音声 {backlog_minutes:.0f}分）。しばらく待ってから再度お試しください。")
                 return
+            
+            # セッション状態に店舗情報を保存
+            st.session_state.current_shop_info = entries[0][1]
+            job_ids = [
+                self.job_manager.submit(
+                    self._run_pipeline, spool_upload(uploaded_file), self._transcription_filename(uploaded_file, validation),
+                    self._file_hash(uploaded_file), file_shop_info, validation['duration'],
+                    label=uploaded_file.name, duration=validation['duration']
+                )
+                for uploaded_file, file_shop_info, validation in entries
+            ]
+            st.session_state.job_ids = job_ids
+            st.query_params['job'] = job_ids
+            # 結果表示とサイドバーを更新するためページ全体を再実行
+            st.rerun()
+    
+    def _render_file_shop_form(self, uploaded_file, common: dict) -> dict:
+        """ファイルごとの店舗情報フォーム（空欄・共通設定の項目は共通の値を使用）"""
+        key = f"file_{getattr(uploaded_file, 'file_id', None) or uploaded_file.name}"
+        with st.expander(f"🏪 {uploaded_file.name} の店舗情報（空欄は共通設定を使用）"):
+            col1, col2 = st.columns(2)
+            with col1:
+                overrides = {
+                    'name': st.text_input("🏪 店舗名", key=f"{key}_name", placeholder=common['name']),
+                    'category': st.selectbox("🏷️ 業種", [self.USE_COMMON] + self.SHOP_CATEGORIES, key=f"{key}_category"),
+                    'address': st.text_input("📍 住所", key=f"{key}_address", placeholder=common['address']),
+                    'phone': st.text_input("📞 電話番号", key=f"{key}_phone", placeholder=common['phone']),
+                    'interviewee_name': st.text_input("👤 取材対応者のお名前", key=f"{key}_interviewee_name", placeholder=common['interviewee_name']),
+                }
+            with col2:
+                overrides.update({
+                    'location': st.selectbox("🌍 エリア（地域）", [self.USE_COMMON] + self.SHOP_LOCATIONS, key=f"{key}_location"),
+                    'hours': st.text_input("🕐 営業時間", key=f"{key}_hours", placeholder=common['hours']),
+                    'holiday': st.text_input("🗓️ 定休日", key=f"{key}_holiday", placeholder=common['holiday']),
+                    'notes': st.text_input("📋 備考・特記事項", key=f"{key}_notes", placeholder=common['notes']),
+                    'interviewee_title': st.selectbox("👤 役職・立場", [self.USE_COMMON] + self.INTERVIEWEE_TITLES, key=f"{key}_interviewee_title"),
+                })
+        
+        return {
+            field: value if value and value != self.USE_COMMON else common[field]
+            for field, value in overrides.items()
+        }
+    
+    def _batch_status(self, jobs: list) -> str:
+        """ジョブ群の状態をサイドバー表示用にまとめる"""
+        if not jobs:
+            return "待機中"
+        if len(jobs) == 1:
+            return PipelineJobManager.STATUS_LABELS[jobs[0]['status']]
+        finished = sum(1 for job in jobs if job['status'] in ('done', 'error'))
+        if finished < len(jobs):
+            return f"処理中（{finished}/{len(jobs)}件完了）"
+        errors = sum(1 for job in jobs if job['status'] == 'error')
+        return f"完了（エラー{errors}件）" if errors else "完了"
+    
+    def _render_jobs(self, job_ids: list):
+        """ジョブの状態に応じて進捗表示または結果表示"""
+        jobs = [job for job in map(self.job_manager.get, job_ids) if job]
+        if not jobs:
+            return
         
-        # 記事生成成功
-        st.session_state.processing_status = "完了"
-        self._display_article_results(article_result, shop_info, transcription_text)
+        if any(job['status'] in ('queued', 'running') for job in jobs):
+            self._poll_jobs(job_ids)
+            return
         
-        # 一時ファイルをクリーンアップ
-        try:
-            os.unlink(temp_audio_path)
-            logger.info(f"一時ファイルを削除: {temp_audio_path}")
-        except Exception as e:
-            logger.warning(f"一時ファイル削除エラー: {e}")
+        if len(jobs) > 1:
+            self._render_batch_table(jobs)
+            done_jobs = [job for job in jobs if job['status'] == 'done']
+            if not done_jobs:
+                return
+            selected = st.selectbox(
+                "📰 表示する記事",
+                done_jobs,
+                format_func=lambda job: f"{job['label']} - {job['result']['shop_info']['name']}"
+            )
+            self._display_article_results(
+                selected['result']['article_result'],
+                selected['result']['shop_info'],
+                selected['result']['transcription_text']
+            )
+            return
+        
+        job = jobs[0]
+        if job['status'] == 'error':
+            st.error(f"❌ {job['error']}")
+        else:
+            result = job['result']
+            st.success(f"✅ 記事生成が完了しました（処理時間: {job['finished_at'] - job['started_at']:.1f}秒）")
+            self._display_article_results(
+                result['article_result'],
+                result['shop_info'],
+                result['transcription_text']
+            )
+    
+    @st.fragment(run_every=JOB_POLL_SECONDS)
+    def _poll_jobs(self, job_ids: list):
+        """実行中のジョブを定期的に確認（この部分だけ再実行）"""
+        jobs = [job for job in map(self.job_manager.get, job_ids) if job]
+        if not any(job['status'] in ('queued', 'running') for job in jobs):
+            # 全て終了したらページ全体を再描画して結果を表示
+            st.rerun()
+        
+        if len(jobs) > 1:
+            self._render_batch_table(jobs)
+            return
+        
+        job = jobs[0]
+        elapsed = time.time() - (job['started_at'] or job['submitted_at'])
+        st.info(f"⏳ {job['stage']}...（経過 {elapsed:.0f}秒）ページを再読み込みしても処理は継続します。")
+    
+    def _render_batch_table(self, jobs: list):
+        """一括処理の結果表と集計時間を表示"""
+        now = time.time()
+        rows = []
+        for job in jobs:
+            result = job['result'] or {}
+            elapsed = (job['finished_at'] or now) - job['started_at'] if job['started_at'] else None
+            rows.append({
+                'ファイル': job['label'],
+                '店舗名': result.get('shop_info', {}).get('name', ''),
+                '状態': job['error'] if job['status'] == 'error' else job['stage'],
+                '処理時間(秒)': round(elapsed, 1) if elapsed is not None else None,
+                '記事文字数': result.get('article_result', {}).get('word_count')
+            })
+        
+        st.subheader("📋 一括処理の状況")
+        st.dataframe(rows, hide_index=True)
+        
+        # 集計時間（並列実行の実時間と、逐次実行した場合の合計）
+        finished = [job for job in jobs if job['finished_at']]
+        wall_time = max(job['finished_at'] or now for job in jobs) - min(job['submitted_at'] for job in jobs)
+        serial_time = sum(job['finished_at'] - job['started_at'] for job in finished)
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("完了件数", f"{len(finished)}/{len(jobs)}件")
+        with col2:
+            st.metric("経過時間", f"{wall_time:.1f}秒")
+        with col3:
+            st.metric("逐次処理の合計", f"{serial_time:.1f}秒")
+
+    def _inspect_upload(self, uploaded_file) -> Dict[str, any]:
+        """アップロードファイルの事前検証と再生時間の取得（同じアップロードでは再計算しない）"""
+        validations = st.session_state.setdefault('file_validations', {})
+        key = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+        if key not in validations:
+            validation = validate_audio(uploaded_file.getbuffer(), uploaded_file.name)
+            if validation['valid']:
+                # 無音・音割れ・音楽ばかりの録音は文字起こし前に警告・除外
+                with st.spinner(f"🔍 {uploaded_file.name} の音声品質を解析中..."):
+                    merge_analysis(validation, analyze_audio(uploaded_file.getbuffer(), validation['duration']))
+            validations[key] = validation
+            self.validation_stats.record(validations[key], uploaded_file.size)
+            if not validations[key]['valid']:
+                logger.warning(f"事前検証で除外: {uploaded_file.name} {validations[key]['errors']}")
+        return validations[key]
+    
+    def _transcription_filename(self, uploaded_file, validation: Dict[str, any]) -> str:
+        """Whisper APIへ送るファイル名（拡張子と中身が食い違う場合は中身に合わせる）"""
+        stem, extension = os.path.splitext(uploaded_file.name)
+        if validation['format'] in EXTENSION_FORMATS.get(extension.lstrip('.').lower(), set()):
+            return uploaded_file.name
+        return f"{stem}.{validation['extension']}"
+    
+    def _file_hash(self, uploaded_file) -> str:
+        """アップロードファイルのSHA-256（同じアップロードでは再計算しない）"""
+        hashes = st.session_state.setdefault('file_hashes', {})
+        key = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+        if key not in hashes:
+            hashes[key] = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+        return hashes[key]
+
+    def _run_pipeline(self, report_stage, spool, filename: str, file_hash: str, shop_info: dict,
+                      duration: Optional[float] = None) -> Dict[str, any]:
+        """音声処理と記事生成のメイン処理（ワーカースレッドで実行）"""
+        # 再生時間が分かる場合は長さに応じたタイムアウトを設定
+        timeout = None
+        if duration is not None:
+            timeout = TRANSCRIBE_TIMEOUT_BASE_SECONDS + duration * TRANSCRIBE_TIMEOUT_PER_AUDIO_SECOND
+        
+        # 文字起こし実行（同じ音声ならキャッシュから取得）
+        # 一時領域はジョブ専用で、成功・失敗・例外のいずれでも必ず破棄する
+        # 表示は実際に使う経路に合わせる（APIが使えずローカルに切り替えた場合も含む）
+        report_stage("🎤 文字起こし中")
+        with spool:
+            try:
+                transcription_result = transcribe_audio_cached(
+                    file_hash, self, spool, filename, timeout,
+                    lambda backend: report_stage(TRANSCRIBE_STAGE_LABELS[backend])
+                )
+            except TranscriptionError as e:
+                return {"success": False, "error": f"文字起こしに失敗しました: {str(e)}"}
+        
+        transcription_text = transcription_result["text"]
+        
+        # 記事生成
+        report_stage("📰 記事を生成中")
+        article_result = self.article_generator.generate_article(transcription_text, shop_info)
+        if not article_result["success"]:
+            return {"success": False, "error": f"記事生成に失敗しました: {article_result['error']}"}
+        
+        return {
+            "success": True,
+            "file_hash": file_hash,
+            "article_result": article_result,
+            "shop_info": shop_info,
+            "transcription_text": transcription_text
+        }
 
     def _display_article_results(self, article_result: dict, shop_info: dict, transcription_text: str):
         """記事生成結果を表示"""
+        # 文字起こし結果を表示
+        with st.expander("📝 文字起こし結果を確認", expanded=False):
+            st.text_area("文字起こし内容", transcription_text, height=200)
+            st.info(f"📊 文字数: {len(transcription_text)} 文字")
+        
         st.markdown("---")
         st.header("📰 生成された記事")
         
@@ -6,20 +6,45 @@
 """
 
 import os
+import io
+import asyncio
 import json
-import subprocess
-from datetime import datetime
+import gzip
+import struct
+import base64
+import hashlib
+import signal
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
 from typing import Dict
 from dataclasses import dataclass, asdict
 import logging
 from pathlib import Path
+from html import escape
 import re
+import glob
+import zipfile
+from collections import OrderedDict
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
 
+from audio_analysis import analyze_file, merge_analysis
+from audio_utils import ValidationStats, validate_file
+from local_transcriber import local_transcriber
+
+try:
+    import zstandard
+except ImportError:  # zstandard が無い環境では gzip で保存する
+    zstandard = None
+
 # 環境変数読み込み
 load_dotenv()
 
@@ -39,6 +64,65 @@ TARGET_WORD_COUNT = 1500
 # OpenAI設定（今回は簡易版なので、テンプレートベースで記事生成）
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 
+# 音声ブロブ（SHA-256で重複排除）の保存先
+BLOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'blobs')
+
+# 分割アップロードの受信中ファイル（ブロブと同じファイルシステムに置き、完了時は移動のみ）
+UPLOAD_INCOMING_FOLDER = os.path.join(BLOB_FOLDER, 'incoming')
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_KB', 1024)) * 1024
+# 最後のチャンク受信からこの時間を過ぎた中断アップロードは掃除で削除
+RESUMABLE_UPLOAD_TTL_HOURS = int(os.environ.get('RESUMABLE_UPLOAD_TTL_HOURS', 24))
+
+# 文字起こしジョブごとの出力ディレクトリ（異常終了で残ったものは掃除で削除）
+JOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'jobs')
+JOB_DIR_TTL_SECONDS = 24 * 3600
+
+# クライアントが送る音声のSHA-256（保存済みの音声との照合用）
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# セッションID: <YYYYmmdd_HHMMSS>_<ランダムな16進6桁>（旧形式はタイムスタンプのみ）
+SESSION_ID_PATTERN = re.compile(r'^\d{8}_\d{6}(?:_[0-9a-f]{6})?$')
+
+# 読み込んだセッション・記事データのメモリキャッシュ件数
+ARTIFACT_CACHE_ENTRIES = int(os.environ.get('ARTIFACT_CACHE_ENTRIES', 256))
+
+# エクスポート済みファイル（記事のバージョンごとのキャッシュ）
+EXPORT_FOLDER = os.path.join(UPLOAD_FOLDER, 'exports')
+EXPORT_CACHE_ENTRIES = int(os.environ.get('EXPORT_CACHE_ENTRIES', 128))
+
+# 過去の文字起こし・記事の検索インデックス（SQLite FTS5）
+ARCHIVE_DB = os.path.join(UPLOAD_FOLDER, 'archive.db')
+# 1文字の語で絞り込むときに走査する候補文書の上限
+SEARCH_SCAN_LIMIT = 2000
+
+# 保持期間（日数、0で無期限）とディスク容量上限（MB、0で無制限）
+# 既定ではどれも削除しない。削除する場合は環境変数で明示的に指定する
+#   RETENTION_AUDIO_DAYS   : 音声（移行前の uploads/*.m4a 等と Whisper の .txt を含む）
+#   RETENTION_SESSION_DAYS : セッション（文字起こし）
+#   RETENTION_ARTICLE_DAYS : 記事
+#   RETENTION_EXPORT_DAYS  : エクスポート済みファイル（記事から作り直せる）
+#   UPLOAD_QUOTA_MB        : uploads/ 全体の上限（超えたら古いセッションから丸ごと削除）
+RETENTION_DAYS = {
+    'audio': int(os.environ.get('RETENTION_AUDIO_DAYS', 0)),
+    'session': int(os.environ.get('RETENTION_SESSION_DAYS', 0)),
+    'article': int(os.environ.get('RETENTION_ARTICLE_DAYS', 0)),
+    'export': int(os.environ.get('RETENTION_EXPORT_DAYS', 0))
+}
+UPLOAD_QUOTA_MB = int(os.environ.get('UPLOAD_QUOTA_MB', 0))
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('SWEEP_INTERVAL_SECONDS', 600))
+SWEEP_BATCH_SIZE = 200
+
+# 同時に実行する文字起こしの数（超えた分は待ち行列に入る）
+TRANSCRIBE_CONCURRENCY = int(os.environ.get('TRANSCRIBE_CONCURRENCY', 2))
+# 文字起こしの実行方法（whisper-cli: Whisper CLI / faster-whisper: int8 量子化モデルでのCPU推論）
+TRANSCRIBE_BACKEND = os.environ.get('TRANSCRIBE_BACKEND', 'whisper-cli')
+# 進捗配信（SSE）の生存確認間隔と、終了したジョブを保持する秒数
+PROGRESS_HEARTBEAT_SECONDS = 15
+PROGRESS_TTL_SECONDS = 600
+# 終了していないジョブを更新なしで保持する秒数（購読だけされて始まらないジョブなど。
+# 分割アップロードの送信中は更新がないので長めにする）
+PROGRESS_IDLE_TTL_SECONDS = 1800
+
 # ディレクトリ作成
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -50,20 +134,1131 @@ class ArticleData:
     location: str
     tags: list
     shop_info: dict
-    transcription: str
+    transcript_id: str
     article_content: str
     created_at: str
     word_count: int
 
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ファイル全体のSHA-256（chunk_size ずつ読む）"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class AudioBlobStore:
+    """音声ファイルのコンテンツアドレス型ストア
+
+    同じ内容の音声はSHA-256ごとに1つだけ保存し、参照しているセッションIDを
+    refs.json に記録する。参照がなくなったブロブは削除される。
+    """
+    
+    CHUNK_SIZE = 1024 * 1024
+    
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, 'refs.json')
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+    
+    def blob_path(self, digest: str, ext: str) -> str:
+        """ブロブの保存パス（先頭2文字でディレクトリを分割）"""
+        return os.path.join(self.root, digest[:2], f"{digest}{ext}")
+    
+    def path_for(self, digest: str) -> str:
+        """登録済みブロブのパスを取得（未登録ならNone）"""
+        with self._lock:
+            entry = self._load_index().get(digest)
+        if not entry:
+            return None
+        return self.blob_path(digest, entry["ext"])
+    
+    def put(self, stream, ext: str, session_id: str) -> Dict[str, any]:
+        """ストリームをハッシュしながら保存し、セッションの参照を追加"""
+        hasher = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return self.adopt(temp_path, hasher.hexdigest(), size, ext, session_id)
+    
+    def adopt(self, temp_path: str, digest: str, size: int, ext: str, session_id: str) -> Dict[str, any]:
+        """ストアと同じファイルシステム上の一時ファイルをブロブとして取り込み（コピーせず移動）"""
+        try:
+            with self._lock:
+                index = self._load_index()
+                entry = index.get(digest)
+                deduplicated = entry is not None
+                if deduplicated:
+                    os.remove(temp_path)
+                else:
+                    entry = {"ext": ext.lower(), "size": size, "refs": []}
+                    path = self.blob_path(digest, entry["ext"])
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+                    index[digest] = entry
+                if session_id not in entry["refs"]:
+                    entry["refs"].append(session_id)
+                self._save_index(index)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        logger.info(f"ブロブ保存: {digest} ({size} bytes, 重複: {deduplicated}, 参照数: {len(entry['refs'])})")
+        return self._blob_info(digest, entry, deduplicated)
+    
+    def add_ref(self, digest: str, session_id: str) -> Dict[str, any]:
+        """既存ブロブにセッションの参照を追加（未登録ならNone。ref_added: この呼び出しで追加したか）"""
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(digest)
+            if not entry:
+                return None
+            ref_added = session_id not in entry["refs"]
+            if ref_added:
+                entry["refs"].append(session_id)
+                self._save_index(index)
+        return {**self._blob_info(digest, entry, True), "ref_added": ref_added}
+    
+    def set_transcript(self, digest: str, transcript_id: str):
+        """ブロブの文字起こし結果を記録（同じ音声の再アップロード時に再利用する）"""
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(digest)
+            if entry and entry.get("transcript_id") != transcript_id:
+                entry["transcript_id"] = transcript_id
+                self._save_index(index)
+    
+    def release(self, digest: str, session_id: str) -> int:
+        """セッションの参照を外し、参照がなくなればブロブを削除（解放バイト数を返す）"""
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(digest)
+            if not entry:
+                return 0
+            if session_id in entry["refs"]:
+                entry["refs"].remove(session_id)
+            if entry["refs"]:
+                self._save_index(index)
+                return 0
+            
+            del index[digest]
+            self._save_index(index)
+            path = self.blob_path(digest, entry["ext"])
+            # 以前のWhisper実行が音声の隣に出力したテキストも一緒に削除
+            for target in (path, os.path.splitext(path)[0] + '.txt'):
+                if os.path.exists(target):
+                    os.remove(target)
+        
+        logger.info(f"ブロブ削除: {digest} ({entry['size']} bytes 解放)")
+        return entry["size"]
+    
+    def prune_refs(self, live_ids: set, grace_seconds: int):
+        """存在しないセッションへの参照を外し、参照がなくなったブロブを削除（件数, 解放バイト数）
+
+        文字起こし中のセッションはまだファイルがないので、IDの作成時刻から
+        grace_seconds を過ぎた参照だけを対象にする。
+        """
+        cutoff = time.time() - grace_seconds
+        removed = []
+        with self._lock:
+            index = self._load_index()
+            changed = False
+            for digest, entry in list(index.items()):
+                dead = [
+                    ref for ref in entry["refs"]
+                    if ref not in live_ids and (session_timestamp(ref) or cutoff) < cutoff
+                ]
+                if not dead:
+                    continue
+                changed = True
+                entry["refs"] = [ref for ref in entry["refs"] if ref not in dead]
+                logger.info(f"存在しないセッションの参照を削除: {digest} {dead}")
+                if not entry["refs"]:
+                    del index[digest]
+                    removed.append((digest, entry))
+            if changed:
+                self._save_index(index)
+            for digest, entry in removed:
+                path = self.blob_path(digest, entry["ext"])
+                for target in (path, os.path.splitext(path)[0] + '.txt'):
+                    if os.path.exists(target):
+                        os.remove(target)
+        
+        freed = sum(entry["size"] for _, entry in removed)
+        if removed:
+            logger.info(f"参照のないブロブを削除: {len(removed)}件 ({freed} bytes 解放)")
+        return len(removed), freed
+    
+    def total_bytes(self) -> int:
+        """ストア内のブロブ合計サイズ"""
+        with self._lock:
+            return sum(entry["size"] for entry in self._load_index().values())
+    
+    def migrate_legacy_uploads(self, upload_folder: str, dry_run: bool = False) -> Dict[str, any]:
+        """uploads/ 直下の <timestamp>_<name> 音声をストアへ移行"""
+        stats = {
+            "sessions": 0,
+            "migrated_files": 0,
+            "missing_files": [],
+            "unreferenced_files": [],
+            "bytes_before": 0,
+            "bytes_after": 0,
+            "bytes_reclaimed": 0
+        }
+        referenced = set()
+        seen_digests = set()
+        
+        session_ids = sorted({
+            os.path.splitext(name)[0][len('session_'):]
+            for name in os.listdir(upload_folder)
+            if name.startswith('session_') and name.endswith(('.json', ArtifactStore.EXTENSION))
+        })
+        for session_id in session_ids:
+            session_data = artifact_store.load('session', session_id)
+            stats["sessions"] += 1
+            if session_data.get("blob_sha256"):
+                continue
+            
+            # filepath はWindowsの区切り文字の場合があるため filename から組み立てる
+            audio_file = os.path.join(upload_folder, session_data.get("filename", ""))
+            referenced.add(os.path.basename(audio_file))
+            if not os.path.isfile(audio_file):
+                stats["missing_files"].append(session_data.get("filename", ""))
+                continue
+            
+            size = os.path.getsize(audio_file)
+            stats["bytes_before"] += size
+            stats["migrated_files"] += 1
+            
+            if dry_run:
+                digest = sha256_file(audio_file)
+                if digest not in seen_digests and not self.path_for(digest):
+                    stats["bytes_after"] += size
+                seen_digests.add(digest)
+                continue
+            
+            ext = os.path.splitext(audio_file)[1]
+            with open(audio_file, 'rb') as f:
+                blob = self.put(f, ext, session_id)
+            if not blob["deduplicated"]:
+                stats["bytes_after"] += blob["size"]
+            
+            session_data["filepath"] = blob["path"]
+            session_data["blob_sha256"] = blob["sha256"]
+            artifact_store.save('session', session_id, session_data)
+            os.remove(audio_file)
+        
+        for name in sorted(os.listdir(upload_folder)):
+            path = os.path.join(upload_folder, name)
+            if os.path.isfile(path) and audio_processor.allowed_file(name) and name not in referenced:
+                stats["unreferenced_files"].append(name)
+        
+        stats["bytes_reclaimed"] = stats["bytes_before"] - stats["bytes_after"]
+        return stats
+    
+    def _blob_info(self, digest: str, entry: dict, deduplicated: bool) -> Dict[str, any]:
+        return {
+            "sha256": digest,
+            "path": self.blob_path(digest, entry["ext"]),
+            "size": entry["size"],
+            "deduplicated": deduplicated,
+            "transcript_id": entry.get("transcript_id")
+        }
+    
+    def _load_index(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _save_index(self, index: dict):
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.index_path)
+
+class ResumableUploadStore:
+    """再開可能な分割アップロードの受け口
+
+    チャンクは incoming/<upload_id>.part の該当オフセットへ直接書き込み、受信済み
+    バイト数を <upload_id>.json に記録する。チャンクは先頭から順に受け付け、全体の
+    SHA-256 も受信しながら計算するため、完了時は読み直さずにブロブへ移動できる
+    （サーバー再起動をまたいだ場合のみ読み直す）。
+    """
+    
+    UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+    CHECKSUM_HEADER = 'X-Chunk-SHA256'
+    READ_SIZE = 256 * 1024
+    
+    def __init__(self, root: str, chunk_size: int, max_size: int):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # 書き込み・取り込み中のアップロードID
+        self._busy = set()
+        # upload_id -> (ハッシュ済みバイト数, 全体のSHA-256)
+        self._hashers = {}
+        self.counters = {"chunks": 0, "bytes": 0, "duplicate_chunks": 0, "rejected_chunks": 0, "completed": 0}
+        os.makedirs(root, exist_ok=True)
+    
+    def create(self, filename: str, size: int) -> Dict[str, any]:
+        """空の .part を作成してアップロードを開始"""
+        upload_id = uuid.uuid4().hex
+        meta = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "size": size,
+            "chunk_size": self.chunk_size,
+            "received": 0,
+            "created_at": datetime.now().isoformat()
+        }
+        open(self._part_path(upload_id), 'wb').close()
+        self._save_meta(meta)
+        with self._lock:
+            self._hashers[upload_id] = (0, hashlib.sha256())
+        logger.info(f"分割アップロード開始: {upload_id} {filename} ({size} bytes)")
+        return self.status(meta)
+    
+    def get(self, upload_id: str) -> dict:
+        """アップロードの記録を取得（不正なIDや未登録ならNone）"""
+        if not upload_id or not self.UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        path = self._meta_path(upload_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def status(self, meta: dict) -> Dict[str, any]:
+        """クライアントが再開位置を決めるための情報（完了済みなら next_chunk は None）"""
+        complete = meta["received"] >= meta["size"]
+        return {
+            "upload_id": meta["upload_id"],
+            "size": meta["size"],
+            "chunk_size": meta["chunk_size"],
+            "received_bytes": meta["received"],
+            "next_chunk": None if complete else meta["received"] // meta["chunk_size"],
+            "complete": complete
+        }
+    
+    def write_chunk(self, upload_id: str, index: int, stream, length: int, checksum: str = None) -> Dict[str, any]:
+        """index 番目のチャンクを検証しながら .part の該当位置へ書き込み"""
+        if not self._acquire(upload_id):
+            return {"success": False, "error": "同じアップロードのチャンクを処理中です", "status": 409}
+        try:
+            meta = self.get(upload_id)
+            if not meta:
+                return {"success": False, "error": "アップロードが見つかりません", "status": 404}
+            
+            offset = index * meta["chunk_size"]
+            expected = min(meta["chunk_size"], meta["size"] - offset)
+            if offset < meta["received"]:
+                # 応答が届かず再送された受信済みチャンクは書き込まずに受理
+                self._count(duplicate_chunks=1)
+                return {"success": True, **self.status(meta)}
+            if offset > meta["received"] or expected <= 0:
+                self._count(rejected_chunks=1)
+                return {"success": False, "error": "チャンクの順番が不正です", "status": 409, **self.status(meta)}
+            if length != expected:
+                self._count(rejected_chunks=1)
+                return {"success": False, "error": f"チャンクのサイズが不正です（期待値 {expected} bytes）", "status": 400, **self.status(meta)}
+            
+            with self._lock:
+                resumed = self._hashers.get(upload_id)
+            total_hasher = resumed[1].copy() if resumed and resumed[0] == offset else None
+            chunk_hasher = hashlib.sha256()
+            written = 0
+            with open(self._part_path(upload_id), 'r+b') as f:
+                try:
+                    f.seek(offset)
+                    while written < expected:
+                        data = stream.read(min(self.READ_SIZE, expected - written))
+                        if not data:
+                            break
+                        f.write(data)
+                        chunk_hasher.update(data)
+                        if total_hasher:
+                            total_hasher.update(data)
+                        written += len(data)
+                except Exception:
+                    f.truncate(offset)
+                    raise
+                
+                error = None
+                if written != expected:
+                    error = "チャンクの受信が途中で切れました"
+                elif checksum and checksum.lower() != chunk_hasher.hexdigest():
+                    error = "チャンクのチェックサムが一致しません"
+                if error:
+                    # 途中まで書いた分は捨て、受信済みの位置から再送してもらう
+                    f.truncate(offset)
+                    self._count(rejected_chunks=1)
+                    return {"success": False, "error": error, "status": 400, **self.status(meta)}
+                f.truncate(offset + written)
+            
+            meta["received"] = offset + written
+            self._save_meta(meta)
+            with self._lock:
+                if total_hasher:
+                    self._hashers[upload_id] = (meta["received"], total_hasher)
+                else:
+                    self._hashers.pop(upload_id, None)
+            self._count(chunks=1, bytes=written)
+            return {"success": True, **self.status(meta)}
+        finally:
+            self._release(upload_id)
+    
+    def finalize(self, upload_id: str, session_id: str, sha256: str = None) -> Dict[str, any]:
+        """受信済みの .part をブロブストアへ移動し、セッションの参照を追加"""
+        if not self._acquire(upload_id):
+            return {"success": False, "error": "同じアップロードを処理中です"}
+        try:
+            meta = self.get(upload_id)
+            if not meta:
+                return {"success": False, "error": "アップロードが見つかりません"}
+            if meta["received"] < meta["size"]:
+                return {"success": False, "error": "まだ受信していないチャンクがあります", **self.status(meta)}
+            
+            part_path = self._part_path(upload_id)
+            with self._lock:
+                hashed = self._hashers.pop(upload_id, None)
+            if hashed and hashed[0] == meta["size"]:
+                digest = hashed[1].hexdigest()
+            else:
+                digest = sha256_file(part_path)
+            if sha256 and sha256.lower() != digest:
+                self.discard(upload_id)
+                return {"success": False, "error": "ファイル全体のチェックサムが一致しません。最初からアップロードしてください"}
+            
+            blob = blob_store.adopt(part_path, digest, meta["size"], os.path.splitext(meta["filename"])[1], session_id)
+            os.remove(self._meta_path(upload_id))
+            self._count(completed=1)
+            return {"success": True, "blob": blob}
+        finally:
+            self._release(upload_id)
+    
+    def discard(self, upload_id: str) -> int:
+        """アップロードの .part と記録を削除（解放バイト数を返す）"""
+        freed = 0
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            if os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+        return freed
+    
+    def purge_stale(self, max_age_seconds: int):
+        """最後の受信から max_age_seconds 以上経ったアップロードを削除（件数, 解放バイト数）"""
+        count = 0
+        freed = 0
+        now = time.time()
+        with os.scandir(self.root) as entries:
+            upload_ids = {os.path.splitext(entry.name)[0] for entry in entries if entry.name.endswith(('.part', '.json'))}
+        for upload_id in upload_ids:
+            paths = [p for p in (self._part_path(upload_id), self._meta_path(upload_id)) if os.path.exists(p)]
+            if not paths or now - max(os.path.getmtime(p) for p in paths) <= max_age_seconds:
+                continue
+            if not self._acquire(upload_id):
+                continue
+            try:
+                freed += self.discard(upload_id)
+                count += 1
+            finally:
+                self._release(upload_id)
+        if count:
+            logger.info(f"中断された分割アップロードを削除: {count}件 ({freed} bytes)")
+        return count, freed
+    
+    def stats(self) -> Dict[str, int]:
+        with os.scandir(self.root) as entries:
+            in_progress = sum(1 for entry in entries if entry.name.endswith('.json'))
+        with self._lock:
+            return dict(self.counters, in_progress=in_progress)
+    
+    def _acquire(self, upload_id: str) -> bool:
+        with self._lock:
+            if upload_id in self._busy:
+                return False
+            self._busy.add(upload_id)
+            return True
+    
+    def _release(self, upload_id: str):
+        with self._lock:
+            self._busy.discard(upload_id)
+    
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.counters[key] += value
+    
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.part")
+    
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.json")
+    
+    def _save_meta(self, meta: dict):
+        path = self._meta_path(meta["upload_id"])
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+class LRUCache:
+    """スレッドセーフな件数上限付きLRUキャッシュ（ヒット率を記録）
+
+    読み込み中に書き込みが起きた場合に古い値を登録しないよう、
+    begin_read() で取得したトークンが無効化後のものなら put() を無視する。
+    """
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        """値を取得（なければNone）"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def begin_read(self) -> int:
+        """ディスク読み込み前に呼び、put() に渡すトークンを取得"""
+        with self._lock:
+            return self._epoch
+    
+    def put(self, key, value, token: int = None):
+        """値を登録（容量を超えたら古いものから破棄）"""
+        with self._lock:
+            if token is not None and token != self._epoch:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._epoch += 1
+    
+    def invalidate_where(self, predicate):
+        """条件に一致するキーをまとめて破棄"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+            self._epoch += 1
+    
+    def stats(self) -> Dict[str, any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / requests, 4) if requests else 0.0,
+                "size": len(self._entries),
+                "capacity": self.capacity
+            }
+
+class ArtifactStore:
+    """セッション・記事データの圧縮保存クラス
+
+    ファイル形式: MAGIC(4) + 圧縮方式(1) + メタデータ長(4) + メタデータJSON + 圧縮本文JSON
+    メタデータは非圧縮なので、本文を展開せずに読み出せる。
+    旧形式の <kind>_<id>.json も読み込み可能。
+    """
+    
+    MAGIC = b'MRT1'
+    EXTENSION = '.mrt'
+    HEADER = struct.Struct('>4scI')
+    # 容量の大きいフィールドは圧縮本文へ
+    BODY_FIELDS = {
+        'session': ('transcription',),
+        'article': ('transcription', 'article_content'),
+        'transcript': ('text',)
+    }
+    
+    def __init__(self, root: str, codec: str = None, cache_entries: int = 0):
+        self.root = root
+        self.codec = codec or ('zstd' if zstandard else 'gzip')
+        # 読み込み結果は共有されるため、呼び出し側には浅いコピーを返す
+        self.cache = LRUCache(cache_entries) if cache_entries else None
+    
+    def path(self, kind: str, artifact_id: str) -> str:
+        """保存先のパス（新形式）"""
+        return os.path.join(self.root, f"{kind}_{artifact_id}{self.EXTENSION}")
+    
+    def legacy_path(self, kind: str, artifact_id: str) -> str:
+        """旧形式（JSON）のパス"""
+        return os.path.join(self.root, f"{kind}_{artifact_id}.json")
+    
+    def exists(self, kind: str, artifact_id: str) -> bool:
+        return os.path.exists(self.path(kind, artifact_id)) or os.path.exists(self.legacy_path(kind, artifact_id))
+    
+    def save(self, kind: str, artifact_id: str, data: dict):
+        """メタデータと本文に分けて圧縮保存"""
+        body_fields = self.BODY_FIELDS.get(kind, ())
+        meta = {k: v for k, v in data.items() if k not in body_fields}
+        body = {k: data[k] for k in body_fields if k in data}
+        try:
+            self.write(self.path(kind, artifact_id), meta, body)
+            
+            # 旧形式が残っていると古い内容を読んでしまうため削除
+            legacy = self.legacy_path(kind, artifact_id)
+            if os.path.exists(legacy):
+                os.remove(legacy)
+        finally:
+            if self.cache:
+                self.cache.invalidate((kind, artifact_id))
+    
+    def version(self, kind: str, artifact_id: str):
+        """ファイルの (更新時刻ns, サイズ)（存在しなければNone）"""
+        for path in (self.path(kind, artifact_id), self.legacy_path(kind, artifact_id)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            return (stat.st_mtime_ns, stat.st_size)
+        return None
+    
+    def load(self, kind: str, artifact_id: str) -> dict:
+        """メタデータと本文を結合して読み込み（存在しなければNone）"""
+        key = (kind, artifact_id)
+        if self.cache:
+            cached = self._cached(key)
+            if cached is not None:
+                return dict(cached)
+            token = self.cache.begin_read()
+        
+        data, version = self.load_versioned(kind, artifact_id)
+        if data is None:
+            return None
+        if self.cache:
+            self.cache.put(key, (version, data), token)
+        return dict(data)
+    
+    def load_versioned(self, kind: str, artifact_id: str):
+        """キャッシュを使わずに読み込み、(データ, 読んだファイルのバージョン) を返す
+
+        バージョンは読み込みに使ったファイル記述子から取るので、内容と必ず一致する。
+        """
+        try:
+            with open(self.path(kind, artifact_id), 'rb') as f:
+                stat = os.fstat(f.fileno())
+                data, body = self._read_file(f)
+            data.update(body)
+            return data, (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self.legacy_path(kind, artifact_id), 'r', encoding='utf-8') as f:
+                stat = os.fstat(f.fileno())
+                return json.load(f), (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None, None
+    
+    def _cached(self, key):
+        """キャッシュの値（ファイルが他のプロセスから更新されていればNone）"""
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        version, data = entry
+        if self.version(*key) != version:
+            self.cache.invalidate(key)
+            return None
+        return data
+    
+    def load_meta(self, kind: str, artifact_id: str) -> dict:
+        """本文を展開せずにメタデータだけ読み込み"""
+        if self.cache:
+            cached = self._cached((kind, artifact_id))
+            if cached is not None:
+                return dict(cached)
+        path = self.path(kind, artifact_id)
+        if os.path.exists(path):
+            return self.read_meta(path)
+        return self.load(kind, artifact_id)
+    
+    def delete(self, kind: str, artifact_id: str) -> int:
+        """新旧両形式のファイルを削除（解放バイト数を返す）"""
+        if self.cache:
+            self.cache.invalidate((kind, artifact_id))
+        freed_bytes = 0
+        for path in (self.path(kind, artifact_id), self.legacy_path(kind, artifact_id)):
+            if os.path.exists(path):
+                freed_bytes += os.path.getsize(path)
+                os.remove(path)
+        return freed_bytes
+    
+    def write(self, path: str, meta: dict, body: dict):
+        """本文をストリームで圧縮しながら書き込み（一時ファイル経由で置き換え）"""
+        meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        codec = b'z' if self.codec == 'zstd' else b'g'
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, codec, len(meta_bytes)))
+                f.write(meta_bytes)
+                with self._open_body_writer(f, codec) as writer:
+                    text = io.TextIOWrapper(writer, encoding='utf-8')
+                    for chunk in json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).iterencode(body):
+                        text.write(chunk)
+                    text.flush()
+                    text.detach()
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    
+    def read_meta(self, path: str) -> dict:
+        """ヘッダーとメタデータのみ読み込み"""
+        with open(path, 'rb') as f:
+            meta, _ = self._read_header(f)
+        return meta
+    
+    def read(self, path: str):
+        """メタデータと本文を読み込み"""
+        with open(path, 'rb') as f:
+            return self._read_file(f)
+    
+    def _read_file(self, f):
+        meta, codec = self._read_header(f)
+        with self._open_body_reader(f, codec) as reader:
+            body = json.load(io.TextIOWrapper(reader, encoding='utf-8'))
+        return meta, body
+    
+    def _read_header(self, f):
+        magic, codec, meta_length = self.HEADER.unpack(f.read(self.HEADER.size))
+        if magic != self.MAGIC:
+            raise ValueError(f"不正なファイル形式です: {f.name}")
+        return json.loads(f.read(meta_length).decode('utf-8')), codec
+    
+    def _open_body_writer(self, f, codec: bytes):
+        if codec == b'z':
+            return zstandard.ZstdCompressor(level=10).stream_writer(f, closefd=False)
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9)
+    
+    def _open_body_reader(self, f, codec: bytes):
+        if codec == b'z':
+            if zstandard is None:
+                raise RuntimeError("zstd形式のファイルを読むには zstandard パッケージが必要です")
+            return zstandard.ZstdDecompressor().stream_reader(f, closefd=False)
+        return gzip.GzipFile(fileobj=f, mode='rb')
+
+class ArchiveIndex:
+    """過去の文字起こし・記事のインデックス（SQLite）
+
+    全文検索はFTS5を使い、3文字以上の語は trigram トークナイザ、2文字の語
+    （「店長」など）は文字バイグラムを空白区切りで格納した別テーブルで検索する。
+    記事一覧は articles テーブルの索引を使ったカーソル方式でページングする。
+    """
+    
+    SNIPPET_WIDTH = 40
+    # 並び替えに使える列（いずれも (列, session_id) の索引がある）
+    SORT_COLUMNS = ('created_at', 'title', 'word_count')
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._write_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    UNIQUE (session_id, kind)
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS documents_trigram
+                    USING fts5(title, body, tokenize='trigram');
+                CREATE VIRTUAL TABLE IF NOT EXISTS documents_bigram
+                    USING fts5(body, tokenize='unicode61');
+                CREATE TABLE IF NOT EXISTS articles (
+                    session_id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    word_count INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_articles_created ON articles (created_at, session_id);
+                CREATE INDEX IF NOT EXISTS idx_articles_title ON articles (title, session_id);
+                CREATE INDEX IF NOT EXISTS idx_articles_word_count ON articles (word_count, session_id);
+                CREATE INDEX IF NOT EXISTS idx_articles_category ON articles (category, created_at, session_id);
+                CREATE INDEX IF NOT EXISTS idx_articles_location ON articles (location, created_at, session_id);
+            """)
+    
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+    
+    def is_empty(self) -> bool:
+        with self._connect() as conn:
+            return (
+                conn.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is None
+                or conn.execute("SELECT 1 FROM articles LIMIT 1").fetchone() is None
+            )
+    
+    def index_article(self, session_id: str, article_data: dict):
+        """記事一覧用のメタデータを登録（既存なら更新）"""
+        with self._write_lock, self._connect() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO articles (session_id, title, category, location, created_at, word_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                session_id,
+                article_data.get("title", ""),
+                article_data.get("category", ""),
+                article_data.get("location", ""),
+                article_data.get("created_at", ""),
+                article_data.get("word_count", 0)
+            ))
+        self.index_document(session_id, 'article', article_data.get("title", ""), article_data.get("article_content", ""))
+    
+    def list_articles(self, filters: dict, sort: str = '-created_at', limit: int = 20, cursor: str = None) -> Dict[str, any]:
+        """記事一覧をカーソル方式で取得（filters: category, location, from, to）"""
+        descending = sort.startswith('-')
+        column = sort.lstrip('-')
+        if column not in self.SORT_COLUMNS:
+            raise ValueError(f"並び替えできない項目です: {sort}")
+        
+        conditions = []
+        params = []
+        for key in ('category', 'location'):
+            if filters.get(key):
+                conditions.append(f"{key} = ?")
+                params.append(filters[key])
+        if filters.get('from'):
+            conditions.append("created_at >= ?")
+            params.append(filters['from'])
+        if filters.get('to'):
+            # 終了日は当日を含める
+            end = datetime.strptime(filters['to'], "%Y-%m-%d") + timedelta(days=1)
+            conditions.append("created_at < ?")
+            params.append(end.strftime("%Y-%m-%d"))
+        if cursor:
+            last_value, last_session_id = self._decode_cursor(cursor)
+            conditions.append(f"({column}, session_id) {'<' if descending else '>'} (?, ?)")
+            params.extend([last_value, last_session_id])
+        
+        direction = 'DESC' if descending else 'ASC'
+        sql = "SELECT session_id, title, category, location, created_at, word_count FROM articles"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {column} {direction}, session_id {direction} LIMIT ?"
+        
+        with self._connect() as conn:
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+        
+        articles = [
+            {
+                "session_id": row[0],
+                "title": row[1],
+                "category": row[2],
+                "location": row[3],
+                "created_at": row[4],
+                "word_count": row[5]
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = articles[-1]
+            next_cursor = self._encode_cursor(last[column], last["session_id"])
+        return {"articles": articles, "next_cursor": next_cursor}
+    
+    def article_ids(self, date_from: str = None, date_to: str = None) -> list:
+        """作成日の範囲（YYYY-MM-DD）で記事IDを古い順に取得"""
+        result = []
+        cursor = None
+        while True:
+            page = self.list_articles({'from': date_from, 'to': date_to}, sort='created_at', limit=1000, cursor=cursor)
+            result.extend(article["session_id"] for article in page["articles"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                return result
+    
+    def _encode_cursor(self, value, session_id: str) -> str:
+        raw = json.dumps([value, session_id], ensure_ascii=False).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+    
+    def _decode_cursor(self, cursor: str):
+        try:
+            value, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except Exception:
+            raise ValueError("カーソルが不正です")
+        return value, session_id
+    
+    def index_document(self, session_id: str, kind: str, title: str, body: str):
+        """文書を登録（同じセッション・種類の文書は置き換え）"""
+        body = re.sub(r'<[^>]+>', '', body or '')
+        bigrams = self._bigrams(f"{title}\n{body}")
+        with self._write_lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM documents WHERE session_id = ? AND kind = ?", (session_id, kind)
+            ).fetchone()
+            if row:
+                doc_id = row[0]
+                conn.execute("UPDATE documents SET title = ? WHERE id = ?", (title, doc_id))
+                conn.execute("DELETE FROM documents_trigram WHERE rowid = ?", (doc_id,))
+                conn.execute("DELETE FROM documents_bigram WHERE rowid = ?", (doc_id,))
+            else:
+                doc_id = conn.execute(
+                    "INSERT INTO documents (session_id, kind, title) VALUES (?, ?, ?)", (session_id, kind, title)
+                ).lastrowid
+            conn.execute("INSERT INTO documents_trigram (rowid, title, body) VALUES (?, ?, ?)", (doc_id, title, body))
+            conn.execute("INSERT INTO documents_bigram (rowid, body) VALUES (?, ?)", (doc_id, bigrams))
+    
+    def remove(self, session_id: str, kind: str = None):
+        """セッションの文書を削除（kind省略時は全種類）"""
+        with self._write_lock, self._connect() as conn:
+            if kind:
+                rows = conn.execute(
+                    "SELECT id FROM documents WHERE session_id = ? AND kind = ?", (session_id, kind)
+                ).fetchall()
+            else:
+                rows = conn.execute("SELECT id FROM documents WHERE session_id = ?", (session_id,)).fetchall()
+            for (doc_id,) in rows:
+                conn.execute("DELETE FROM documents_trigram WHERE rowid = ?", (doc_id,))
+                conn.execute("DELETE FROM documents_bigram WHERE rowid = ?", (doc_id,))
+                conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+            if kind in (None, 'article'):
+                conn.execute("DELETE FROM articles WHERE session_id = ?", (session_id,))
+    
+    def search(self, query: str, limit: int = 20) -> list:
+        """空白区切りの全ての語を含む文書を新しい順に検索"""
+        terms = [term for term in query.split() if term]
+        # 1文字の語だけではインデックスが使えず全件を走査するため検索しない
+        if not any(len(term) >= 2 for term in terms):
+            return []
+        
+        # 2文字の語があればバイグラム表（3文字以上の語はバイグラムのフレーズ）、
+        # なければ trigram 表で1回のMATCHに収め、rowid降順のLIMITで打ち切る
+        indexed_terms = [term for term in terms if len(term) >= 2]
+        if any(len(term) == 2 for term in indexed_terms):
+            table = 'documents_bigram'
+            expression = ' AND '.join(self._quote(self._bigrams(term)) for term in indexed_terms)
+        else:
+            table = 'documents_trigram'
+            expression = ' AND '.join(self._quote(term) for term in indexed_terms)
+        # 1文字の語はインデックスが効かないため、取り出した文書を順に絞り込む
+        like_terms = [term for term in terms if len(term) == 1]
+        
+        # 1文字の語で絞り込む場合も、走査する候補は SEARCH_SCAN_LIMIT 件まで
+        sql = f"SELECT rowid FROM {table} WHERE {table} MATCH ? ORDER BY rowid DESC LIMIT ?"
+        params = [expression, SEARCH_SCAN_LIMIT if like_terms else limit]
+        
+        results = []
+        with self._connect() as conn:
+            cursor = conn.execute(sql, params)
+            while len(results) < limit:
+                doc_ids = [row[0] for row in cursor.fetchmany(100)]
+                if not doc_ids:
+                    break
+                placeholders = ','.join('?' * len(doc_ids))
+                rows = conn.execute(f"""
+                    SELECT d.session_id, d.kind, d.title, t.body
+                    FROM documents d JOIN documents_trigram t ON t.rowid = d.id
+                    WHERE d.id IN ({placeholders})
+                    ORDER BY d.id DESC
+                """, doc_ids).fetchall()
+                for session_id, kind, title, body in rows:
+                    if not all(term in title or term in body for term in like_terms):
+                        continue
+                    results.append({
+                        "session_id": session_id,
+                        "kind": kind,
+                        "title": title,
+                        "snippet": self._snippet(body, terms)
+                    })
+        
+        return results[:limit]
+    
+    def rebuild(self, store: 'ArtifactStore', upload_folder: str) -> int:
+        """保存済みのセッション・記事からインデックスを作り直す"""
+        count = 0
+        for name in sorted(os.listdir(upload_folder)):
+            stem, ext = os.path.splitext(name)
+            if ext not in ('.json', ArtifactStore.EXTENSION) or '_' not in stem:
+                continue
+            kind, session_id = stem.split('_', 1)
+            if kind not in ('session', 'article'):
+                continue
+            data = store.load(kind, session_id)
+            if kind == 'session':
+                self.index_document(session_id, 'transcript', data.get("original_filename", ""), transcript_store.text_of(data))
+            else:
+                self.index_article(session_id, data)
+            count += 1
+        logger.info(f"検索インデックス再構築: {count}件")
+        return count
+    
+    def _bigrams(self, text: str) -> str:
+        return ' '.join(text[i:i + 2] for i in range(len(text) - 1) if not text[i:i + 2].isspace())
+    
+    def _quote(self, term: str) -> str:
+        return '"' + term.replace('"', '""') + '"'
+    
+    def _snippet(self, body: str, terms: list) -> str:
+        """最初に一致した語の前後を抜き出して <mark> で強調"""
+        positions = [(body.find(term), term) for term in terms if body.find(term) >= 0]
+        if not positions:
+            return escape(body[:self.SNIPPET_WIDTH * 2])
+        position, term = min(positions)
+        start = max(0, position - self.SNIPPET_WIDTH)
+        end = min(len(body), position + len(term) + self.SNIPPET_WIDTH)
+        raw = body[start:end].replace('\n', ' ')
+        # 一致箇所はエスケープ前の本文で探し、重なる箇所はまとめてから1回だけ <mark> で囲む
+        spans = []
+        for t in sorted({t for t in terms if t}, key=len, reverse=True):
+            index = raw.find(t)
+            while index >= 0:
+                spans.append((index, index + len(t)))
+                index = raw.find(t, index + len(t))
+        merged = []
+        for span_start, span_end in sorted(spans):
+            if merged and span_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], span_end)
+            else:
+                merged.append([span_start, span_end])
+        parts = []
+        cursor = 0
+        for span_start, span_end in merged:
+            parts.append(escape(raw[cursor:span_start]))
+            parts.append(f"<mark>{escape(raw[span_start:span_end])}</mark>")
+            cursor = span_end
+        parts.append(escape(raw[cursor:]))
+        return ('…' if start > 0 else '') + ''.join(parts) + ('…' if end < len(body) else '')
+
+class TranscriptStore:
+    """文字起こし本文を1か所にだけ保存するクラス
+
+    本文のSHA-256をIDとして transcript_<id>.mrt に保存し、セッション・記事は
+    IDだけを持つ。メタデータに参照しているセッションIDを記録し、参照が
+    なくなったら削除する。
+    """
+    
+    def __init__(self, store: ArtifactStore):
+        self.store = store
+        self._lock = threading.Lock()
+    
+    def put(self, text: str, session_id: str) -> str:
+        """本文を保存してセッションの参照を追加し、IDを返す"""
+        transcript_id = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            data = self.store.load('transcript', transcript_id)
+            if data is None:
+                data = {"length": len(text), "created_at": datetime.now().isoformat(), "refs": [], "text": text}
+            if session_id not in data["refs"]:
+                data["refs"].append(session_id)
+                self.store.save('transcript', transcript_id, data)
+        return transcript_id
+    
+    def add_ref(self, transcript_id: str, session_id: str) -> bool:
+        """保存済みの本文にセッションの参照を追加（本文がなければFalse）"""
+        with self._lock:
+            data = self.store.load('transcript', transcript_id)
+            if data is None:
+                return False
+            if session_id not in data["refs"]:
+                data["refs"].append(session_id)
+                self.store.save('transcript', transcript_id, data)
+        return True
+    
+    def get(self, transcript_id: str) -> str:
+        """本文を取得（なければNone）"""
+        data = self.store.load('transcript', transcript_id)
+        return data["text"] if data else None
+    
+    def text_of(self, data: dict) -> str:
+        """セッション・記事データから本文を取得（旧形式の埋め込み本文にも対応）"""
+        if data.get("transcript_id"):
+            return self.get(data["transcript_id"]) or ""
+        return data.get("transcription", "")
+    
+    def release(self, transcript_id: str, session_id: str) -> int:
+        """セッションの参照を外し、参照がなくなれば削除（解放バイト数を返す）"""
+        with self._lock:
+            meta = self.store.load_meta('transcript', transcript_id)
+            if meta is None:
+                return 0
+            refs = [ref for ref in meta.get("refs", []) if ref != session_id]
+            if refs:
+                if len(refs) != len(meta.get("refs", [])):
+                    data = self.store.load('transcript', transcript_id)
+                    data["refs"] = refs
+                    self.store.save('transcript', transcript_id, data)
+                return 0
+            return self.store.delete('transcript', transcript_id)
+
 class AudioProcessor:
-    """音声処理クラス（既存Whisperを使用）"""
+    """音声処理クラス（既存Whisperを使用）
+
+    Whisper CLI は非同期サブプロセスで実行し、--verbose True の標準出力を1行ずつ
+    セグメントとして解析する。出力全体は保持しないのでメモリ使用量は一定で、
+    実行中のジョブはプロセスグループごと停止できる。結果はジョブごとの
+    出力ディレクトリに書かせ、決まったパスから読み込んだら削除する。
+    TRANSCRIBE_BACKEND が faster-whisper のときは CLI を使わず、プロセス内で
+    共有する int8 量子化モデルで文字起こしする。
+    """
+    
+    # [00:01.000 --> 00:04.500] テキスト（1時間以上は HH:MM:SS.mmm）
+    SEGMENT_PATTERN = re.compile(r'^\[((?:\d+:)?\d{2}:\d{2}\.\d{3}) --> ((?:\d+:)?\d{2}:\d{2}\.\d{3})\]\s*(.*)$')
+    STDOUT_LINE_LIMIT = 1024 * 1024
+    STDERR_TAIL_BYTES = 8 * 1024
+    STDERR_TAIL_LINES = 10
+    # キャンセル時に SIGTERM から SIGKILL へ切り替えるまでの猶予
+    KILL_GRACE_SECONDS = 5
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        # job_id -> 停止を要求する関数
+        self._running = {}
     
     def allowed_file(self, filename: str) -> bool:
         """許可されたファイル拡張子かチェック"""
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
     
-    def transcribe_audio(self, audio_path: str) -> Dict[str, any]:
-        """既存のWhisperコマンドを使用して音声を文字起こし"""
+    def cancel(self, job_id: str) -> bool:
+        """実行中の文字起こしを停止（実行中でなければFalse）"""
+        with self._lock:
+            running = self._running.get(job_id)
+        if not running:
+            return False
+        running()
+        logger.info(f"文字起こしのキャンセルを要求: {job_id}")
+        return True
+    
+    def transcribe_audio(self, audio_path: str, job_id: str = None, on_segment=None) -> Dict[str, any]:
+        """既存のWhisperコマンドを使用して音声を文字起こし
+
+        on_segment(segment, count) はセグメントが出力されるたびに呼ばれる。
+        """
         try:
             logger.info(f"Whisperで音声文字起こし開始: {audio_path}")
             
@@ -78,131 +1273,63 @@ class AudioProcessor:
             file_size = os.path.getsize(audio_path)
             logger.info(f"音声ファイルサイズ: {file_size} bytes")
             
-            # Whisperコマンドを実行（デバッグ情報追加）
-            output_dir = os.path.dirname(audio_path)
+            if TRANSCRIBE_BACKEND == 'faster-whisper':
+                return self._transcribe_local(audio_path, job_id, on_segment)
             
-            # 出力ディレクトリの絶対パスを取得
-            output_dir = os.path.abspath(output_dir)
+            # ジョブごとの出力ディレクトリ（他のジョブの出力と混ざらず、結果のパスも一意に決まる）
             audio_path = os.path.abspath(audio_path)
+            os.makedirs(JOB_FOLDER, exist_ok=True)
+            output_dir = os.path.abspath(tempfile.mkdtemp(prefix=f"{job_id or 'job'}_", dir=JOB_FOLDER))
+            # Whisperは音声ファイル名から拡張子を除いた名前で出力する
+            result_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(audio_path))[0]}.txt")
             
-            cmd = f'whisper "{audio_path}" --language ja --output_dir "{output_dir}" --output_format txt --verbose True'
-            
-            logger.info(f"実行コマンド: {cmd}")
-            logger.info(f"音声ファイル（絶対パス）: {audio_path}")
-            logger.info(f"出力ディレクトリ（絶対パス）: {output_dir}")
+            cmd = ['whisper', audio_path, '--language', 'ja', '--output_dir', output_dir, '--output_format', 'txt', '--verbose', 'True']
+            logger.info(f"実行コマンド: {' '.join(cmd)}")
             
-            # 実行前のディレクトリ内容を確認
             try:
-                before_files = os.listdir(output_dir)
-                logger.info(f"実行前のディレクトリ内容: {before_files}")
-            except Exception as e:
-                logger.error(f"実行前ディレクトリ確認エラー: {e}")
-            
-            # Whisperコマンド実行
-            result = subprocess.run(
-                cmd, 
-                shell=True, 
-                capture_output=True, 
-                text=True, 
-                encoding='utf-8',
-                errors='replace',
-                cwd=output_dir  # 作業ディレクトリを明示的に設定
-            )
-            
-            logger.info(f"Whisperリターンコード: {result.returncode}")
-            logger.info(f"Whisper標準出力: {result.stdout}")
-            
-            if result.stderr:
-                logger.warning(f"Whisper標準エラー: {result.stderr}")
-            
-            # 実行後のディレクトリ内容を確認
-            try:
-                after_files = os.listdir(output_dir)
-                logger.info(f"実行後のディレクトリ内容: {after_files}")
-                
-                # 新しく作成されたファイルを特定
-                new_files = [f for f in after_files if f not in before_files]
-                logger.info(f"新しく作成されたファイル: {new_files}")
+                # Whisperコマンド実行（作業ディレクトリを明示的に設定）
+                result = asyncio.run(self._run_whisper(cmd, output_dir, job_id, on_segment))
                 
-            except Exception as e:
-                logger.error(f"実行後ディレクトリ確認エラー: {e}")
-            
-            if result.returncode != 0:
-                logger.error(f"Whisperエラー出力: {result.stderr}")
-                return {
-                    "success": False,
-                    "error": f"Whisperエラー (コード: {result.returncode}): {result.stderr}"
-                }
-            
-            # 期待されるテキストファイルのパスを生成
-            base_name = os.path.splitext(os.path.basename(audio_path))[0]
-            expected_txt_file = os.path.join(output_dir, f"{base_name}.txt")
-            
-            logger.info(f"期待されるテキストファイル: {expected_txt_file}")
-            
-            # すべての.txtファイルを検索
-            try:
-                all_files = os.listdir(output_dir)
-                txt_files = [f for f in all_files if f.endswith('.txt')]
-                logger.info(f"見つかった.txtファイル: {txt_files}")
+                logger.info(f"Whisperリターンコード: {result['returncode']}（セグメント {len(result['segments'])} 件）")
                 
-                # 各.txtファイルの詳細を確認
-                for txt_file in txt_files:
-                    full_path = os.path.join(output_dir, txt_file)
-                    size = os.path.getsize(full_path)
-                    logger.info(f"ファイル: {txt_file}, サイズ: {size} bytes")
+                if result["stderr"]:
+                    logger.warning(f"Whisper標準エラー（末尾）: {result['stderr']}")
                 
-            except Exception as e:
-                logger.error(f"ディレクトリ読み込みエラー: {e}")
-            
-            # 最初に期待されるファイルを確認
-            if os.path.exists(expected_txt_file):
-                logger.info(f"期待されるテキストファイルが見つかりました: {expected_txt_file}")
-                transcription = self._read_transcription_file(expected_txt_file)
-                if transcription:
+                if result["cancelled"]:
                     return {
-                        "success": True,
-                        "text": transcription,
-                        "language": "ja"
+                        "success": False,
+                        "cancelled": True,
+                        "error": "文字起こしをキャンセルしました"
                     }
-            
-            # 代替ファイル名で検索
-            possible_names = [
-                f"{base_name}.txt",
-                f"{os.path.basename(audio_path)}.txt",
-                # タイムスタンプ付きの元ファイル名から推測
-                f"{base_name.split('_', 1)[-1] if '_' in base_name else base_name}.txt"
-            ]
-            
-            for possible_name in possible_names:
-                possible_file = os.path.join(output_dir, possible_name)
-                if os.path.exists(possible_file):
-                    logger.info(f"代替ファイルが見つかりました: {possible_file}")
-                    transcription = self._read_transcription_file(possible_file)
-                    if transcription:
-                        return {
-                            "success": True,
-                            "text": transcription,
-                            "language": "ja"
-                        }
-            
-            # すべての.txtファイルを試行
-            for txt_file in txt_files:
-                full_path = os.path.join(output_dir, txt_file)
-                logger.info(f"全.txtファイル試行: {full_path}")
-                transcription = self._read_transcription_file(full_path)
-                if transcription:
+                
+                if result["returncode"] != 0:
                     return {
-                        "success": True,
-                        "text": transcription,
-                        "language": "ja"
+                        "success": False,
+                        "error": f"Whisperエラー (コード: {result['returncode']}): {result['stderr']}"
                     }
+                
+                transcription = self._read_transcription_file(result_path)
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            
+            if not transcription:
+                return {
+                    "success": False,
+                    "error": f"文字起こしファイルが見つからないか空です: {os.path.basename(result_path)}"
+                }
             
             return {
-                "success": False,
-                "error": f"文字起こしファイルが見つかりません。出力ディレクトリ: {output_dir}, 期待ファイル: {expected_txt_file}"
+                "success": True,
+                "text": transcription,
+                "language": "ja"
             }
                 
+        except FileNotFoundError:
+            logger.error("whisper コマンドが見つかりません")
+            return {
+                "success": False,
+                "error": "whisper コマンドが見つかりません（openai-whisper をインストールしてください）"
+            }
         except Exception as e:
             logger.error(f"音声文字起こしエラー: {str(e)}")
             return {
@@ -210,39 +1337,139 @@ class AudioProcessor:
                 "error": str(e)
             }
     
-    def _read_transcription_file(self, file_path: str) -> str:
-        """文字起こしファイルを読み込み"""
+    def _transcribe_local(self, audio_path: str, job_id: str, on_segment) -> Dict[str, any]:
+        """faster-whisper（int8 量子化モデル）で文字起こし"""
+        logger.info(f"ローカルモデルで文字起こし: {local_transcriber.describe()}")
+        stop_event = threading.Event()
+        if job_id:
+            with self._lock:
+                self._running[job_id] = stop_event.set
         try:
-            # 複数のエンコーディングで試行
-            encodings = ['utf-8', 'shift_jis', 'cp932', 'utf-8-sig']
-            
-            for encoding in encodings:
-                try:
-                    with open(file_path, 'r', encoding=encoding) as f:
-                        content = f.read().strip()
-                    if content:
-                        logger.info(f"エンコーディング {encoding} で読み込み成功: {len(content)} 文字")
-                        logger.info(f"文字起こし結果（最初の100文字）: {content[:100]}")
-                        return content
-                except UnicodeDecodeError as e:
-                    logger.warning(f"エンコーディング {encoding} で失敗: {e}")
+            return local_transcriber.transcribe(audio_path, on_segment, stop_event.is_set)
+        finally:
+            if job_id:
+                with self._lock:
+                    self._running.pop(job_id, None)
+    
+    async def _run_whisper(self, cmd: list, cwd: str, job_id: str, on_segment) -> Dict[str, any]:
+        """Whisperを実行し、標準出力をセグメントに解析しながら終了を待つ"""
+        env = dict(os.environ, PYTHONUNBUFFERED='1', PYTHONIOENCODING='utf-8')
+        # POSIXでは新しいプロセスグループで起動し、子プロセス（ffmpeg）ごと停止できるようにする
+        group = {'start_new_session': True} if os.name == 'posix' else {}
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            limit=self.STDOUT_LINE_LIMIT,
+            **group
+        )
+        
+        cancel_event = asyncio.Event()
+        if job_id:
+            with self._lock:
+                loop = asyncio.get_running_loop()
+                self._running[job_id] = lambda: loop.call_soon_threadsafe(cancel_event.set)
+        
+        segments = []
+        stderr_tail = bytearray()
+        
+        async def read_stdout():
+            async for raw in process.stdout:
+                line = raw.decode('utf-8', errors='replace').strip()
+                match = self.SEGMENT_PATTERN.match(line)
+                if not match:
+                    if line:
+                        logger.info(f"Whisper: {line}")
                     continue
-            
-            # 最後の手段：バイナリで読み込んで無効文字を置換
-            logger.info("バイナリモードで読み込み試行")
+                segment = {
+                    "start": self._parse_timestamp(match.group(1)),
+                    "end": self._parse_timestamp(match.group(2)),
+                    "text": match.group(3)
+                }
+                segments.append(segment)
+                if on_segment:
+                    on_segment(segment, len(segments))
+        
+        async def read_stderr():
+            # 進捗バーの \r 区切りなど行が長くなりうるので、末尾だけを保持する
+            while True:
+                chunk = await process.stderr.read(4096)
+                if not chunk:
+                    break
+                stderr_tail.extend(chunk)
+                del stderr_tail[:-self.STDERR_TAIL_BYTES]
+        
+        readers = asyncio.ensure_future(asyncio.gather(read_stdout(), read_stderr()))
+        cancel_wait = asyncio.ensure_future(cancel_event.wait())
+        try:
+            await asyncio.wait({readers, cancel_wait}, return_when=asyncio.FIRST_COMPLETED)
+            cancelled = cancel_event.is_set()
+            if cancelled:
+                await self._kill(process)
+            await readers
+            returncode = await process.wait()
+        except BaseException:
+            await self._kill(process)
+            raise
+        finally:
+            cancel_wait.cancel()
+            if job_id:
+                with self._lock:
+                    self._running.pop(job_id, None)
+        
+        return {
+            "returncode": returncode,
+            "segments": segments,
+            "stderr": '\n'.join(stderr_tail.decode('utf-8', errors='replace').splitlines()[-self.STDERR_TAIL_LINES:]).strip(),
+            "cancelled": cancelled
+        }
+    
+    async def _kill(self, process):
+        """SIGTERM で停止を促し、猶予を過ぎたら SIGKILL（POSIXではプロセスグループごと）"""
+        if process.returncode is not None:
+            return
+        for force in (False, True):
+            try:
+                if os.name == 'posix':
+                    os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+                elif force:
+                    process.kill()
+                else:
+                    process.terminate()
+            except ProcessLookupError:
+                return
+            try:
+                await asyncio.wait_for(process.wait(), self.KILL_GRACE_SECONDS)
+                return
+            except asyncio.TimeoutError:
+                logger.warning(f"Whisperが終了しないため強制終了します (pid: {process.pid})")
+    
+    def _parse_timestamp(self, value: str) -> float:
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    
+    def _read_transcription_file(self, file_path: str) -> str:
+        """文字起こしファイルを1回で読み込み（UTF-8（BOM有無とも）で読めなければ cp932）"""
+        try:
             with open(file_path, 'rb') as f:
                 raw_data = f.read()
-            content = raw_data.decode('utf-8', errors='replace').strip()
-            
-            if content:
-                logger.info(f"バイナリモードで読み込み成功: {len(content)} 文字")
-                return content
-            
-            return ""
-            
-        except Exception as e:
-            logger.error(f"ファイル読み込みエラー {file_path}: {e}")
+        except FileNotFoundError:
+            logger.error(f"文字起こしファイルが見つかりません: {file_path}")
             return ""
+        
+        try:
+            content, encoding = raw_data.decode('utf-8-sig'), 'utf-8'
+        except UnicodeDecodeError:
+            content, encoding = raw_data.decode('cp932', errors='replace'), 'cp932'
+        content = content.strip()
+        
+        logger.info(f"文字起こしファイル読み込み: {len(content)} 文字（{encoding}）")
+        logger.info(f"文字起こし結果（最初の100文字）: {content[:100]}")
+        return content
 
 class SuperImprovedArticleGenerator:
     """超改良版記事生成クラス（まるつー風プロ仕様）"""
@@ -992,111 +2219,991 @@ class QualityChecker:
         else:
             return "要改善"
 
-# インスタンス作成（超改良版を使用）
-audio_processor = AudioProcessor()
-article_generator = SuperImprovedArticleGenerator()
-quality_checker = QualityChecker()
-
-@app.route('/')
-def index():
-    """メインページ"""
-    return render_template('index.html')
-
-@app.route('/upload', methods=['POST'])
-def upload_audio():
-    """音声ファイルアップロード"""
-    try:
-        if 'audio_file' not in request.files:
-            return jsonify({"success": False, "error": "音声ファイルが選択されていません"})
-        
-        file = request.files['audio_file']
-        if file.filename == '':
-            return jsonify({"success": False, "error": "ファイルが選択されていません"})
-        
-        if not audio_processor.allowed_file(file.filename):
-            return jsonify({"success": False, "error": "対応していないファイル形式です"})
-        
-        # ファイル保存（日本語ファイル名対策）
-        original_filename = file.filename
-        safe_filename = secure_filename(file.filename)
-        
-        # 日本語ファイル名の場合、英数字に変換
-        if not safe_filename or safe_filename != original_filename:
-            # 拡張子を取得
-            file_ext = os.path.splitext(original_filename)[1]
-            # タイムスタンプベースの安全なファイル名を生成
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            safe_filename = f"audio_{timestamp}{file_ext}"
-            logger.info(f"ファイル名を変更: {original_filename} → {safe_filename}")
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{safe_filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        
-        # ファイルパスが英数字のみかログ出力
-        logger.info(f"保存ファイルパス: {filepath}")
-        
-        file.save(filepath)
-        
-        # 音声文字起こし
-        transcription_result = audio_processor.transcribe_audio(filepath)
-        
-        if not transcription_result["success"]:
-            os.remove(filepath)
-            return jsonify(transcription_result)
-        
-        # セッションデータ保存
-        session_data = {
-            "filepath": filepath,
-            "filename": filename,
-            "original_filename": original_filename,
-            "transcription": transcription_result["text"]
-        }
-        
-        session_file = f"{UPLOAD_FOLDER}/session_{timestamp}.json"
-        with open(session_file, 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, ensure_ascii=False, indent=2)
-        
-        return jsonify({
-            "success": True,
-            "session_id": timestamp,
-            "transcription": transcription_result["text"],
-            "original_filename": original_filename,
-            "safe_filename": filename
-        })
+class ArticleExporter:
+    """記事のエクスポート用ファイルを生成するクラス"""
+    
+    FORMATS = {
+        'html': 'text/html; charset=utf-8',
+        'txt': 'text/plain; charset=utf-8',
+        'md': 'text/markdown; charset=utf-8'
+    }
+    
+    def render(self, article_data: dict, format: str) -> str:
+        """指定形式で記事を描画"""
+        if format == 'html':
+            return self._render_html(article_data)
+        elif format == 'txt':
+            return self._render_txt(article_data)
+        elif format == 'md':
+            return self._render_markdown(article_data)
+        raise ValueError(f"対応していないエクスポート形式です: {format}")
+    
+    def _render_html(self, article_data: dict) -> str:
+        return f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <title>{article_data['title']}</title>
+    <style>
+        body {{ 
+            font-family: 'Hiragino Sans', 'Yu Gothic', sans-serif; 
+            line-height: 1.8; 
+            margin: 2em auto; 
+            max-width: 800px;
+            padding: 0 1em;
+        }}
+        h1 {{ 
+            color: #2c3e50; 
+            border-bottom: 3px solid #3498db; 
+            padding-bottom: 0.5em;
+        }}
+        h2 {{ 
+            color: #34495e; 
+            border-left: 4px solid #3498db; 
+            padding-left: 1em;
+            margin-top: 2em;
+        }}
+        .meta {{ 
+            color: #7f8c8d; 
+            margin-bottom: 2em; 
+            padding: 1em;
+            background: #f8f9fa;
+            border-radius: 5px;
+        }}
+        .content {{ 
+            white-space: pre-line; 
+            font-size: 16px;
+        }}
+        .interview {{ 
+            margin: 2em 0; 
+        }}
+    </style>
+</head>
+<body>
+    <h1>{article_data['title']}</h1>
+    <div class="meta">
+        📅 作成日: {article_data['created_at'][:10]}<br>
+        📝 文字数: {article_data['word_count']}文字<br>
+        🏷️ カテゴリ: {article_data['category']}<br>
+        📍 場所: {article_data.get('location', '香川県')}
+    </div>
+    <div class="content">{article_data['article_content']}</div>
+    <hr style="margin-top: 3em; border: none; border-top: 2px solid #ecf0f1;">
+    <p style="text-align: center; color: #7f8c8d; font-size: 14px;">
+        この記事は「まるつー記事作る君」で生成されました
+    </p>
+</body>
+</html>"""
+    
+    def _render_txt(self, article_data: dict) -> str:
+        return f"""{article_data['title']}
+
+=====================================
+📅 作成日: {article_data['created_at'][:10]}
+📝 文字数: {article_data['word_count']}文字
+🏷️ カテゴリ: {article_data['category']}
+📍 場所: {article_data.get('location', '香川県')}
+=====================================
+
+{article_data['article_content']}
+
+---
+この記事は「まるつー記事作る君」で生成されました"""
+    
+    def _render_markdown(self, article_data: dict) -> str:
+        return f"""# {article_data['title']}
+
+- 作成日: {article_data['created_at'][:10]}
+- 文字数: {article_data['word_count']}文字
+- カテゴリ: {article_data['category']}
+- 場所: {article_data.get('location', '香川県')}
+
+{article_data['article_content']}
+
+---
+この記事は「まるつー記事作る君」で生成されました
+"""
+
+class ZipStreamBuffer:
+    """ZipFile の書き込み先として使い、書かれたバイト列を順次取り出すバッファ
+
+    seek() を持たないため ZipFile はデータディスクリプタ形式で書き込み、
+    アーカイブ全体をメモリやディスクに溜めずにストリーム配信できる。
+    """
+    
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._offset
+    
+    def flush(self):
+        pass
+    
+    def pop(self) -> bytes:
+        """溜まったバイト列を取り出して空にする"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+class ExportCache:
+    """記事のバージョンごとにエクスポート結果をキャッシュするクラス
+
+    メモリ（LRU）→ ディスク（exports/）→ 描画 の順に探す。記事ファイルの
+    更新時刻とサイズをバージョンとして使うため、記事が更新されると自動的に
+    描画し直される。ETagは描画結果のSHA-256（強いETag）。
+    """
+    
+    def __init__(self, export_folder: str, max_entries: int):
+        self.export_folder = export_folder
+        self._entries = LRUCache(max_entries)
+        os.makedirs(export_folder, exist_ok=True)
+    
+    def get(self, session_id: str, format: str) -> Dict[str, any]:
+        """エクスポート結果を取得（記事がなければNone）"""
+        version = self._article_version(session_id)
+        if version is None:
+            return None
+        
+        key = (session_id, format)
+        entry = self._entries.get(key)
+        if entry and entry["version"] == version:
+            return entry
+        
+        disk_path = self._disk_path(session_id, version, format)
+        if os.path.exists(disk_path):
+            with open(disk_path, 'rb') as f:
+                data = f.read()
+            title = artifact_store.load_meta('article', session_id)["title"]
+        else:
+            # 描画元はキャッシュを通さずに読み、実際に読んだファイルのバージョンで保存する
+            # （stat の後に記事が更新されても、古い内容を新しいバージョン名で残さない）
+            article_data, source_version = artifact_store.load_versioned('article', session_id)
+            if article_data is None:
+                return None
+            version = self._format_version(source_version)
+            data = article_exporter.render(article_data, format).encode('utf-8')
+            title = article_data["title"]
+            self._write_disk(session_id, version, format, data)
+        
+        entry = {
+            "version": version,
+            "etag": hashlib.sha256(data).hexdigest(),
+            "data": data,
+            "title": title,
+            "mimetype": ArticleExporter.FORMATS[format]
+        }
+        self._entries.put(key, entry)
+        return entry
+    
+    def invalidate(self, session_id: str) -> int:
+        """セッションのキャッシュを破棄（解放したディスク容量を返す）"""
+        self._entries.invalidate_where(lambda key: key[0] == session_id)
+        freed_bytes = 0
+        for path in glob.glob(os.path.join(self.export_folder, f"export_{glob.escape(session_id)}_*")):
+            freed_bytes += os.path.getsize(path)
+            os.remove(path)
+        return freed_bytes
+    
+    def stats(self) -> Dict[str, any]:
+        return self._entries.stats()
+    
+    def _article_version(self, session_id: str) -> str:
+        version = artifact_store.version('article', session_id)
+        return self._format_version(version) if version else None
+    
+    def _format_version(self, version) -> str:
+        mtime_ns, size = version
+        return f"{mtime_ns:x}{size:x}"
+    
+    def _disk_path(self, session_id: str, version: str, format: str) -> str:
+        return os.path.join(self.export_folder, f"export_{session_id}_{version}.{format}")
+    
+    def _write_disk(self, session_id: str, version: str, format: str, data: bytes):
+        # 古いバージョンのファイルを削除してから書き込む
+        for path in glob.glob(os.path.join(self.export_folder, f"export_{glob.escape(session_id)}_*.{format}")):
+            os.remove(path)
+        path = self._disk_path(session_id, version, format)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+class UploadSweeper:
+    """uploads/ の保持期間・容量上限を管理するバックグラウンド掃除クラス
+
+    ディレクトリを SWEEP_BATCH_SIZE 件ずつ処理し、バッチの間で休むことで
+    リクエスト処理スレッドを妨げないようにする。
+    """
+    
+    # 名前の先頭のセッションID（エクスポートは export_<id>_<version> なのでランダム部の後ろは _ か末尾）
+    SESSION_ID_PATTERN = re.compile(r'^(\d{8}_\d{6}(?:_[0-9a-f]{6}(?=_|$))?)')
+    BATCH_PAUSE_SECONDS = 0.05
+    
+    def __init__(self, upload_folder: str, retention_days: dict, quota_bytes: int, interval: int):
+        self.upload_folder = upload_folder
+        self.retention_days = retention_days
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "runs": 0,
+            "deleted_files": 0,
+            "reclaimed_bytes": {"audio": 0, "session": 0, "article": 0, "export": 0, "incoming": 0, "jobs": 0, "quota": 0},
+            "last_run_at": None,
+            "last_run_seconds": 0.0,
+            "last_total_bytes": 0
+        }
+    
+    def start(self):
+        """掃除スレッドを開始"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name='upload-sweeper', daemon=True)
+        self._thread.start()
+        logger.info(f"アップロード掃除スレッド開始（間隔: {self.interval}秒）")
+    
+    def stop(self):
+        """掃除スレッドを停止"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+    
+    def snapshot(self) -> Dict[str, any]:
+        """メトリクスのコピーを取得"""
+        with self._stats_lock:
+            return json.loads(json.dumps(self.stats))
+    
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"アップロード掃除エラー: {str(e)}")
+            self._stop_event.wait(self.interval)
+    
+    def sweep(self) -> Dict[str, int]:
+        """1周分の掃除を実行し、種類ごとの解放バイト数を返す"""
+        started = time.monotonic()
+        reclaimed = {"audio": 0, "session": 0, "article": 0, "export": 0, "incoming": 0, "jobs": 0, "quota": 0}
+        deleted_files = 0
+        total_bytes = blob_store.total_bytes()
+        sessions = {}
+        article_ids = set()
+        exports = []
+        
+        scanned = True
+        for count, entry in enumerate(self._iter_entries(), 1):
+            if count % SWEEP_BATCH_SIZE == 0:
+                if self._stop_event.wait(self.BATCH_PAUSE_SECONDS):
+                    scanned = False
+                    break
+            if not entry.is_file():
+                continue
+            
+            size = entry.stat().st_size
+            total_bytes += size
+            kind = self._classify(entry.name)
+            artifact_id = self._artifact_id(entry.name)
+            
+            if kind == 'session':
+                sessions[artifact_id] = entry.path
+            elif kind == 'article':
+                article_ids.add(artifact_id)
+                if self._is_expired('article', artifact_id, entry):
+                    artifact_store.delete('article', artifact_id)
+                    archive_index.remove(artifact_id, 'article')
+                    export_cache.invalidate(artifact_id)
+                    article_ids.discard(artifact_id)
+                    reclaimed["article"] += size
+                    deleted_files += 1
+                    total_bytes -= size
+            elif kind == 'export':
+                exports.append((artifact_id, entry, size))
+            elif kind == 'audio' and self._is_expired('audio', artifact_id, entry):
+                # 旧形式（ブロブストア移行前）の音声とWhisper出力
+                os.remove(entry.path)
+                reclaimed["audio"] += size
+                deleted_files += 1
+                total_bytes -= size
+        
+        # セッション: 期限切れなら丸ごと削除、音声の期限切れなら音声参照のみ解放
+        for session_id, path in sessions.items():
+            if self._is_expired('session', session_id, None, path):
+                freed = remove_session_artifacts(session_id)
+                reclaimed["session"] += freed
+                total_bytes -= freed
+                deleted_files += 1
+                article_ids.discard(session_id)
+            elif self._is_expired('audio', session_id, None, path):
+                freed = self._release_session_audio(session_id)
+                reclaimed["audio"] += freed
+                total_bytes -= freed
+        
+        # 削除済みセッションへの音声参照（全件を見終えたときだけ判定できる）
+        if scanned:
+            purged, freed = blob_store.prune_refs(set(sessions), JOB_DIR_TTL_SECONDS)
+            reclaimed["audio"] += freed
+            total_bytes -= freed
+            deleted_files += purged
+        
+        # エクスポート: 記事が存在しない孤立ファイルと期限切れファイルを削除
+        for artifact_id, entry, size in exports:
+            if not os.path.exists(entry.path):
+                continue
+            if artifact_id not in article_ids or self._is_expired('export', artifact_id, entry):
+                os.remove(entry.path)
+                reclaimed["export"] += size
+                deleted_files += 1
+                total_bytes -= size
+        
+        # 中断されたまま再開されない分割アップロード
+        purged, freed = resumable_uploads.purge_stale(RESUMABLE_UPLOAD_TTL_HOURS * 3600)
+        reclaimed["incoming"] += freed
+        deleted_files += purged
+        
+        # 異常終了で残った文字起こしジョブの出力ディレクトリ
+        purged, freed = self._purge_job_dirs()
+        reclaimed["jobs"] += freed
+        deleted_files += purged
+        
+        # 容量上限: 古いセッションから順に削除
+        if self.quota_bytes and total_bytes > self.quota_bytes:
+            for session_id in sorted(sid for sid in sessions if os.path.exists(sessions[sid])):
+                if total_bytes <= self.quota_bytes:
+                    break
+                freed = remove_session_artifacts(session_id)
+                reclaimed["quota"] += freed
+                total_bytes -= freed
+                deleted_files += 1
+        
+        elapsed = time.monotonic() - started
+        with self._stats_lock:
+            self.stats["runs"] += 1
+            self.stats["deleted_files"] += deleted_files
+            for kind, freed in reclaimed.items():
+                self.stats["reclaimed_bytes"][kind] += freed
+            self.stats["last_run_at"] = datetime.now().isoformat()
+            self.stats["last_run_seconds"] = round(elapsed, 3)
+            self.stats["last_total_bytes"] = total_bytes
+        
+        if sum(reclaimed.values()):
+            logger.info(f"アップロード掃除完了: {reclaimed} bytes 解放, 使用量 {total_bytes} bytes, {elapsed:.2f}秒")
+        return reclaimed
+    
+    def _purge_job_dirs(self):
+        """JOB_DIR_TTL_SECONDS を過ぎたジョブ出力ディレクトリを削除（件数, 解放バイト数）"""
+        if not os.path.isdir(JOB_FOLDER):
+            return 0, 0
+        now = time.time()
+        with os.scandir(JOB_FOLDER) as entries:
+            stale = [entry.path for entry in entries if entry.is_dir() and now - entry.stat().st_mtime > JOB_DIR_TTL_SECONDS]
+        freed = 0
+        for path in stale:
+            for root, _, files in os.walk(path):
+                freed += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+            shutil.rmtree(path, ignore_errors=True)
+        return len(stale), freed
+    
+    def _iter_entries(self):
+        """uploads/ 直下とエクスポートキャッシュのエントリを順に返す"""
+        for folder in (self.upload_folder, EXPORT_FOLDER):
+            if not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as entries:
+                yield from entries
+    
+    def _classify(self, name: str) -> str:
+        if name.startswith('session_') and name.endswith(('.json', ArtifactStore.EXTENSION)):
+            return 'session'
+        if name.startswith('article_') and name.endswith(('.json', ArtifactStore.EXTENSION)):
+            return 'article'
+        if name.startswith('export_'):
+            return 'export'
+        if self.SESSION_ID_PATTERN.match(name) and (audio_processor.allowed_file(name) or name.endswith('.txt')):
+            return 'audio'
+        return None
+    
+    def _artifact_id(self, name: str) -> str:
+        stem = os.path.splitext(name)[0]
+        for prefix in ('session_', 'article_', 'export_'):
+            if stem.startswith(prefix):
+                stem = stem[len(prefix):]
+                break
+        # エクスポートキャッシュは export_<id>_<version> 形式
+        match = self.SESSION_ID_PATTERN.match(stem)
+        return match.group(1) if match else stem
+    
+    def _is_expired(self, kind: str, artifact_id: str, entry=None, path: str = None) -> bool:
+        days = self.retention_days.get(kind, 0)
+        if days <= 0:
+            return False
+        created = session_timestamp(artifact_id)
+        if created is None:
+            created = entry.stat().st_mtime if entry else os.path.getmtime(path)
+        return time.time() - created > days * 86400
+    
+    def _release_session_audio(self, session_id: str) -> int:
+        """文字起こし済みセッションの音声参照だけを解放"""
+        session_data = artifact_store.load('session', session_id)
+        digest = session_data.pop("blob_sha256", None) if session_data else None
+        if not digest:
+            return 0
+        session_data["filepath"] = None
+        artifact_store.save('session', session_id, session_data)
+        return blob_store.release(digest, session_id)
+
+class ProgressTracker:
+    """ジョブごとの進捗を保持し、Server-Sent Events で配信するクラス
+
+    段階: received（受信中）→ queued（順番待ち）→ transcribing（文字起こし中）
+    → generating（記事生成中）→ done / error
+    購読者はジョブごとの Condition で待機するため、更新がない間はCPUを使わない。
+    終了したジョブは ttl 秒、終了していないジョブは更新がないまま idle_ttl 秒で削除し、
+    削除されたジョブの購読は expired で終了する。
+    """
+    
+    JOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+    FINAL_STAGES = ('done', 'error', 'expired')
+    # 受信バイト数はこの間隔ごとに通知する
+    BYTES_NOTIFY_INTERVAL = 256 * 1024
+    
+    def __init__(self, heartbeat: int, ttl: int, idle_ttl: int):
+        self.heartbeat = heartbeat
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._subscribers = 0
+    
+    def valid_job_id(self, job_id: str) -> bool:
+        return bool(job_id and self.JOB_ID_PATTERN.match(job_id))
+    
+    def update(self, job_id: str, stage: str, **fields):
+        """ジョブの進捗を更新して購読者に通知"""
+        if not job_id:
+            return
+        with self._lock:
+            job = self._get_job(job_id)
+            job["state"].update(fields, stage=stage, updated_at=time.time())
+            job["version"] += 1
+            job["condition"].notify_all()
+            self._purge_expired()
+    
+    def finish(self, job_id: str, result: dict):
+        """処理結果に応じてジョブを完了またはエラーにする"""
+        if result.get("success"):
+            self.update(job_id, 'done')
+        else:
+            self.update(job_id, 'error', message=result.get("error", ""))
+    
+    def watch_upload(self, job_id: str, environ: dict):
+        """リクエストボディの受信バイト数を進捗として通知するよう入力ストリームを包む"""
+        total = int(environ.get('CONTENT_LENGTH') or 0)
+        self.update(job_id, 'received', bytes_received=0, bytes_total=total)
+        environ['wsgi.input'] = _ProgressInputStream(
+            environ['wsgi.input'],
+            lambda received: self.update(job_id, 'received', bytes_received=received, bytes_total=total),
+            self.BYTES_NOTIFY_INTERVAL,
+            total
+        )
+    
+    def stream(self, job_id: str):
+        """SSEのイベント列を生成（完了・エラー・期限切れで終了）"""
+        last_version = -1
+        with self._lock:
+            self._subscribers += 1
+        try:
+            with self._lock:
+                job = self._get_job(job_id)
+            while True:
+                with self._lock:
+                    if job["version"] == last_version:
+                        job["condition"].wait(self.heartbeat)
+                    self._purge_expired()
+                    current = self._jobs.get(job_id)
+                    if current is None:
+                        # 開始されないまま期限切れ（終了後に削除されたジョブへの再接続を含む）
+                        state = {"job_id": job_id, "stage": "expired", "updated_at": time.time()}
+                    else:
+                        if current is not job:
+                            # 期限切れで削除された後に処理が始まり、作り直されたジョブ
+                            job = current
+                            last_version = -1
+                        state = None
+                        if job["version"] != last_version:
+                            last_version = job["version"]
+                            state = dict(job["state"])
+                
+                if state is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: progress\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+                if state.get("stage") in self.FINAL_STAGES:
+                    return
+        finally:
+            with self._lock:
+                self._subscribers -= 1
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"jobs": len(self._jobs), "subscribers": self._subscribers}
+    
+    def _get_job(self, job_id: str) -> dict:
+        # 購読がアップロード開始より先に来ても待てるよう、未知のIDは作成する
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = {
+                "state": {"job_id": job_id, "stage": "pending", "updated_at": time.time()},
+                "version": 0,
+                "condition": threading.Condition(self._lock)
+            }
+            self._jobs[job_id] = job
+        return job
+    
+    def _purge_expired(self):
+        now = time.time()
+        for job_id in [
+            job_id for job_id, job in self._jobs.items()
+            if now - job["state"]["updated_at"] > (self.ttl if job["state"]["stage"] in self.FINAL_STAGES else self.idle_ttl)
+        ]:
+            del self._jobs[job_id]
+
+class _ProgressInputStream:
+    """読み込んだバイト数を一定間隔でコールバックに通知する入力ストリーム"""
+    
+    def __init__(self, stream, callback, interval: int, total: int):
+        self._stream = stream
+        self._callback = callback
+        self._interval = interval
+        self._total = total
+        self._received = 0
+        self._notified = 0
+    
+    def read(self, *args):
+        return self._count(self._stream.read(*args))
+    
+    def readline(self, *args):
+        return self._count(self._stream.readline(*args))
+    
+    def _count(self, data: bytes) -> bytes:
+        self._received += len(data)
+        if self._received - self._notified >= self._interval or (data and self._received >= self._total):
+            self._notified = self._received
+            self._callback(self._received)
+        return data
+
+# インスタンス作成（超改良版を使用）
+audio_processor = AudioProcessor()
+blob_store = AudioBlobStore(BLOB_FOLDER)
+resumable_uploads = ResumableUploadStore(UPLOAD_INCOMING_FOLDER, UPLOAD_CHUNK_SIZE, app.config['MAX_CONTENT_LENGTH'])
+artifact_store = ArtifactStore(UPLOAD_FOLDER, cache_entries=ARTIFACT_CACHE_ENTRIES)
+transcript_store = TranscriptStore(artifact_store)
+archive_index = ArchiveIndex(ARCHIVE_DB)
+article_generator = SuperImprovedArticleGenerator()
+quality_checker = QualityChecker()
+article_exporter = ArticleExporter()
+export_cache = ExportCache(EXPORT_FOLDER, EXPORT_CACHE_ENTRIES)
+progress_tracker = ProgressTracker(PROGRESS_HEARTBEAT_SECONDS, PROGRESS_TTL_SECONDS, PROGRESS_IDLE_TTL_SECONDS)
+transcribe_slots = threading.BoundedSemaphore(TRANSCRIBE_CONCURRENCY)
+validation_stats = ValidationStats()
+upload_sweeper = UploadSweeper(UPLOAD_FOLDER, RETENTION_DAYS, UPLOAD_QUOTA_MB * 1024 * 1024, SWEEP_INTERVAL_SECONDS)
+
+# バックグラウンド処理を開始したプロセスの pid（fork 後の子プロセスでは改めて開始する）
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background_services():
+    """検索インデックスの初期構築と掃除スレッドを開始（リクエストを処理するプロセスごとに1回だけ）"""
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    
+    def run():
+        # 構築中に掃除でファイルが消えないよう、インデックスを作ってから掃除を始める
+        try:
+            if archive_index.is_empty():
+                archive_index.rebuild(artifact_store, UPLOAD_FOLDER)
+        except Exception as e:
+            logger.error(f"検索インデックス再構築エラー: {str(e)}")
+        upload_sweeper.start()
+    
+    threading.Thread(target=run, name='background-init', daemon=True).start()
+
+@app.before_request
+def ensure_background_services():
+    # WSGI サーバーの各ワーカーでも、最初のリクエストで開始する
+    # （リローダーの親プロセスはリクエストを処理しないので開始されない）
+    start_background_services()
+
+def session_timestamp(session_id: str):
+    """セッションIDの作成時刻（UNIX時刻、解釈できなければNone）"""
+    try:
+        return datetime.strptime(session_id[:15], "%Y%m%d_%H%M%S").timestamp()
+    except ValueError:
+        return None
+
+def remove_session_artifacts(session_id: str) -> int:
+    """セッションと関連ファイルを削除し、音声の参照も解放（解放バイト数を返す）"""
+    freed_bytes = 0
+    
+    session_data = artifact_store.load_meta('session', session_id)
+    if session_data and session_data.get("blob_sha256"):
+        freed_bytes += blob_store.release(session_data["blob_sha256"], session_id)
+    if session_data and session_data.get("transcript_id"):
+        freed_bytes += transcript_store.release(session_data["transcript_id"], session_id)
+    
+    freed_bytes += artifact_store.delete('session', session_id)
+    freed_bytes += artifact_store.delete('article', session_id)
+    freed_bytes += export_cache.invalidate(session_id)
+    archive_index.remove(session_id)
+    
+    for path in (
+        f"{UPLOAD_FOLDER}/export_{session_id}.html",
+        f"{UPLOAD_FOLDER}/export_{session_id}.txt"
+    ):
+        if os.path.exists(path):
+            freed_bytes += os.path.getsize(path)
+            os.remove(path)
+    
+    return freed_bytes
+
+@app.route('/')
+def index():
+    """メインページ"""
+    return render_template('index.html')
+
+@app.route('/upload', methods=['POST'])
+def upload_audio():
+    """音声ファイルアップロード（?job_id= を付けると /progress/<job_id> で進捗を配信）
+
+    ファイルの代わりに JSON で sha256・filename・size を送ると、同じ内容の音声が
+    保存済みなら転送なしでそのブロブと文字起こしを使ってセッションを作成する。
+    未登録なら known: false を返すので、クライアントは通常どおりアップロードする。
+    """
+    job_id = request.args.get('job_id')
+    if not progress_tracker.valid_job_id(job_id):
+        job_id = None
+    
+    if request.is_json:
+        result = _link_known_upload(job_id)
+        if result.get("known") is False:
+            # 続く本アップロードが同じジョブIDで進捗を配信する
+            return jsonify(result)
+    else:
+        if job_id:
+            # request.files に触れる前に入力ストリームを差し替える
+            progress_tracker.watch_upload(job_id, request.environ)
+        result = _process_upload(job_id)
+    
+    progress_tracker.finish(job_id, result)
+    return jsonify(result)
+
+def _link_known_upload(job_id: str) -> Dict[str, any]:
+    """SHA-256 が一致する保存済みの音声に新しいセッションを紐づける"""
+    # 信頼の境界: 音声の所持は確認せず、SHA-256 とサイズを知っていれば保存済みの
+    # 音声と文字起こしを新しいセッションで使える。利用者を区別しない単一ユーザー
+    # 前提の機能なので、複数の利用者で共有する場合はこのエンドポイントを無効にするか、
+    # サーバーが選んだ範囲のハッシュを求めるなどの所持確認を追加すること
+    try:
+        data = request.get_json(silent=True) or {}
+        digest = str(data.get('sha256') or '').lower()
+        original_filename = data.get('filename') or ''
+        
+        if not SHA256_PATTERN.match(digest):
+            return {"success": False, "error": "SHA-256の形式が不正です"}
+        if not audio_processor.allowed_file(original_filename):
+            return {"success": False, "error": "対応していないファイル形式です"}
+        
+        safe_filename, filename, timestamp = _upload_filenames(original_filename)
+        blob = blob_store.add_ref(digest, timestamp)
+        if blob and data.get('size') not in (None, blob["size"]):
+            # 既存の参照は他のアップロードのものなので、この呼び出しで追加した参照だけ外す
+            if blob["ref_added"]:
+                blob_store.release(digest, timestamp)
+            blob = None
+        if not blob:
+            return {"success": False, "known": False}
+        
+        logger.info(f"保存済みの音声を転送なしで再利用: {original_filename} ({digest}, {blob['size']} bytes)")
+        return _transcribe_upload(job_id, blob, original_filename, filename, timestamp)
+    except Exception as e:
+        logger.error(f"音声の照合エラー: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+def _process_upload(job_id: str) -> Dict[str, any]:
+    """アップロードされた音声を保存して文字起こしし、セッションを作成"""
+    try:
+        if 'audio_file' not in request.files:
+            return {"success": False, "error": "音声ファイルが選択されていません"}
+        
+        file = request.files['audio_file']
+        if file.filename == '':
+            return {"success": False, "error": "ファイルが選択されていません"}
+        
+        if not audio_processor.allowed_file(file.filename):
+            return {"success": False, "error": "対応していないファイル形式です"}
+        
+        original_filename = file.filename
+        safe_filename, filename, timestamp = _upload_filenames(original_filename)
+        
+        # 同じ内容の音声は1つのブロブを共有する
+        blob = blob_store.put(file.stream, os.path.splitext(safe_filename)[1], timestamp)
+        return _transcribe_upload(job_id, blob, original_filename, filename, timestamp)
         
     except RequestEntityTooLarge:
-        return jsonify({"success": False, "error": "ファイルサイズが大きすぎます（最大100MB）"})
+        return {"success": False, "error": "ファイルサイズが大きすぎます（最大100MB）"}
     except Exception as e:
         logger.error(f"音声アップロードエラー: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+def _upload_filenames(original_filename: str):
+    """保存用の安全なファイル名・セッションのファイル名・セッションIDを決める"""
+    # ファイル保存（日本語ファイル名対策）
+    safe_filename = secure_filename(original_filename)
+    
+    # 日本語ファイル名の場合、英数字に変換
+    if not safe_filename or safe_filename != original_filename:
+        # 拡張子を取得
+        file_ext = os.path.splitext(original_filename)[1]
+        # タイムスタンプベースの安全なファイル名を生成
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        safe_filename = f"audio_{timestamp}{file_ext}"
+        logger.info(f"ファイル名を変更: {original_filename} → {safe_filename}")
+    
+    # 同じ秒のアップロードが重ならないようにランダムな接尾辞を付ける
+    session_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    while artifact_store.exists('session', session_id):
+        session_id = f"{session_id[:15]}_{uuid.uuid4().hex[:6]}"
+    return safe_filename, f"{session_id}_{safe_filename}", session_id
+
+def _transcribe_upload(job_id: str, blob: dict, original_filename: str, filename: str, timestamp: str) -> Dict[str, any]:
+    """ブロブに保存済みの音声を検証・文字起こしし、セッションを作成"""
+    filepath = blob["path"]
+    
+    # ファイルパスが英数字のみかログ出力
+    logger.info(f"保存ファイルパス: {filepath}")
+    
+    # 同じ音声を文字起こし済みなら、検証もAPI呼び出しもせずに本文を再利用
+    if blob.get("transcript_id") and transcript_store.add_ref(blob["transcript_id"], timestamp):
+        logger.info(f"文字起こしを再利用: {original_filename} → {blob['transcript_id']}")
+        text = transcript_store.get(blob["transcript_id"])
+        return _save_upload_session(blob, blob["transcript_id"], text, original_filename, filename, timestamp, [])
+    
+    # 形式・構造の事前検証（壊れたファイルは文字起こしに回さない）
+    validation = validate_file(filepath, original_filename)
+    if validation["valid"]:
+        # 無音・音割れ・音楽ばかりの録音は文字起こしに回さない
+        merge_analysis(validation, analyze_file(filepath, validation["duration"]))
+    validation_stats.record(validation, blob["size"])
+    if not validation["valid"]:
+        logger.warning(f"事前検証で除外: {original_filename} {validation['errors']}")
+        blob_store.release(blob["sha256"], timestamp)
+        reason = "文字起こしに適さない録音です" if validation.get("analysis") else "音声ファイルが壊れているか対応していない形式です"
+        return {"success": False, "error": f"{reason}: {'、'.join(validation['errors'])}"}
+    
+    # 音声文字起こし（同時実行数を超えたら順番待ち）
+    duration = validation["duration"]
+    progress_tracker.update(job_id, 'queued')
+    with transcribe_slots:
+        progress_tracker.update(job_id, 'transcribing', position=0, duration=duration, segments=0)
+        # セグメントが出るたびに再生位置と直近のテキストを配信
+        transcription_result = audio_processor.transcribe_audio(
+            filepath,
+            job_id,
+            lambda segment, count: progress_tracker.update(
+                job_id, 'transcribing', position=segment["end"], duration=duration, segments=count, text=segment["text"]
+            )
+        )
+    
+    if not transcription_result["success"]:
+        blob_store.release(blob["sha256"], timestamp)
+        return transcription_result
+    
+    # 文字起こし本文はIDで参照し、ブロブにも記録して次回の再アップロードで再利用する
+    transcript_id = transcript_store.put(transcription_result["text"], timestamp)
+    blob_store.set_transcript(blob["sha256"], transcript_id)
+    return _save_upload_session(blob, transcript_id, transcription_result["text"], original_filename, filename, timestamp, validation["warnings"])
+
+def _save_upload_session(blob: dict, transcript_id: str, text: str, original_filename: str, filename: str, timestamp: str, warnings: list) -> Dict[str, any]:
+    """文字起こし済みのアップロードからセッションを作成して検索インデックスに登録"""
+    session_data = {
+        "filepath": blob["path"],
+        "filename": filename,
+        "original_filename": original_filename,
+        "blob_sha256": blob["sha256"],
+        "transcript_id": transcript_id
+    }
+    
+    artifact_store.save('session', timestamp, session_data)
+    archive_index.index_document(timestamp, 'transcript', original_filename, text)
+    
+    # 本文はレスポンスに含めず、必要に応じて /transcript/<id> から取得する
+    return {
+        "success": True,
+        "session_id": timestamp,
+        "transcript_id": transcript_id,
+        "transcript_length": len(text),
+        "original_filename": original_filename,
+        "safe_filename": filename,
+        "quality_warnings": warnings,
+        "deduplicated": blob["deduplicated"]
+    }
+
+@app.route('/upload/resumable', methods=['POST'])
+def create_resumable_upload():
+    """再開可能な分割アップロードを開始（JSON: filename, size）"""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or ''
+    size = data.get('size')
+    
+    if not audio_processor.allowed_file(filename):
+        return jsonify({"success": False, "error": "対応していないファイル形式です"}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({"success": False, "error": "ファイルサイズが不正です"}), 400
+    if size > resumable_uploads.max_size:
+        return jsonify({"success": False, "error": "ファイルサイズが大きすぎます（最大100MB）"}), 413
+    
+    return jsonify({"success": True, **resumable_uploads.create(filename, size)})
+
+@app.route('/upload/resumable/<upload_id>', methods=['GET'])
+def resumable_upload_status(upload_id):
+    """受信済みバイト数と次に送るチャンク番号を取得（中断後の再開用）"""
+    meta = resumable_uploads.get(upload_id)
+    if not meta:
+        return jsonify({"success": False, "error": "アップロードが見つかりません"}), 404
+    return jsonify({"success": True, **resumable_uploads.status(meta)})
+
+@app.route('/upload/resumable/<upload_id>/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    """チャンクを受信（X-Chunk-SHA256 ヘッダーがあれば内容を検証）"""
+    result = resumable_uploads.write_chunk(
+        upload_id,
+        index,
+        request.stream,
+        request.content_length or 0,
+        request.headers.get(ResumableUploadStore.CHECKSUM_HEADER)
+    )
+    status = result.pop("status", 200)
+    return jsonify(result), status
+
+@app.route('/upload/resumable/<upload_id>/complete', methods=['POST'])
+def complete_resumable_upload(upload_id):
+    """全チャンクの受信後にブロブへ取り込んで文字起こし（?job_id= で進捗を配信）"""
+    job_id = request.args.get('job_id')
+    if not progress_tracker.valid_job_id(job_id):
+        job_id = None
+    
+    result = _complete_resumable_upload(upload_id, job_id)
+    progress_tracker.finish(job_id, result)
+    return jsonify(result)
+
+def _complete_resumable_upload(upload_id: str, job_id: str) -> Dict[str, any]:
+    """受信済みの分割アップロードをブロブへ移動し、セッションを作成"""
+    try:
+        meta = resumable_uploads.get(upload_id)
+        if not meta:
+            return {"success": False, "error": "アップロードが見つかりません"}
+        
+        original_filename = meta["filename"]
+        safe_filename, filename, timestamp = _upload_filenames(original_filename)
+        data = request.get_json(silent=True) or {}
+        finalized = resumable_uploads.finalize(upload_id, timestamp, data.get('sha256'))
+        if not finalized["success"]:
+            return finalized
+        return _transcribe_upload(job_id, finalized["blob"], original_filename, filename, timestamp)
+    except Exception as e:
+        logger.error(f"分割アップロード完了エラー: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+@app.route('/progress/<job_id>')
+def progress_stream(job_id):
+    """ジョブの進捗を Server-Sent Events で配信"""
+    if not progress_tracker.valid_job_id(job_id):
+        return jsonify({"success": False, "error": "ジョブIDが不正です"}), 400
+    
+    return Response(
+        stream_with_context(progress_tracker.stream(job_id)),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/cancel/<job_id>', methods=['POST'])
+def cancel_transcription(job_id):
+    """実行中の文字起こしをキャンセル（Whisperのプロセスを停止）"""
+    if not progress_tracker.valid_job_id(job_id):
+        return jsonify({"success": False, "error": "ジョブIDが不正です"}), 400
+    if not audio_processor.cancel(job_id):
+        return jsonify({"success": False, "error": "実行中の文字起こしがありません"}), 409
+    return jsonify({"success": True})
+
+@app.route('/transcript/<transcript_id>')
+def get_transcript(transcript_id):
+    """文字起こし本文を取得（IDは本文のハッシュなので内容は不変）"""
+    try:
+        if not re.fullmatch(r'[0-9a-f]{64}', transcript_id):
+            return jsonify({"success": False, "error": "文字起こしIDが不正です"})
+        
+        text = transcript_store.get(transcript_id)
+        if text is None:
+            return jsonify({"success": False, "error": "文字起こしが見つかりません"})
+        
+        response = jsonify({"success": True, "transcript_id": transcript_id, "text": text})
+        response.set_etag(transcript_id)
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
+        
+    except Exception as e:
+        logger.error(f"文字起こし取得エラー: {str(e)}")
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/generate_article', methods=['POST'])
 def generate_article():
-    """記事生成"""
+    """記事生成（job_id を付けると /progress/<job_id> で進捗を配信）"""
+    job_id = None
     try:
         data = request.get_json()
         session_id = data.get('session_id')
         shop_info = data.get('shop_info', {})
+        job_id = data.get('job_id') if progress_tracker.valid_job_id(data.get('job_id')) else None
         
         if not session_id:
             return jsonify({"success": False, "error": "セッションIDが必要です"})
         
+        progress_tracker.update(job_id, 'generating')
+        
         # セッションデータ読み込み
-        session_file = f"{UPLOAD_FOLDER}/session_{session_id}.json"
-        if not os.path.exists(session_file):
-            return jsonify({"success": False, "error": "セッションが見つかりません"})
+        session_data = artifact_store.load('session', session_id)
+        if session_data is None:
+            result = {"success": False, "error": "セッションが見つかりません"}
+            progress_tracker.finish(job_id, result)
+            return jsonify(result)
         
-        with open(session_file, 'r', encoding='utf-8') as f:
-            session_data = json.load(f)
+        # 旧形式のセッションは文字起こし本文を切り出して保存し直す
+        if "transcription" in session_data:
+            session_data["transcript_id"] = transcript_store.put(session_data.pop("transcription"), session_id)
+            artifact_store.save('session', session_id, session_data)
         
         # 記事生成
         article_result = article_generator.generate_article(
-            session_data["transcription"], 
+            transcript_store.text_of(session_data), 
             shop_info
         )
         
         if not article_result["success"]:
+            progress_tracker.finish(job_id, article_result)
             return jsonify(article_result)
         
         # 品質チェック
@@ -1112,16 +3219,17 @@ def generate_article():
             location=shop_info.get('location', ''),
             tags=shop_info.get('tags', []),
             shop_info=shop_info,
-            transcription=session_data["transcription"],
+            transcript_id=session_data["transcript_id"],
             article_content=article_result["content"],
             created_at=datetime.now().isoformat(),
             word_count=article_result["word_count"]
         )
         
         # 記事保存
-        article_file = f"{UPLOAD_FOLDER}/article_{session_id}.json"
-        with open(article_file, 'w', encoding='utf-8') as f:
-            json.dump(asdict(article_data), f, ensure_ascii=False, indent=2)
+        artifact_store.save('article', session_id, asdict(article_data))
+        export_cache.invalidate(session_id)
+        archive_index.index_article(session_id, asdict(article_data))
+        progress_tracker.update(job_id, 'done')
         
         return jsonify({
             "success": True,
@@ -1136,106 +3244,203 @@ def generate_article():
         
     except Exception as e:
         logger.error(f"記事生成エラー: {str(e)}")
+        progress_tracker.update(job_id, 'error', message=str(e))
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/export/<session_id>/<format>')
 def export_article(session_id, format):
     """記事エクスポート"""
     try:
-        article_file = f"{UPLOAD_FOLDER}/article_{session_id}.json"
-        if not os.path.exists(article_file):
+        if format not in ArticleExporter.FORMATS:
+            return jsonify({"success": False, "error": "対応していないエクスポート形式です"})
+        
+        export = export_cache.get(session_id, format)
+        if export is None:
             return jsonify({"success": False, "error": "記事が見つかりません"})
         
-        with open(article_file, 'r', encoding='utf-8') as f:
-            article_data = json.load(f)
+        # If-None-Match が一致すれば 304 Not Modified を返す
+        return send_file(
+            io.BytesIO(export["data"]),
+            mimetype=export["mimetype"],
+            as_attachment=True,
+            download_name=f"{export['title']}.{format}",
+            etag=export["etag"],
+            conditional=True
+        )
         
-        if format == 'html':
-            html_content = f"""<!DOCTYPE html>
-<html lang="ja">
-<head>
-    <meta charset="UTF-8">
-    <title>{article_data['title']}</title>
-    <style>
-        body {{ 
-            font-family: 'Hiragino Sans', 'Yu Gothic', sans-serif; 
-            line-height: 1.8; 
-            margin: 2em auto; 
-            max-width: 800px;
-            padding: 0 1em;
-        }}
-        h1 {{ 
-            color: #2c3e50; 
-            border-bottom: 3px solid #3498db; 
-            padding-bottom: 0.5em;
-        }}
-        h2 {{ 
-            color: #34495e; 
-            border-left: 4px solid #3498db; 
-            padding-left: 1em;
-            margin-top: 2em;
-        }}
-        .meta {{ 
-            color: #7f8c8d; 
-            margin-bottom: 2em; 
-            padding: 1em;
-            background: #f8f9fa;
-            border-radius: 5px;
-        }}
-        .content {{ 
-            white-space: pre-line; 
-            font-size: 16px;
-        }}
-        .interview {{ 
-            margin: 2em 0; 
-        }}
-    </style>
-</head>
-<body>
-    <h1>{article_data['title']}</h1>
-    <div class="meta">
-        📅 作成日: {article_data['created_at'][:10]}<br>
-        📝 文字数: {article_data['word_count']}文字<br>
-        🏷️ カテゴリ: {article_data['category']}<br>
-        📍 場所: {article_data.get('location', '香川県')}
-    </div>
-    <div class="content">{article_data['article_content']}</div>
-    <hr style="margin-top: 3em; border: none; border-top: 2px solid #ecf0f1;">
-    <p style="text-align: center; color: #7f8c8d; font-size: 14px;">
-        この記事は「まるつー記事作る君」で生成されました
-    </p>
-</body>
-</html>"""
-            temp_file = f"{UPLOAD_FOLDER}/export_{session_id}.html"
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                f.write(html_content)
+    except Exception as e:
+        logger.error(f"エクスポートエラー: {str(e)}")
+        return jsonify({"success": False, "error": str(e)})
+
+ZIP_NAME_INVALID_CHARS = re.compile(r'[\\/:*?"<>|\s]+')
+
+def _parse_date_range(date_from, date_to):
+    """from/to（YYYY-MM-DD）を検証して正規化（不正ならValueError）"""
+    dates = []
+    for label, value in (('開始日', date_from), ('終了日', date_to)):
+        if not value:
+            dates.append(None)
+            continue
+        try:
+            dates.append(datetime.strptime(str(value), "%Y-%m-%d").strftime("%Y-%m-%d"))
+        except ValueError:
+            raise ValueError(f"{label}の形式が不正です（YYYY-MM-DD で指定してください）: {value}")
+    if dates[0] and dates[1] and dates[0] > dates[1]:
+        raise ValueError(f"開始日が終了日より後になっています: {dates[0]} 〜 {dates[1]}")
+    return dates[0], dates[1]
+
+def _select_bulk_export_ids(ids: list, date_from: str, date_to: str) -> list:
+    """ID一覧または作成日の範囲（YYYY-MM-DD）からエクスポート対象の記事IDを選ぶ"""
+    if ids:
+        return [session_id for session_id in ids if SESSION_ID_PATTERN.match(session_id)]
+    return archive_index.article_ids(date_from, date_to)
+
+def _generate_bulk_zip(session_ids: list, formats: list):
+    """記事を1件ずつ描画してZIPに書き込み、できたバイト列から順に返す"""
+    buffer = ZipStreamBuffer()
+    exported = 0
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for session_id in session_ids:
+            try:
+                article_data = artifact_store.load('article', session_id)
+            except Exception as e:
+                logger.error(f"一括エクスポート読み込みエラー {session_id}: {str(e)}")
+                continue
+            if article_data is None:
+                logger.warning(f"一括エクスポート: 記事が見つかりません {session_id}")
+                continue
             
-            return send_file(temp_file, as_attachment=True, download_name=f"{article_data['title']}.html")
+            title = ZIP_NAME_INVALID_CHARS.sub('_', article_data['title'])[:60]
+            for format in formats:
+                with zf.open(f"{session_id}_{title}.{format}", mode='w') as entry:
+                    entry.write(article_exporter.render(article_data, format).encode('utf-8'))
+                yield buffer.pop()
+            exported += 1
+    
+    yield buffer.pop()
+    logger.info(f"一括エクスポート完了: {exported}/{len(session_ids)}件")
+
+@app.route('/export/bulk', methods=['GET', 'POST'])
+def export_bulk():
+    """複数記事をZIPでストリーム配信（ID一覧 or 日付範囲）"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json() or {}
+            ids = data.get('ids') or []
+            formats = data.get('formats') or ['html', 'txt', 'md']
+            date_from = data.get('from')
+            date_to = data.get('to')
+        else:
+            ids = [i for i in request.args.get('ids', '').split(',') if i]
+            formats = [f for f in request.args.get('formats', 'html,txt,md').split(',') if f]
+            date_from = request.args.get('from')
+            date_to = request.args.get('to')
         
-        elif format == 'txt':
-            txt_content = f"""{article_data['title']}
+        if not ids and not date_from and not date_to:
+            return jsonify({"success": False, "error": "記事IDまたは日付範囲を指定してください"})
+        try:
+            date_from, date_to = _parse_date_range(date_from, date_to)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)})
+        unsupported = [f for f in formats if f not in ArticleExporter.FORMATS]
+        if unsupported or not formats:
+            return jsonify({"success": False, "error": f"対応していないエクスポート形式です: {', '.join(unsupported)}"})
+        
+        session_ids = _select_bulk_export_ids(ids, date_from, date_to)
+        if not session_ids:
+            return jsonify({"success": False, "error": "該当する記事がありません"})
+        
+        download_name = f"marutsu_articles_{session_ids[0]}_{session_ids[-1]}.zip"
+        return Response(
+            stream_with_context(_generate_bulk_zip(session_ids, formats)),
+            mimetype='application/zip',
+            headers={"Content-Disposition": f"attachment; filename={download_name}"}
+        )
+        
+    except Exception as e:
+        logger.error(f"一括エクスポートエラー: {str(e)}")
+        return jsonify({"success": False, "error": str(e)})
 
-=====================================
-📅 作成日: {article_data['created_at'][:10]}
-📝 文字数: {article_data['word_count']}文字
-🏷️ カテゴリ: {article_data['category']}
-📍 場所: {article_data.get('location', '香川県')}
-=====================================
+@app.route('/session/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """セッション削除（関連する記事・エクスポートと音声の参照も解放）"""
+    try:
+        if not artifact_store.exists('session', session_id):
+            return jsonify({"success": False, "error": "セッションが見つかりません"})
+        
+        freed_bytes = remove_session_artifacts(session_id)
+        
+        return jsonify({"success": True, "session_id": session_id, "freed_bytes": freed_bytes})
+        
+    except Exception as e:
+        logger.error(f"セッション削除エラー: {str(e)}")
+        return jsonify({"success": False, "error": str(e)})
 
-{article_data['article_content']}
+@app.route('/search')
+def search_archive():
+    """過去の文字起こし・記事を全文検索"""
+    try:
+        query = request.args.get('q', '').strip()
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        if not query:
+            return jsonify({"success": False, "error": "検索語を入力してください"})
+        if not any(len(term) >= 2 for term in query.split()):
+            return jsonify({"success": False, "error": "2文字以上の検索語を1つ以上含めてください"})
+        
+        started = time.perf_counter()
+        results = archive_index.search(query, limit)
+        
+        return jsonify({
+            "success": True,
+            "query": query,
+            "results": results,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+        })
+        
+    except Exception as e:
+        logger.error(f"検索エラー: {str(e)}")
+        return jsonify({"success": False, "error": str(e)})
 
----
-この記事は「まるつー記事作る君」で生成されました"""
-            
-            temp_file = f"{UPLOAD_FOLDER}/export_{session_id}.txt"
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                f.write(txt_content)
-            
-            return send_file(temp_file, as_attachment=True, download_name=f"{article_data['title']}.txt")
+@app.route('/articles')
+def list_articles():
+    """記事一覧（カーソル方式のページング）"""
+    try:
+        date_from, date_to = _parse_date_range(request.args.get('from'), request.args.get('to'))
+        filters = {
+            'category': request.args.get('category'),
+            'location': request.args.get('location'),
+            'from': date_from,
+            'to': date_to
+        }
+        limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+        page = archive_index.list_articles(
+            filters,
+            sort=request.args.get('sort', '-created_at'),
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+        
+        return jsonify({"success": True, **page})
         
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)})
     except Exception as e:
-        logger.error(f"エクスポートエラー: {str(e)}")
+        logger.error(f"記事一覧エラー: {str(e)}")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/metrics')
+def metrics():
+    """運用メトリクス"""
+    return jsonify({
+        "sweeper": upload_sweeper.snapshot(),
+        "artifact_cache": artifact_store.cache.stats() if artifact_store.cache else None,
+        "export_cache": export_cache.stats(),
+        "progress": progress_tracker.stats(),
+        "upload_validation": validation_stats.stats(),
+        "resumable_uploads": resumable_uploads.stats(),
+        "local_transcriber": local_transcriber.stats()
+    })
+
 @app.errorhandler(413)
 def too_large(e):
     return jsonify({"success": False, "error": "ファイルサイズが大きすぎます"}), 413
@@ -1245,4 +3450,7 @@ if __name__ == '__main__':
     print("✨ プロ仕様の記事生成機能を搭載")
     print("📰 見出し構造 + 視覚的インタビュー対応")
     print("ブラウザで http://localhost:5000 にアクセスしてください")
+    # デバッグ時のリローダー親プロセスでは起動しない（実際に配信する子プロセスで起動時に開始）
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+音声品質の事前解析
+間引いたモノラルPCMから音量・音割れ・会話帯域の比率・無音の割合を計算し、
+文字起こしに回す前に使えない録音を警告・除外する
+（WAV は標準ライブラリで直接読み、それ以外は ffmpeg があれば ffmpeg でデコード）
+"""
+
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from audio_utils import detect_format
+
+logger = logging.getLogger(__name__)
+
+# 解析用のサンプリング周波数（会話帯域 300〜3400Hz を十分含む）
+ANALYSIS_SAMPLE_RATE = 16000
+
+# フレーム長（32ms）と、一度に FFT するフレーム数
+FRAME_SIZE = 512
+FRAMES_PER_BLOCK = 2048
+
+# 会話帯域
+SPEECH_BAND_HZ = (300, 3400)
+
+# 判定のしきい値
+SILENCE_DBFS = float(os.environ.get('ANALYSIS_SILENCE_DBFS', '-45'))
+CLIP_LEVEL = 0.99
+BLOCK_SILENCE_FRACTION = float(os.environ.get('ANALYSIS_BLOCK_SILENCE_FRACTION', '0.97'))
+WARN_SILENCE_FRACTION = float(os.environ.get('ANALYSIS_WARN_SILENCE_FRACTION', '0.7'))
+WARN_CLIPPING_RATIO = float(os.environ.get('ANALYSIS_WARN_CLIPPING_RATIO', '0.01'))
+BLOCK_CLIPPING_RATIO = float(os.environ.get('ANALYSIS_BLOCK_CLIPPING_RATIO', '0.2'))
+# 声の基本周波数は 300Hz 未満にも多く含まれるため、会話帯域比は低めで警告のみにする
+WARN_SPEECH_BAND_RATIO = float(os.environ.get('ANALYSIS_WARN_SPEECH_BAND_RATIO', '0.25'))
+WARN_LOUDNESS_DBFS = float(os.environ.get('ANALYSIS_WARN_LOUDNESS_DBFS', '-40'))
+
+# 直接デコードできる WAV の (形式, ビット数)（1: PCM, 3: IEEE float。ADPCM などは解析しない）
+WAV_SAMPLE_FORMATS = {(1, 8), (1, 16), (1, 24), (1, 32), (3, 32)}
+
+# ffmpeg でのデコードにかける時間の上限（音声の長さに対する比率と最低秒数）
+DECODE_TIMEOUT_RATIO = 0.05
+DECODE_TIMEOUT_MIN_SECONDS = 30
+
+
+def decode_wav(data) -> Optional[np.ndarray]:
+    """WAV（PCM / IEEE float）を間引いたモノラル float32 に変換"""
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(data):
+        chunk_id = bytes(data[offset:offset + 4])
+        chunk_size = struct.unpack_from('<I', data, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', data, body)
+            if audio_format == 0xFFFE and chunk_size >= 26:
+                # WAVE_FORMAT_EXTENSIBLE は SubFormat の先頭2バイトが実際の形式
+                audio_format = struct.unpack_from('<H', data, body + 24)[0]
+            fmt = (audio_format, channels, sample_rate, bits)
+        elif chunk_id == b'data' and fmt:
+            audio_format, channels, sample_rate, bits = fmt
+            if (audio_format, bits) not in WAV_SAMPLE_FORMATS or not channels or not sample_rate:
+                return None
+            end = body + min(chunk_size, len(data) - body)
+            frame_bytes = channels * bits // 8
+            end -= (end - body) % frame_bytes
+            raw = np.frombuffer(data[body:end], dtype=np.uint8)
+            if audio_format == 1 and bits == 16:
+                samples = raw.view('<i2').astype(np.float32) / 32768
+            elif audio_format == 1 and bits == 8:
+                samples = (raw.astype(np.float32) - 128) / 128
+            elif audio_format == 1 and bits == 24:
+                triples = raw.reshape(-1, 3).astype(np.int32)
+                values = triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)
+                samples = ((values << 8) >> 8).astype(np.float32) / 8388608
+            elif audio_format == 1 and bits == 32:
+                samples = raw.view('<i4').astype(np.float32) / 2147483648
+            else:
+                samples = raw.view('<f4').astype(np.float32)
+            return _downmix(samples.reshape(-1, channels), sample_rate)
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def decode_with_ffmpeg(data, audio_format: str, duration: Optional[float] = None) -> Optional[np.ndarray]:
+    """ffmpeg で解析用PCM（16kHz モノラル）にデコード（ffmpeg がなければ None）"""
+    if not shutil.which('ffmpeg'):
+        return None
+    if audio_format == 'mp4':
+        # moov が末尾にある MP4 はパイプからはシークできないため一時ファイル経由
+        with tempfile.NamedTemporaryFile(suffix='.m4a') as temp:
+            temp.write(data)
+            temp.flush()
+            return _run_ffmpeg(temp.name, None, duration)
+    return _run_ffmpeg('pipe:0', data, duration)
+
+
+def _run_ffmpeg(source: str, data, duration: Optional[float]) -> Optional[np.ndarray]:
+    """ffmpeg を実行して s16le の出力を float32 に変換"""
+    timeout = max(DECODE_TIMEOUT_MIN_SECONDS, (duration or 0) * DECODE_TIMEOUT_RATIO)
+    try:
+        completed = subprocess.run(
+            [shutil.which('ffmpeg'), '-v', 'error', '-i', source, '-vn', '-ac', '1',
+             '-ar', str(ANALYSIS_SAMPLE_RATE), '-f', 's16le', '-'],
+            input=data, capture_output=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        logger.warning(f"解析用デコードがタイムアウトしました（{timeout:.0f}秒）")
+        return None
+
+    if completed.returncode != 0 or not completed.stdout:
+        logger.warning(f"解析用デコードに失敗: {completed.stderr.decode('utf-8', 'replace')[-500:]}")
+        return None
+    return np.frombuffer(completed.stdout, dtype='<i2').astype(np.float32) / 32768
+
+
+def _downmix(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """モノラル化し、ブロック平均で解析用サンプリング周波数付近まで間引く"""
+    mono = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    factor = max(1, sample_rate // ANALYSIS_SAMPLE_RATE)
+    if factor > 1:
+        mono = mono[:len(mono) - len(mono) % factor].reshape(-1, factor).mean(axis=1)
+    return _resample(mono, sample_rate / factor)
+
+
+def _resample(samples: np.ndarray, sample_rate: float) -> np.ndarray:
+    """線形補間で解析用サンプリング周波数に揃える（帯域比の計算に十分な精度）"""
+    if abs(sample_rate - ANALYSIS_SAMPLE_RATE) < 1:
+        return samples.astype(np.float32, copy=False)
+    count = int(len(samples) * ANALYSIS_SAMPLE_RATE / sample_rate)
+    positions = np.arange(count, dtype=np.float64) * (sample_rate / ANALYSIS_SAMPLE_RATE)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def compute_metrics(samples: np.ndarray) -> Dict[str, float]:
+    """解析用PCMから音量・音割れ・会話帯域比・無音の割合を計算"""
+    usable = len(samples) - len(samples) % FRAME_SIZE
+    frames = samples[:usable].reshape(-1, FRAME_SIZE)
+    if not len(frames):
+        return {'loudness_dbfs': -120.0, 'peak_dbfs': -120.0, 'clipping_ratio': 0.0, 'speech_band_ratio': 0.0, 'silence_fraction': 1.0}
+
+    frame_rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+    frame_dbfs = 20 * np.log10(np.maximum(frame_rms, 1e-6))
+    active = frame_dbfs > SILENCE_DBFS
+    active_rms = np.sqrt(np.mean(np.square(frame_rms[active]))) if active.any() else 0.0
+    peak = float(np.max(np.abs(samples))) if len(samples) else 0.0
+
+    # 会話帯域の比率は有音フレームだけで計算（無音部分の雑音に引きずられないように）
+    window = np.hanning(FRAME_SIZE).astype(np.float32)
+    frequencies = np.fft.rfftfreq(FRAME_SIZE, 1 / ANALYSIS_SAMPLE_RATE)
+    band = (frequencies >= SPEECH_BAND_HZ[0]) & (frequencies <= SPEECH_BAND_HZ[1])
+    active_frames = frames[active]
+    band_energy = total_energy = 0.0
+    for start in range(0, len(active_frames), FRAMES_PER_BLOCK):
+        spectrum = np.abs(np.fft.rfft(active_frames[start:start + FRAMES_PER_BLOCK] * window, axis=1)) ** 2
+        band_energy += float(spectrum[:, band].sum())
+        total_energy += float(spectrum[:, 1:].sum())
+
+    return {
+        'loudness_dbfs': float(20 * np.log10(max(active_rms, 1e-6))),
+        'peak_dbfs': float(20 * np.log10(max(peak, 1e-6))),
+        'clipping_ratio': float(np.count_nonzero(np.abs(samples) >= CLIP_LEVEL) / len(samples)),
+        'speech_band_ratio': band_energy / total_energy if total_energy else 0.0,
+        'silence_fraction': float(1 - active.mean())
+    }
+
+
+def judge(metrics: Dict[str, float]) -> Dict[str, any]:
+    """指標から判定（block: 文字起こししない / warn: 注意して続行 / ok）"""
+    blocks = []
+    warnings = []
+    if metrics['silence_fraction'] >= BLOCK_SILENCE_FRACTION:
+        blocks.append(f"ほぼ無音です（無音 {metrics['silence_fraction']:.0%}）")
+    elif metrics['silence_fraction'] >= WARN_SILENCE_FRACTION:
+        warnings.append(f"無音の部分が多い録音です（無音 {metrics['silence_fraction']:.0%}）")
+    if metrics['clipping_ratio'] >= BLOCK_CLIPPING_RATIO:
+        blocks.append(f"音割れがひどく聞き取れない可能性が高いです（音割れ {metrics['clipping_ratio']:.1%}）")
+    elif metrics['clipping_ratio'] >= WARN_CLIPPING_RATIO:
+        warnings.append(f"音割れしている部分があります（音割れ {metrics['clipping_ratio']:.1%}）")
+    if not blocks:
+        if metrics['speech_band_ratio'] < WARN_SPEECH_BAND_RATIO:
+            warnings.append(f"音楽や雑音が多い可能性があります（会話帯域 {metrics['speech_band_ratio']:.0%}）")
+        if metrics['loudness_dbfs'] < WARN_LOUDNESS_DBFS:
+            warnings.append(f"音量が小さい録音です（{metrics['loudness_dbfs']:.0f}dBFS）")
+    return {
+        'verdict': 'block' if blocks else ('warn' if warnings else 'ok'),
+        'issues': blocks + warnings
+    }
+
+
+def analyze_audio(data, duration: Optional[float] = None) -> Optional[Dict[str, any]]:
+    """音声品質を解析（デコードできない場合は None）"""
+    started = time.perf_counter()
+    audio_format = detect_format(data)
+    if audio_format == 'wav':
+        samples = decode_wav(data)
+    elif audio_format:
+        samples = decode_with_ffmpeg(data, audio_format, duration)
+    else:
+        samples = None
+    return _analyze_samples(samples, started)
+
+
+def analyze_file(path: str, duration: Optional[float] = None) -> Optional[Dict[str, any]]:
+    """ファイルの音声品質を解析（WAV 以外は ffmpeg にパスを直接渡す）"""
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        audio_format = detect_format(f.read(64 * 1024))
+        if audio_format == 'wav':
+            f.seek(0)
+            samples = decode_wav(f.read())
+        elif audio_format and shutil.which('ffmpeg'):
+            samples = _run_ffmpeg(path, None, duration)
+        else:
+            samples = None
+    return _analyze_samples(samples, started)
+
+
+def _analyze_samples(samples: Optional[np.ndarray], started: float) -> Optional[Dict[str, any]]:
+    """指標の計算と判定をまとめて行う"""
+    if samples is None:
+        return None
+    metrics = compute_metrics(samples)
+    result = judge(metrics)
+    result['metrics'] = metrics
+    result['elapsed'] = time.perf_counter() - started
+    logger.info(
+        f"音声品質解析: {result['verdict']} {len(samples) / ANALYSIS_SAMPLE_RATE:.0f}秒分を"
+        f"{result['elapsed'] * 1000:.0f}ms で解析 {result['issues']}"
+    )
+    return result
+
+
+def merge_analysis(validation: Dict[str, any], analysis: Optional[Dict[str, any]]) -> Dict[str, any]:
+    """品質解析の結果を事前検証の結果へ反映（block はエラー、warn は警告）"""
+    validation['analysis'] = analysis
+    if not analysis:
+        return validation
+    if analysis['verdict'] == 'block':
+        validation['errors'].extend(analysis['issues'])
+        validation['valid'] = False
+    else:
+        validation['warnings'].extend(analysis['issues'])
+    return validation
@@ -0,0 +1,570 @@
+# -*- coding: utf-8 -*-
+"""
+音声ファイルのヘッダー解析ユーティリティ
+デコードせずにコンテナのヘッダーだけを読み、形式と再生時間を求める
+（MP3 / MP4・M4A / WAV / FLAC / AAC(ADTS) に対応）
+"""
+
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, List, Optional
+
+# MP3 のビットレート表（kbps）: [MPEG1 / MPEG2・2.5][レイヤー1〜3][インデックス]
+MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# MP3 のサンプリング周波数（バージョンビット → 周波数表）
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG1
+    2: [22050, 24000, 16000],  # MPEG2
+    0: [11025, 12000, 8000],   # MPEG2.5
+}
+
+# ADTS のサンプリング周波数インデックス
+ADTS_SAMPLE_RATES = [
+    96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050,
+    16000, 12000, 11025, 8000, 7350
+]
+
+# 固定ビットレート判定・推定に使う先頭フレーム数
+MP3_CBR_CHECK_FRAMES = 32
+ADTS_ESTIMATE_FRAMES = 256
+
+# 構造チェックで先頭から辿るフレーム数（約1〜2秒分）
+PROBE_WINDOW_FRAMES = 64
+
+# 判定した形式ごとの正しい拡張子（Whisper API へ送るファイル名に使用）
+FORMAT_EXTENSIONS = {
+    'wav': 'wav',
+    'flac': 'flac',
+    'mp4': 'm4a',
+    'mp3': 'mp3',
+    'aac': 'aac',
+}
+
+# 拡張子ごとに中身として許容する形式
+EXTENSION_FORMATS = {
+    'wav': {'wav'},
+    'flac': {'flac'},
+    'm4a': {'mp4'},
+    'mp4': {'mp4'},
+    'mp3': {'mp3'},
+    'aac': {'aac', 'mp4'},
+}
+
+
+def skip_id3(data) -> int:
+    """先頭の ID3v2 タグを飛ばした位置を返す"""
+    offset = 0
+    while len(data) >= offset + 10 and bytes(data[offset:offset + 3]) == b'ID3':
+        flags = data[offset + 5]
+        size = 0
+        for byte in data[offset + 6:offset + 10]:
+            size = (size << 7) | (byte & 0x7F)
+        offset += 10 + size + (10 if flags & 0x10 else 0)
+    return offset
+
+
+def detect_format(data) -> Optional[str]:
+    """マジックバイトから音声形式を判定（wav / flac / mp4 / mp3 / aac、不明なら None）"""
+    if len(data) >= 12 and bytes(data[0:4]) in (b'RIFF', b'RF64') and bytes(data[8:12]) == b'WAVE':
+        return 'wav'
+    if len(data) >= 12 and bytes(data[4:8]) == b'ftyp':
+        return 'mp4'
+
+    offset = skip_id3(data)
+    if len(data) >= offset + 4 and bytes(data[offset:offset + 4]) == b'fLaC':
+        return 'flac'
+    if len(data) >= offset + 2 and data[offset] == 0xFF:
+        second = data[offset + 1]
+        if second & 0xF6 == 0xF0:
+            return 'aac'
+        if second & 0xE0 == 0xE0 and second & 0x06:
+            return 'mp3'
+    if offset:
+        # ID3 の後に余計なパディングがある MP3
+        return 'mp3' if _find_mp3_frame(data, offset) is not None else None
+    return None
+
+
+def probe_audio(data) -> Optional[Dict[str, any]]:
+    """ヘッダーから形式と再生時間（秒）を求める（判定できなければ None）
+
+    data は bytes / memoryview / mmap など添字アクセスできるバッファ。
+    method は長さの求め方（header: ヘッダーの正確な値, cbr: 固定ビットレートからの計算,
+    scan: 全フレーム走査, estimate: 先頭フレームからの推定）
+    """
+    audio_format = detect_format(data)
+    parser = {
+        'wav': _probe_wav,
+        'flac': _probe_flac,
+        'mp4': _probe_mp4,
+        'mp3': _probe_mp3,
+        'aac': _probe_adts,
+    }.get(audio_format)
+    if not parser:
+        return None
+
+    try:
+        result = parser(data)
+    except (struct.error, IndexError, ValueError, ZeroDivisionError):
+        result = None
+    if not result:
+        return None
+    result['format'] = audio_format
+    return result
+
+
+def probe_file(path: str) -> Optional[Dict[str, any]]:
+    """ファイルを mmap してヘッダー解析（ファイル全体は読み込まない）"""
+    if not os.path.getsize(path):
+        return None
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return probe_audio(mapped)
+
+
+def _probe_wav(data) -> Optional[Dict[str, any]]:
+    """RIFF チャンクを辿り fmt / fact / data から長さを計算"""
+    offset = 12
+    fmt = None
+    fact_samples = None
+    while offset + 8 <= len(data):
+        chunk_id = bytes(data[offset:offset + 4])
+        chunk_size = struct.unpack_from('<I', data, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            audio_format, channels, sample_rate, byte_rate = struct.unpack_from('<HHII', data, body)
+            fmt = {'audio_format': audio_format, 'channels': channels, 'sample_rate': sample_rate, 'byte_rate': byte_rate}
+        elif chunk_id == b'fact' and chunk_size >= 4:
+            fact_samples = struct.unpack_from('<I', data, body)[0]
+        elif chunk_id == b'data':
+            if not fmt:
+                return None
+            # 録音中断などでサイズが書かれていない場合は残り全体をデータとみなす
+            data_size = min(chunk_size, len(data) - body)
+            if fmt['audio_format'] != 1 and fact_samples and fmt['sample_rate']:
+                duration = fact_samples / fmt['sample_rate']
+            else:
+                duration = data_size / fmt['byte_rate']
+            return {
+                'duration': duration,
+                'sample_rate': fmt['sample_rate'],
+                'channels': fmt['channels'],
+                'method': 'header'
+            }
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _probe_flac(data) -> Optional[Dict[str, any]]:
+    """STREAMINFO ブロックの総サンプル数とサンプリング周波数から計算"""
+    offset = skip_id3(data) + 4
+    block_type = data[offset] & 0x7F
+    if block_type != 0:
+        return None
+    packed = struct.unpack_from('>Q', data, offset + 4 + 10)[0]
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x07) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        return None
+    return {
+        'duration': total_samples / sample_rate,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'method': 'header'
+    }
+
+
+def _iter_boxes(data, start: int, end: int):
+    """MP4 のボックスを (種類, 中身の開始位置, 終了位置) で列挙"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _probe_mp4(data) -> Optional[Dict[str, any]]:
+    """moov/mvhd ボックスの timescale と duration から計算（mdat は読み飛ばす）"""
+    for box_type, body, end in _iter_boxes(data, 0, len(data)):
+        if box_type != b'moov':
+            continue
+        for child_type, child_body, _ in _iter_boxes(data, body, end):
+            if child_type != b'mvhd':
+                continue
+            version = data[child_body]
+            if version == 1:
+                timescale, duration = struct.unpack_from('>IQ', data, child_body + 4 + 16)
+            else:
+                timescale, duration = struct.unpack_from('>II', data, child_body + 4 + 8)
+            if not timescale:
+                return None
+            return {'duration': duration / timescale, 'method': 'header'}
+    return None
+
+
+def _parse_mp3_header(data, offset: int) -> Optional[Dict[str, int]]:
+    """MP3 フレームヘッダーを解析（不正なら None）"""
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    header = struct.unpack_from('>I', data, offset)[0]
+    version_bits = (header >> 19) & 0x03
+    layer_bits = (header >> 17) & 0x03
+    bitrate_index = (header >> 12) & 0x0F
+    sample_rate_index = (header >> 10) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    version = 1 if version_bits == 3 else 2
+    layer = 4 - layer_bits
+    bitrate = MP3_BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+    padding = (header >> 9) & 0x01
+    mono = ((header >> 6) & 0x03) == 3
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+        length = (samples // 8) * bitrate // sample_rate + padding
+
+    return {
+        'version': version,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'samples': samples,
+        'length': length,
+        'mono': mono
+    }
+
+
+def _find_mp3_frame(data, offset: int, limit: int = 64 * 1024) -> Optional[int]:
+    """次のフレームも正しく続く最初のフレーム同期位置を探す"""
+    end = min(len(data) - 4, offset + limit)
+    while offset < end:
+        frame = _parse_mp3_header(data, offset)
+        if frame and _parse_mp3_header(data, offset + frame['length']):
+            return offset
+        offset += 1
+    return None
+
+
+def _probe_mp3(data) -> Optional[Dict[str, any]]:
+    """Xing/Info・VBRI ヘッダー、固定ビットレート計算、全フレーム走査の順に長さを求める"""
+    offset = _find_mp3_frame(data, skip_id3(data))
+    if offset is None:
+        return None
+    first = _parse_mp3_header(data, offset)
+    result = {'sample_rate': first['sample_rate'], 'channels': 1 if first['mono'] else 2}
+
+    # Xing / Info ヘッダー（サイド情報の直後）
+    if first['version'] == 1:
+        side_info = 17 if first['mono'] else 32
+    else:
+        side_info = 9 if first['mono'] else 17
+    xing = offset + 4 + side_info
+    if bytes(data[xing:xing + 4]) in (b'Xing', b'Info'):
+        flags = struct.unpack_from('>I', data, xing + 4)[0]
+        if flags & 0x01:
+            frames = struct.unpack_from('>I', data, xing + 8)[0]
+            result.update(duration=frames * first['samples'] / first['sample_rate'], method='header')
+            return result
+
+    # VBRI ヘッダー（フレーム先頭から 32 バイト後）
+    vbri = offset + 4 + 32
+    if bytes(data[vbri:vbri + 4]) == b'VBRI':
+        frames = struct.unpack_from('>I', data, vbri + 14)[0]
+        result.update(duration=frames * first['samples'] / first['sample_rate'], method='header')
+        return result
+
+    # 先頭フレームのビットレートが揃っていれば固定ビットレートとして計算
+    end = len(data) - (128 if bytes(data[-128:-125]) == b'TAG' else 0)
+    position = offset
+    bitrates = set()
+    for _ in range(MP3_CBR_CHECK_FRAMES):
+        frame = _parse_mp3_header(data, position)
+        if not frame:
+            break
+        bitrates.add(frame['bitrate'])
+        position += frame['length']
+    if len(bitrates) == 1:
+        result.update(duration=(end - offset) * 8 / first['bitrate'], method='cbr')
+        return result
+
+    # 可変ビットレートでヘッダーがない場合は全フレームを走査
+    # （フレーム長はヘッダー2〜3バイト目だけで決まるため、その値ごとに解析結果を使い回す）
+    position = offset
+    total_samples = 0
+    frame_sizes = {}
+    while position + 4 <= end and data[position] == 0xFF:
+        key = (data[position + 1] << 8) | data[position + 2]
+        size = frame_sizes.get(key)
+        if size is None:
+            frame = _parse_mp3_header(data, position)
+            if not frame:
+                break
+            size = frame_sizes[key] = (frame['length'], frame['samples'])
+        position += size[0]
+        total_samples += size[1]
+    result.update(duration=total_samples / first['sample_rate'], method='scan')
+    return result
+
+
+def _parse_adts_header(data, offset: int) -> Optional[Dict[str, int]]:
+    """ADTS フレームヘッダーを解析（不正なら None）"""
+    if offset + 7 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xF6 != 0xF0:
+        return None
+    sample_rate_index = (data[offset + 2] >> 2) & 0x0F
+    if sample_rate_index >= len(ADTS_SAMPLE_RATES):
+        return None
+    channels = ((data[offset + 2] & 0x01) << 2) | (data[offset + 3] >> 6)
+    length = ((data[offset + 3] & 0x03) << 11) | (data[offset + 4] << 3) | (data[offset + 5] >> 5)
+    blocks = (data[offset + 6] & 0x03) + 1
+    if length < 7:
+        return None
+    return {
+        'sample_rate': ADTS_SAMPLE_RATES[sample_rate_index],
+        'channels': channels,
+        'length': length,
+        'samples': 1024 * blocks
+    }
+
+
+def _probe_adts(data) -> Optional[Dict[str, any]]:
+    """ADTS は長さの記録がないため、先頭フレームの平均サイズから全体を推定"""
+    offset = skip_id3(data)
+    first = _parse_adts_header(data, offset)
+    if not first:
+        return None
+
+    position = offset
+    frames = samples = 0
+    while frames < ADTS_ESTIMATE_FRAMES:
+        frame = _parse_adts_header(data, position)
+        if not frame:
+            break
+        frames += 1
+        samples += frame['samples']
+        position += frame['length']
+
+    if position >= len(data):
+        method = 'scan'
+        total_samples = samples
+    else:
+        method = 'estimate'
+        total_samples = samples * (len(data) - offset) / (position - offset)
+    return {
+        'duration': total_samples / first['sample_rate'],
+        'sample_rate': first['sample_rate'],
+        'channels': first['channels'],
+        'method': method
+    }
+
+
+def validate_audio(data, filename: str = '') -> Dict[str, any]:
+    """文字起こし前の事前検証（マジックバイト・構造・先頭フレームの整合性）
+
+    errors があれば文字起こしに回さない。warnings は送信可能だが注意が必要なもの。
+    拡張子と中身が食い違う場合は extension に中身に合った拡張子を返す。
+    """
+    result = {'valid': False, 'format': None, 'extension': None, 'duration': None, 'errors': [], 'warnings': []}
+    size = len(data)
+    if not size:
+        result['errors'].append("ファイルが空です")
+        return result
+
+    audio_format = detect_format(data)
+    if not audio_format:
+        result['errors'].append("音声ファイルとして認識できません（対応形式のヘッダーがありません）")
+        return result
+    result['format'] = audio_format
+    result['extension'] = FORMAT_EXTENSIONS[audio_format]
+
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension and audio_format not in EXTENSION_FORMATS.get(extension, set()):
+        result['warnings'].append(f"拡張子は .{extension} ですが、中身は {audio_format.upper()} 形式です")
+
+    checker = {
+        'wav': _check_wav,
+        'flac': _check_flac,
+        'mp4': _check_mp4,
+        'mp3': _check_mp3,
+        'aac': _check_adts,
+    }[audio_format]
+    try:
+        checker(data, result['errors'], result['warnings'])
+    except (struct.error, IndexError, ValueError):
+        result['errors'].append("ヘッダーが途中で切れています")
+
+    if not result['errors']:
+        probe = probe_audio(data)
+        if not probe or probe['duration'] <= 0:
+            result['warnings'].append("再生時間をヘッダーから取得できません")
+        else:
+            result['duration'] = probe['duration']
+    result['valid'] = not result['errors']
+    return result
+
+
+def validate_file(path: str, filename: str = '') -> Dict[str, any]:
+    """ファイルを mmap して事前検証"""
+    if not os.path.getsize(path):
+        return validate_audio(b'', filename)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return validate_audio(mapped, filename)
+
+
+def _check_wav(data, errors: List[str], warnings: List[str]):
+    """fmt / data チャンクの有無と、宣言サイズと実サイズの整合性"""
+    offset = 12
+    chunks = {}
+    while offset + 8 <= len(data):
+        chunk_id = bytes(data[offset:offset + 4])
+        chunk_size = struct.unpack_from('<I', data, offset + 4)[0]
+        chunks[chunk_id] = (offset + 8, chunk_size)
+        if chunk_id == b'data':
+            break
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+    if b'fmt ' not in chunks:
+        errors.append("WAV の fmt チャンクがありません")
+        return
+    body, _ = chunks[b'fmt ']
+    _, channels, sample_rate, byte_rate = struct.unpack_from('<HHII', data, body)
+    if not channels or not sample_rate or not byte_rate:
+        errors.append("WAV のフォーマット情報が不正です")
+    if b'data' not in chunks:
+        errors.append("WAV の音声データ（data チャンク）がありません")
+        return
+    body, declared = chunks[b'data']
+    actual = len(data) - body
+    if actual <= 0:
+        errors.append("WAV の音声データが空です")
+    elif declared != 0xFFFFFFFF and actual < declared:
+        warnings.append(f"WAV が途中で切れています（{actual / declared:.0%} のみ）")
+
+
+def _check_flac(data, errors: List[str], warnings: List[str]):
+    """メタデータブロックの連結と、その直後の最初のフレーム同期"""
+    offset = skip_id3(data) + 4
+    if data[offset] & 0x7F != 0:
+        errors.append("FLAC の STREAMINFO がありません")
+        return
+    while True:
+        header = data[offset]
+        length = int.from_bytes(bytes(data[offset + 1:offset + 4]), 'big')
+        offset += 4 + length
+        if offset > len(data):
+            errors.append("FLAC のメタデータが途中で切れています")
+            return
+        if header & 0x80:
+            break
+    if offset + 2 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xFE != 0xF8:
+        errors.append("FLAC の音声フレームが見つかりません")
+
+
+def _check_mp4(data, errors: List[str], warnings: List[str]):
+    """moov / mdat の有無と、ボックスがファイル末尾を超えていないか"""
+    boxes = {}
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header:
+            errors.append("MP4 のボックス構造が壊れています")
+            return
+        boxes[box_type] = (offset, size)
+        offset += size
+
+    if b'moov' not in boxes:
+        errors.append("MP4 の moov ボックスがありません（録音が途中で中断された可能性があります）")
+    if b'mdat' not in boxes:
+        errors.append("MP4 の音声データ（mdat ボックス）がありません")
+    if offset > len(data):
+        errors.append(f"MP4 が途中で切れています（{len(data) / offset:.0%} のみ）")
+
+
+def _check_mp3(data, errors: List[str], warnings: List[str]):
+    """先頭のフレームが途切れずに連続しているか"""
+    offset = _find_mp3_frame(data, skip_id3(data))
+    if offset is None:
+        errors.append("MP3 のフレームが見つかりません")
+        return
+    if offset - skip_id3(data) > 4096:
+        warnings.append("MP3 の先頭に不明なデータがあります")
+    for _ in range(PROBE_WINDOW_FRAMES):
+        if offset >= len(data) - 128:
+            return
+        frame = _parse_mp3_header(data, offset)
+        if not frame:
+            errors.append("MP3 のフレーム構造が壊れています")
+            return
+        offset += frame['length']
+
+
+def _check_adts(data, errors: List[str], warnings: List[str]):
+    """先頭の ADTS フレームが途切れずに連続しているか"""
+    offset = skip_id3(data)
+    for _ in range(PROBE_WINDOW_FRAMES):
+        if offset >= len(data):
+            return
+        frame = _parse_adts_header(data, offset)
+        if not frame:
+            errors.append("AAC のフレーム構造が壊れています")
+            return
+        offset += frame['length']
+
+
+class ValidationStats:
+    """事前検証で除外したファイルの集計（送信しなかったバイト数・API呼び出し数）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = 0
+        self.rejected = 0
+        self.rejected_bytes = 0
+        self.reasons = {}
+
+    def record(self, validation: Dict[str, any], size: int):
+        with self.lock:
+            self.checked += 1
+            if validation['valid']:
+                return
+            self.rejected += 1
+            self.rejected_bytes += size
+            reason = validation['errors'][0]
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def stats(self) -> Dict[str, any]:
+        with self.lock:
+            return {
+                "checked": self.checked,
+                "rejected": self.rejected,
+                "rejected_bytes": self.rejected_bytes,
+                "api_calls_saved": self.rejected,
+                "reasons": dict(self.reasons)
+            }
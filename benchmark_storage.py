@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+セッション・記事データの保存形式ベンチマーク
+uploads/ の既存JSONを圧縮形式へ変換し、サイズ比と読み込み時間を比較する
+
+使い方:
+    python benchmark_storage.py [--repeat 200]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from app_old01 import UPLOAD_FOLDER, ArtifactStore, zstandard
+
+
+def measure(func, repeat: int) -> float:
+    """1回あたりの平均実行時間（ミリ秒）"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def load_json(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存形式のサイズ・読み込み時間を比較")
+    parser.add_argument('--repeat', type=int, default=200, help="読み込みの繰り返し回数")
+    args = parser.parse_args()
+    
+    sources = sorted(
+        name for name in os.listdir(UPLOAD_FOLDER)
+        if name.startswith(('session_', 'article_')) and name.endswith('.json')
+    )
+    if not sources:
+        print("uploads/ にJSONファイルがありません")
+        return
+    
+    codecs = ['gzip'] + (['zstd'] if zstandard else [])
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for codec in codecs:
+            store = ArtifactStore(temp_dir, codec=codec)
+            json_bytes = compact_bytes = 0
+            json_ms = meta_ms = full_ms = 0.0
+            
+            for name in sources:
+                kind, artifact_id = os.path.splitext(name)[0].split('_', 1)
+                source_path = os.path.join(UPLOAD_FOLDER, name)
+                store.save(kind, artifact_id, load_json(source_path))
+                compact_path = store.path(kind, artifact_id)
+                
+                json_bytes += os.path.getsize(source_path)
+                compact_bytes += os.path.getsize(compact_path)
+                json_ms += measure(lambda: load_json(source_path), args.repeat)
+                meta_ms += measure(lambda: store.read_meta(compact_path), args.repeat)
+                full_ms += measure(lambda: store.read(compact_path), args.repeat)
+            
+            count = len(sources)
+            print(f"=== {codec} ({count}ファイル) ===")
+            print(f"JSON合計: {json_bytes:,} bytes")
+            print(f"圧縮形式合計: {compact_bytes:,} bytes (比率 {compact_bytes / json_bytes:.1%})")
+            print(f"読み込み平均 JSON全体: {json_ms / count:.3f}ms")
+            print(f"読み込み平均 メタデータのみ: {meta_ms / count:.3f}ms")
+            print(f"読み込み平均 メタデータ+本文: {full_ms / count:.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文字起こし経路のベンチマーク
+ローカル文字起こし（faster-whisper の int8 量子化モデル）と Whisper API で同じ音声を
+文字起こしし、実時間比（RTF = 処理時間 / 音声の長さ）と最大メモリ（RSS）を比べる
+ワーカー数を変えると、シャード並列での速度向上（ワーカー1に対する倍率）も出す
+
+メモリを経路ごとに正しく測るため、設定ごとに新しいプロセスで実行する。
+音声と同じ名前の .txt（Whisper CLI の出力）があれば、その文字起こしとの一致率も出す。
+
+使い方:
+    python benchmark_transcription.py [uploads/*.m4a] [--models small,base] [--workers 1,2,4] [--threads 0] [--beam-size 5] [--api]
+"""
+
+import argparse
+import difflib
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from audio_utils import probe_file
+from local_transcriber import physical_cpu_count
+
+
+def reference_text(path: str):
+    """音声と同じ名前の .txt（既存の文字起こし）を読む"""
+    reference_path = f"{os.path.splitext(path)[0]}.txt"
+    if not os.path.exists(reference_path):
+        return None
+    with open(reference_path, encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+def similarity(text: str, reference: str) -> float:
+    """空白・改行を除いた文字単位の一致率"""
+    return difflib.SequenceMatcher(None, ''.join(text.split()), ''.join(reference.split()), autojunk=False).ratio()
+
+
+def run_worker(args):
+    """子プロセス側: 1つの設定で全ファイルを文字起こしして結果を JSON で出力"""
+    load_seconds = None
+    if args.worker == 'local':
+        from local_transcriber import LocalTranscriber
+        transcriber = LocalTranscriber(
+            model_size=args.model, threads=args.thread_count, beam_size=args.beam_size, workers=args.worker_count
+        )
+        if not transcriber.available():
+            print(json.dumps({"error": "faster-whisper がインストールされていません"}))
+            return
+        started = time.perf_counter()
+        transcriber.load_model()
+        load_seconds = time.perf_counter() - started
+        transcribe = transcriber.transcribe
+    else:
+        # API の失敗をローカル文字起こしで補うと測定が混ざるので無効にする
+        os.environ['LOCAL_TRANSCRIBE_FALLBACK'] = '0'
+        import app
+        transcribe = app.AudioProcessor().transcribe_audio
+
+    files = []
+    for path in args.files:
+        started = time.perf_counter()
+        result = transcribe(path)
+        elapsed = time.perf_counter() - started
+        probe = probe_file(path) or {}
+        duration = result.get("duration") or probe.get("duration")
+        reference = reference_text(path)
+        files.append({
+            "file": os.path.basename(path),
+            "duration": duration,
+            "elapsed": elapsed,
+            "rtf": elapsed / duration if duration else None,
+            "similarity": similarity(result["text"], reference) if result["success"] and reference else None,
+            "error": None if result["success"] else result["error"]
+        })
+
+    print(json.dumps({
+        "load_seconds": load_seconds,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "files": files
+    }))
+
+
+def run_config(label: str, worker_args: list, files: list):
+    """設定ごとに新しいプロセスで実行して結果を表示（合計の処理時間を返す）"""
+    print(f"\n== {label}")
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *files, *worker_args],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        print(f"  実行に失敗しました（終了コード {completed.returncode}）")
+        return None
+    if report.get("error"):
+        print(f"  {report['error']}")
+        return None
+
+    if report["load_seconds"] is not None:
+        print(f"  モデル読み込み: {report['load_seconds']:.1f}秒")
+    total_audio = total_elapsed = 0.0
+    for item in report["files"]:
+        if item["error"]:
+            print(f"  {item['file']}: エラー: {item['error']}")
+            continue
+        match = f" / 一致率 {item['similarity']:.1%}" if item["similarity"] is not None else ""
+        print(f"  {item['file']}: 音声 {item['duration']:.1f}秒 / 処理 {item['elapsed']:.1f}秒 / RTF {item['rtf']:.3f}{match}")
+        total_audio += item["duration"]
+        total_elapsed += item["elapsed"]
+    if total_audio:
+        print(f"  合計: 音声 {total_audio:.1f}秒 / 処理 {total_elapsed:.1f}秒 / RTF {total_elapsed / total_audio:.3f}")
+    print(f"  最大RSS: {report['max_rss_mb']:.1f}MB")
+    return total_elapsed or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカル文字起こしと Whisper API の実時間比・メモリを比較")
+    parser.add_argument('files', nargs='*', help="音声ファイル（省略時は uploads/ の音声）")
+    parser.add_argument('--models', default='small', help="ローカルモデルのサイズ（カンマ区切り）")
+    parser.add_argument('--workers', default='1', help="並列ワーカー数（カンマ区切り。2以上でシャード並列）")
+    parser.add_argument('--threads', default='0', help="ワーカーあたりの推論スレッド数（カンマ区切り。0: 物理コア数 / ワーカー数）")
+    parser.add_argument('--beam-size', type=int, default=5, help="ビーム幅")
+    parser.add_argument('--api', action='store_true', help="Whisper API でも文字起こしする（OPENAI_API_KEY が必要・課金あり）")
+    parser.add_argument('--worker', choices=['local', 'api'], help=argparse.SUPPRESS)
+    parser.add_argument('--model', help=argparse.SUPPRESS)
+    parser.add_argument('--thread-count', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-count', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    files = args.files or sorted(
+        path for path in glob.glob('uploads/*')
+        if os.path.splitext(path)[1].lower() in ('.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.webm')
+    )
+    if not files:
+        print("音声ファイルがありません")
+        return
+    print(f"対象: {len(files)}ファイル / CPU {os.cpu_count()}コア（物理 {physical_cpu_count()}コア）")
+
+    for model in args.models.split(','):
+        for threads in args.threads.split(','):
+            baseline = None
+            for workers in args.workers.split(','):
+                elapsed = run_config(
+                    f"ローカル: faster-whisper {model}（int8, {workers}ワーカー × {threads if threads != '0' else '自動'}スレッド, ビーム幅 {args.beam_size}）",
+                    ['--worker', 'local', '--model', model, '--thread-count', threads, '--worker-count', workers,
+                     '--beam-size', str(args.beam_size)],
+                    files
+                )
+                if elapsed and int(workers) == 1:
+                    baseline = elapsed
+                elif elapsed and baseline:
+                    print(f"  速度向上: {baseline / elapsed:.2f}倍（{workers}ワーカー / 1ワーカー比）")
+
+    if args.api:
+        run_config("Whisper API", ['--worker', 'api'], files)
+
+
+if __name__ == "__main__":
+    main()
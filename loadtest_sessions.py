@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streamlit版の同時セッション負荷テスト
+複数セッションから同時にジョブを投入し、音声の取り違え（クロストーク）がないことと
+一時ディスクI/O・一時ファイルの残留を確認する
+
+文字起こしAPIはローカルのスタブサーバーに差し替え、受け取った音声の SHA-256 を
+文字起こし結果として返させる。各ジョブの結果が自分の音声のハッシュと一致すれば取り違えなし。
+
+使い方:
+    python loadtest_sessions.py [--sessions 8] [--files 3] [--small-mb 1] [--large-mb 12]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+
+import openai
+
+import app
+
+
+class StubWhisperHandler(BaseHTTPRequestHandler):
+    """受信した音声の SHA-256 を文字起こし結果として返すスタブ"""
+    
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        message = BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('latin-1') + body
+        )
+        audio = next(
+            part.get_payload(decode=True) for part in message.get_payload()
+            if part.get_param('name', header='content-disposition') == 'file'
+        )
+        response = json.dumps({"text": f"sha256:{hashlib.sha256(audio).hexdigest()}"}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+    
+    def log_message(self, *args):
+        pass
+
+
+class FakeUploadedFile(io.BytesIO):
+    """st.file_uploader が返す UploadedFile 相当"""
+    
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+        self.file_id = name
+
+
+def process_io() -> dict:
+    """このプロセスの実ディスクI/O（Linux の /proc/self/io）"""
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except OSError:
+        return {}
+
+
+def temp_entries() -> set:
+    return set(os.listdir(tempfile.gettempdir()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同時セッションでのクロストークと一時ディスクI/Oを測定")
+    parser.add_argument('--sessions', type=int, default=8, help="同時セッション数")
+    parser.add_argument('--files', type=int, default=3, help="セッションあたりのファイル数")
+    parser.add_argument('--small-mb', type=float, default=1, help="小さい音声のサイズ（MB）")
+    parser.add_argument('--large-mb', type=float, default=12, help="大きい音声のサイズ（MB）")
+    args = parser.parse_args()
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubWhisperHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    openai.api_base = f"http://127.0.0.1:{server.server_port}/v1"
+    
+    pipeline_app = app.SuperImprovedApp()
+    expected = {}
+    expected_lock = threading.Lock()
+    
+    def session(index: int):
+        """1セッション分のアップロードとジョブ投入"""
+        for number in range(args.files):
+            size_mb = args.large_mb if (index + number) % 2 else args.small_mb
+            # 同じ秒に同じ拡張子で投入されるよう、名前も揃える
+            uploaded = FakeUploadedFile(os.urandom(int(size_mb * 1024 * 1024)), f"interview_{number}.mp3")
+            file_hash = hashlib.sha256(uploaded.getbuffer()).hexdigest()
+            job_id = pipeline_app.job_manager.submit(
+                pipeline_app._run_pipeline, app.spool_upload(uploaded), uploaded.name, file_hash,
+                {'name': f"店舗{index}", 'interviewee_name': "山田", 'category': "カフェ", 'location': "高松市"},
+                label=f"session{index}/{uploaded.name}"
+            )
+            with expected_lock:
+                expected[job_id] = (file_hash, size_mb)
+    
+    temp_before = temp_entries()
+    io_before = process_io()
+    started = time.perf_counter()
+    
+    threads = [threading.Thread(target=session, args=(index,)) for index in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    while any(pipeline_app.job_manager.get(job_id)['status'] in ('queued', 'running') for job_id in expected):
+        time.sleep(0.05)
+    
+    elapsed = time.perf_counter() - started
+    io_after = process_io()
+    leftovers = temp_entries() - temp_before
+    
+    crosstalk = errors = 0
+    for job_id, (file_hash, _) in expected.items():
+        job = pipeline_app.job_manager.get(job_id)
+        if job['status'] != 'done':
+            errors += 1
+            print(f"エラー: {job['label']}: {job['error']}")
+        elif job['result']['transcription_text'] != f"sha256:{file_hash}":
+            crosstalk += 1
+            print(f"取り違え: {job['label']}")
+    
+    total_mb = sum(size_mb for _, size_mb in expected.values())
+    spooled_mb = sum(size_mb for _, size_mb in expected.values() if size_mb > app.SPOOL_MAX_MEMORY_MB)
+    
+    print(f"ジョブ数: {len(expected)}（{args.sessions}セッション × {args.files}ファイル、並列度 {app.PIPELINE_WORKERS}）")
+    print(f"音声合計: {total_mb:.1f}MB（うち一時ディスクへ退避: {spooled_mb:.1f}MB、閾値 {app.SPOOL_MAX_MEMORY_MB:.0f}MB）")
+    print(f"処理時間: {elapsed:.2f}秒")
+    print(f"取り違え: {crosstalk}件 / エラー: {errors}件")
+    if io_before and io_after:
+        written = (io_after['write_bytes'] - io_before['write_bytes']) / 1024 / 1024
+        read = (io_after['read_bytes'] - io_before['read_bytes']) / 1024 / 1024
+        print(f"ディスクI/O: 書き込み {written:.1f}MB / 読み込み {read:.1f}MB")
+    print(f"最大RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}MB")
+    print(f"残留した一時ファイル: {len(leftovers)}件")
+    
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+CPU向けのローカル文字起こし
+faster-whisper（CTranslate2）の int8 量子化モデルで文字起こしし、Whisper API や
+Whisper CLI（PyTorch の float32 推論）の代わりに使う。モデルは初回利用時に1度だけ
+読み込んでプロセス内で共有する（faster-whisper が無い環境では利用不可として扱う）
+
+ワーカーを複数にすると、長い音声を発話の切れ目（VAD）でシャードに分け、
+モデルのレプリカで並列に文字起こしして時刻順につなぎ直す。
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+try:
+    from faster_whisper import WhisperModel
+    from faster_whisper.audio import decode_audio
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+except ImportError:  # faster-whisper が無い環境ではローカル文字起こしを無効にする
+    WhisperModel = None
+
+logger = logging.getLogger(__name__)
+
+
+def physical_cpu_count() -> int:
+    """使える物理コア数（/proc/cpuinfo から数え、分からなければ論理コア数）"""
+    try:
+        logical = len(os.sched_getaffinity(0))
+    except AttributeError:
+        logical = os.cpu_count() or 1
+    cores = set()
+    try:
+        with open('/proc/cpuinfo') as f:
+            physical_id = None
+            for line in f:
+                key, _, value = line.partition(':')
+                key = key.strip()
+                if key == 'physical id':
+                    physical_id = value.strip()
+                elif key == 'core id':
+                    cores.add((physical_id, value.strip()))
+    except OSError:
+        pass
+    return min(len(cores), logical) if cores else logical
+
+
+# モデルサイズ（tiny / base / small / medium / large-v3 など、または変換済みモデルのディレクトリ）
+LOCAL_WHISPER_MODEL = os.environ.get('LOCAL_WHISPER_MODEL', 'small')
+# 量子化の種類（int8: 重みを8bit整数で保持し、float32 の約1/4のメモリで高速に推論）
+LOCAL_WHISPER_COMPUTE_TYPE = os.environ.get('LOCAL_WHISPER_COMPUTE_TYPE', 'int8')
+# 並列に動かすモデルのレプリカ数（CTranslate2 は CPU ではレプリカ間で重みを共有する）
+# 2以上にすると1つの音声もシャードに分けて並列に文字起こしする
+LOCAL_WHISPER_WORKERS = int(os.environ.get('LOCAL_WHISPER_WORKERS', 1))
+# レプリカあたりの推論スレッド数（0: 物理コア数をワーカー数で割った数。ハイパースレッドは数えない）
+LOCAL_WHISPER_THREADS = int(os.environ.get('LOCAL_WHISPER_THREADS', 0))
+# ビーム幅（Whisper CLI の既定と同じ 5。1 にすると貪欲法で速くなるが精度は少し落ちる）
+LOCAL_WHISPER_BEAM_SIZE = int(os.environ.get('LOCAL_WHISPER_BEAM_SIZE', 5))
+# 無音区間を VAD で飛ばしてデコード量を減らす
+LOCAL_WHISPER_VAD = os.environ.get('LOCAL_WHISPER_VAD', '1') == '1'
+# モデルの保存先（オフライン環境では事前にダウンロードしたディレクトリを指定）
+LOCAL_WHISPER_MODEL_DIR = os.environ.get('LOCAL_WHISPER_MODEL_DIR') or None
+# シャードの最短の長さ（秒）。境界では直前の文脈が引き継がれないので短くしすぎない
+LOCAL_WHISPER_SHARD_SECONDS = float(os.environ.get('LOCAL_WHISPER_SHARD_SECONDS', 60))
+# シャードの境界にできる無音の最短の長さ（ミリ秒）
+SHARD_MIN_SILENCE_MS = 500
+SAMPLE_RATE = 16000
+
+
+class LocalTranscriber:
+    """faster-whisper による CPU 文字起こし（int8 量子化）"""
+
+    def __init__(self, model_size: str = LOCAL_WHISPER_MODEL, threads: int = LOCAL_WHISPER_THREADS,
+                 compute_type: str = LOCAL_WHISPER_COMPUTE_TYPE, beam_size: int = LOCAL_WHISPER_BEAM_SIZE,
+                 vad_filter: bool = LOCAL_WHISPER_VAD, workers: int = LOCAL_WHISPER_WORKERS,
+                 shard_seconds: float = LOCAL_WHISPER_SHARD_SECONDS):
+        self.model_size = model_size
+        self.workers = max(1, workers)
+        self.threads = threads or max(1, physical_cpu_count() // self.workers)
+        self.compute_type = compute_type
+        self.beam_size = beam_size
+        self.vad_filter = vad_filter
+        self.shard_seconds = shard_seconds
+        self._model = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        self.transcriptions = 0
+        self.shards = 0
+        self.audio_seconds = 0.0
+        self.elapsed_seconds = 0.0
+
+    def available(self) -> bool:
+        """faster-whisper が使えるか"""
+        return WhisperModel is not None
+
+    def describe(self) -> str:
+        return f"faster-whisper {self.model_size}（{self.compute_type}, {self.workers}ワーカー × {self.threads}スレッド）"
+
+    def load_model(self):
+        """モデルを読み込む（初回のみ。以降は読み込み済みのモデルを共有）"""
+        with self._lock:
+            if self._model is None:
+                started = time.perf_counter()
+                self._model = WhisperModel(
+                    self.model_size,
+                    device='cpu',
+                    compute_type=self.compute_type,
+                    cpu_threads=self.threads,
+                    num_workers=self.workers,
+                    download_root=LOCAL_WHISPER_MODEL_DIR
+                )
+                self.load_seconds = time.perf_counter() - started
+                logger.info(f"ローカル文字起こしモデル読み込み: {self.describe()} {self.load_seconds:.1f}秒")
+                if self.workers > 1:
+                    # シャードはレプリカ数だけ同時に流す（複数の音声が来てもコア数を超えて詰め込まない）
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='whisper-shard')
+            return self._model
+
+    def transcribe(self, audio, on_segment=None, should_stop=None) -> Dict[str, any]:
+        """音声（パスまたはファイル風オブジェクト）を文字起こし
+
+        on_segment(segment, count) はセグメントが確定するたびに呼ばれる。
+        デコードはセグメントを取り出すたびに進むので、should_stop() が真になれば
+        次のセグメントの前で打ち切る。
+        """
+        if not self.available():
+            return {
+                "success": False,
+                "error": "faster-whisper がインストールされていません（pip install faster-whisper）"
+            }
+
+        try:
+            model = self.load_model()
+            started = time.perf_counter()
+            if self.workers > 1:
+                segments, duration = self._transcribe_sharded(model, audio, on_segment, should_stop)
+            else:
+                segments, duration = self._transcribe_segments(model, audio, 0.0, should_stop, on_segment)
+
+            if segments is None:
+                return {
+                    "success": False,
+                    "cancelled": True,
+                    "error": "文字起こしをキャンセルしました"
+                }
+
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.transcriptions += 1
+                self.audio_seconds += duration
+                self.elapsed_seconds += elapsed
+            logger.info(
+                f"ローカル文字起こし完了: 音声 {duration:.1f}秒 / 処理 {elapsed:.1f}秒"
+                f"（RTF {elapsed / max(duration, 0.001):.2f}, セグメント {len(segments)} 件）"
+            )
+
+            # Whisper CLI の txt 出力と同じく1セグメント1行にする
+            text = '\n'.join(segment["text"] for segment in segments if segment["text"])
+            if not text:
+                return {
+                    "success": False,
+                    "error": "文字起こし結果が空です。音声が明確でない可能性があります。"
+                }
+
+            return {
+                "success": True,
+                "text": text,
+                "language": "ja",
+                "segments": segments,
+                "duration": duration,
+                "elapsed": elapsed
+            }
+
+        except Exception as e:
+            logger.error(f"ローカル文字起こしエラー: {str(e)}")
+            return {
+                "success": False,
+                "error": f"ローカル文字起こしエラー: {str(e)}"
+            }
+
+    def _transcribe_segments(self, model, audio, offset: float, should_stop, on_segment=None):
+        """音声（またはシャード）を文字起こしして (セグメント, 音声の秒数) を返す（キャンセル時のセグメントは None）
+
+        デコードはセグメントを取り出すたびに進むので、止める判定はセグメントごとに行う。
+        """
+        if should_stop and should_stop():
+            return None, 0.0
+        segment_iter, info = model.transcribe(
+            audio,
+            language='ja',
+            beam_size=self.beam_size,
+            vad_filter=self.vad_filter
+        )
+
+        segments = []
+        for item in segment_iter:
+            if should_stop and should_stop():
+                return None, info.duration
+            segment = {"start": offset + item.start, "end": offset + item.end, "text": item.text.strip()}
+            segments.append(segment)
+            if on_segment:
+                on_segment(segment, len(segments))
+        return segments, info.duration
+
+    def _transcribe_sharded(self, model, audio, on_segment, should_stop):
+        """音声をシャードに分けて並列に文字起こしし、時刻順につなぐ"""
+        samples = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+        duration = len(samples) / SAMPLE_RATE
+        shards = plan_shards(samples, self.workers, self.shard_seconds)
+        if len(shards) < 2:
+            return self._transcribe_segments(model, samples, 0.0, should_stop, on_segment)
+
+        logger.info(f"{len(shards)}シャードに分割して{self.workers}並列で文字起こし（音声 {duration:.1f}秒）")
+        with self._lock:
+            self.shards += len(shards)
+
+        # 1つのシャードが失敗・キャンセルしたら残りのシャードも止める
+        stop_event = threading.Event()
+
+        def stopped() -> bool:
+            if should_stop and should_stop():
+                stop_event.set()
+            return stop_event.is_set()
+
+        # シャードは元の配列のビューなので複製しない
+        futures = [
+            self._executor.submit(self._transcribe_segments, model, samples[start:end], start / SAMPLE_RATE, stopped)
+            for start, end in shards
+        ]
+        segments = []
+        try:
+            # 先頭のシャードから順に待ち、確定した分だけ時刻順に通知する
+            for future in futures:
+                shard_segments, _ = future.result()
+                if shard_segments is None:
+                    return None, duration
+                for segment in shard_segments:
+                    segments.append(segment)
+                    if on_segment:
+                        on_segment(segment, len(segments))
+        finally:
+            # 失敗・キャンセルで抜けたときに、残っているシャードを止める
+            stop_event.set()
+            for future in futures:
+                future.cancel()
+        return segments, duration
+
+    def stats(self) -> Dict[str, any]:
+        with self._lock:
+            return {
+                "available": self.available(),
+                "model": self.model_size,
+                "compute_type": self.compute_type,
+                "workers": self.workers,
+                "threads": self.threads,
+                "loaded": self._model is not None,
+                "load_seconds": round(self.load_seconds, 2) if self.load_seconds is not None else None,
+                "transcriptions": self.transcriptions,
+                "shards": self.shards,
+                "audio_seconds": round(self.audio_seconds, 1),
+                "real_time_factor": round(self.elapsed_seconds / self.audio_seconds, 3) if self.audio_seconds else None
+            }
+
+
+def plan_shards(samples, workers: int, min_seconds: float = LOCAL_WHISPER_SHARD_SECONDS) -> List[Tuple[int, int]]:
+    """音声を発話の切れ目でシャードに分ける（(開始, 終了) のサンプル位置のリスト）
+
+    どのワーカーも同じ本数を受け持つよう、ワーカー数の倍数（最大2倍）の本数を目安に分ける。
+    境界は発話と発話の間の無音の中央に置くので、言葉の途中では切れない。
+    """
+    total = len(samples)
+    rounds = min(2, int(total // (workers * min_seconds * SAMPLE_RATE)))
+    target = total / (workers * rounds) if rounds else min_seconds * SAMPLE_RATE
+    if total < target * 1.5:
+        return [(0, total)]
+
+    # 目安より長く続く発話は、VAD が発話中で最も静かな位置で区切る
+    speech = get_speech_timestamps(samples, VadOptions(
+        min_silence_duration_ms=SHARD_MIN_SILENCE_MS,
+        max_speech_duration_s=target / SAMPLE_RATE
+    ))
+    shards = []
+    start = 0
+    for current, following in zip(speech, speech[1:]):
+        if current['end'] - start >= target:
+            cut = (current['end'] + following['start']) // 2
+            shards.append((start, cut))
+            start = cut
+    # 最後が短すぎるときは直前のシャードにまとめる
+    if shards and total - start < target / 2:
+        start = shards.pop()[0]
+    shards.append((start, total))
+    return shards
+
+
+# プロセス内で共有するインスタンス（モデルは初回の文字起こしで読み込む）
+local_transcriber = LocalTranscriber()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+uploads/ の既存音声ファイルをブロブストアへ移行するツール
+同じ内容の音声を1つにまとめ、削減できた容量を表示する
+
+使い方:
+    python migrate_uploads.py            # 移行を実行
+    python migrate_uploads.py --dry-run  # 削減量の見積もりのみ
+"""
+
+import argparse
+
+from app_old01 import UPLOAD_FOLDER, blob_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="uploads/ の音声をブロブストアへ移行")
+    parser.add_argument('--dry-run', action='store_true', help="ファイルを変更せずに削減量だけ計算する")
+    args = parser.parse_args()
+    
+    stats = blob_store.migrate_legacy_uploads(UPLOAD_FOLDER, dry_run=args.dry_run)
+    
+    print("見積もり結果（dry-run）" if args.dry_run else "移行が完了しました")
+    print(f"セッション数: {stats['sessions']}")
+    print(f"移行した音声ファイル: {stats['migrated_files']}")
+    print(f"移行前の容量: {stats['bytes_before'] / 1024 / 1024:.1f}MB")
+    print(f"移行後の容量: {stats['bytes_after'] / 1024 / 1024:.1f}MB")
+    print(f"削減した容量: {stats['bytes_reclaimed'] / 1024 / 1024:.1f}MB ({stats['bytes_reclaimed']} bytes)")
+    
+    if stats["missing_files"]:
+        print(f"⚠ 見つからなかった音声: {', '.join(stats['missing_files'])}")
+    if stats["unreferenced_files"]:
+        print(f"⚠ どのセッションからも参照されていない音声: {', '.join(stats['unreferenced_files'])}")
+
+
+if __name__ == '__main__':
+    main()